@@ -1,49 +1,243 @@
-import anthropic 
-from typing import List, Dict, Generator 
+import asyncio
+import threading
+from typing import List, Dict, Generator, AsyncGenerator
 
 from .gateway import AICompanyGateway
+from .response_cache import cache_response, acache_response
+from .cache_planner import CacheBreakpointPlanner
+from .telemetry import CallMetrics
+from .attachments import Attachment
+from .stream_retry import resume_stream, aresume_stream
+from .stop_signals import watch_stop_signals, awatch_stop_signals
 
+@AICompanyGateway.register()
 class AnthropicGateway (AICompanyGateway): 
     name = 'anthropic' 
+    # places the prompt cache breakpoints on the messages, one is kept for the system prompt if there is one 
+    cache_planner = CacheBreakpointPlanner(max_breakpoints=4) 
+    # the stop_signals of stream_message are sent as stop sequences 
+    native_stop_signals = True 
+    # the Files API is in beta 
+    files_beta = 'files-api-2025-04-14' 
 
-    def setup_client(self, api_key:str) -> None: 
+    def setup_client(self, api_key:str, timeout:float=600.0, connect_timeout:float=10.0, max_retries:int=2, **pool_opts) -> None: 
         """Sets up the client to the AI company SDK 
 
+        The client is thread-safe and keeps its connections alive, so one gateway can be shared by every session 
+
         Args:
             api_key (str): the api key 
+            timeout (float, optional): seconds to wait on a read, write or pool checkout. Defaults to 600.0.
+            connect_timeout (float, optional): seconds to wait while opening a new connection. Defaults to 10.0.
+            max_retries (int, optional): number of retries done by the SDK. Defaults to 2.
+            pool_opts: the connection pool limits (see build_http_client) 
         """
-        self.__client = anthropic.Anthropic(api_key=api_key) 
+        self.__client_opts = {
+            'api_key': api_key,
+            'timeout': self.build_timeout(timeout, connect_timeout),
+            'max_retries': max_retries
+        }
+        self.__pool_opts = pool_opts
+        # the SDK is only imported once a gateway to the AI company is created 
+        import anthropic 
+        self.__http_client = self.build_http_client(anthropic.DefaultHttpxClient, **pool_opts) 
+        self.__client = anthropic.Anthropic(http_client=self.__http_client, **self.__client_opts)
 
+        # the async client is created lazily because its connections belong to the event loop that uses it
+        self.__async_client = None
+        self.__async_client_loop = None
+        self.__async_client_lock = threading.Lock()
 
-    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
-        """Returns a message from the API. Overriden by subclass 
+
+    def get_async_client(self) -> 'anthropic.AsyncAnthropic':
+        """Gets the async client for the running event loop, creating it if the loop changed
+
+        Returns:
+            anthropic.AsyncAnthropic: the async client
+        """
+        import anthropic
+        loop = asyncio.get_running_loop()
+        with self.__async_client_lock:
+            if self.__async_client is None or self.__async_client_loop is not loop:
+                self.__async_client = anthropic.AsyncAnthropic(
+                    http_client=self.build_http_client(anthropic.DefaultAsyncHttpxClient, **self.__pool_opts),
+                    **self.__client_opts
+                )
+                self.__async_client_loop = loop
+            return self.__async_client
+
+
+    def get_connection_stats(self) -> Dict: 
+        """Gets the statistics of the connection pool 
+
+        Returns:
+            Dict: the number of open and idle connections 
+        """
+        return self.read_connection_stats(self.__http_client) 
+
+
+    def close(self) -> None: 
+        """Closes the SDK client and its connection pool"""
+        self.__client.close() 
+
+
+    def upload_file(self, attachment:Attachment) -> str: 
+        """Uploads a document through the Files API 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            str: the id of the uploaded file 
+        """
+        with self.track_request(): 
+            file = self.__client.post(
+                '/v1/files', 
+                cast_to=object, 
+                body={}, 
+                files=[('file', (attachment.name, attachment.get_bytes(), attachment.media_type))], 
+                options={'headers': {'Content-Type': 'multipart/form-data', 'anthropic-beta': self.files_beta}} 
+            ) 
+        return file['id'] 
+
+
+    def get_attachment_blocks(self, attachment:Attachment) -> List[Dict]: 
+        """Gets the content blocks that attach a document to a message, by file id once it has been uploaded 
+
+        If the upload fails, the document is sent inline as base64 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            List[Dict]: the content blocks 
+        """
+        file_id = self.get_file_id(attachment) 
+        if file_id is None: 
+            source = {'type': 'base64', 'media_type': attachment.media_type, 'data': attachment.content} 
+        else: 
+            source = {'type': 'file', 'file_id': file_id} 
+        return [{'type': 'document', 'source': source}] 
+
+
+    def add_file_beta(self, messages:List[Dict], kwargs:Dict) -> None: 
+        """Adds the Files API beta header to a request that references an uploaded file 
 
         Args:
-            model (str): the name of the model 
             messages (List[Dict]): a list of messages of the conversation so far 
-            max_tokens (int): the max number of tokens that can be generated in the chat completion 
-            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+            kwargs (Dict): the keyword arguments of the request 
+        """
+        for msg in messages: 
+            if isinstance(msg['content'], list) and any(block.get('source', {}).get('type') == 'file' for block in msg['content']): 
+                kwargs['extra_headers'] = {**kwargs.get('extra_headers', {}), 'anthropic-beta': self.files_beta} 
+                return 
+
+
+    def get_system(self, system_message:str) -> List[Dict]:
+        """Gets the system blocks for the API, with the system message cached
+
+        Args:
+            system_message (str): the system message, None if there is none
 
         Returns:
-            str: the messsage sent by the API 
+            List[Dict]: the system blocks, or NOT_GIVEN if there is no system message (the API rejects an empty text block)
         """
-        system = [
+        if not system_message:
+            import anthropic
+            return anthropic.NOT_GIVEN
+        return [
             {
                 'type': 'text', 
                 'text': system_message, 
                 'cache_control': {'type': 'ephemeral'}
             }
         ]
-        msg = self.__client.messages.create(
-            model=model, 
-            messages=messages, 
-            max_tokens=max_tokens, 
-            system=system, 
-            **kwargs
-        ) 
+
+
+    def get_messages(self, messages:List[Dict], system_message:str=None) -> List[Dict]: 
+        """Gets the messages for the API, with the prompt cache breakpoints placed by the cache planner 
+
+        Args:
+            messages (List[Dict]): a list of messages of the conversation so far 
+            system_message (str, optional): the system message of the request, whose block takes one of the breakpoints (see get_system). Defaults to None.
+
+        Returns:
+            List[Dict]: the messages with the cache breakpoints 
+        """
+        return self.cache_planner.plan(messages, reserved=1 if system_message else 0) 
+
+
+    def is_retryable(self, error:Exception) -> bool: 
+        """Checks if an error is a connection-level failure, a server error or an overloaded API, which are worth retrying 
+
+        Args:
+            error (Exception): the error 
+
+        Returns:
+            bool: True if the request can be retried. False otherwise 
+        """
+        import anthropic 
+        if isinstance(error, (anthropic.APIConnectionError, anthropic.InternalServerError)): 
+            return True 
+        # errors sent in the middle of a stream come back with the status of the stream 
+        if isinstance(error, anthropic.APIStatusError) and 'overloaded_error' in str(error): 
+            return True 
+        return super().is_retryable(error) 
+
+
+    def record_message_usage(self, msg:'anthropic.types.Message', metrics:CallMetrics) -> None: 
+        """Records the usage and stop reason of a message in the gateway's statistics and in the call's metrics 
+
+        Args:
+            msg (anthropic.types.Message): the message 
+            metrics (CallMetrics): the metrics of the call 
+        """
+        usage = msg.usage 
+        self.record_usage(
+            input_tokens=usage.input_tokens, 
+            cache_read_tokens=usage.cache_read_input_tokens, 
+            cache_write_tokens=usage.cache_creation_input_tokens 
+        )
+        metrics.record_usage(
+            input_tokens=usage.input_tokens, 
+            output_tokens=usage.output_tokens, 
+            cache_read_tokens=usage.cache_read_input_tokens or 0, 
+            cache_write_tokens=usage.cache_creation_input_tokens or 0, 
+            stop_reason=msg.stop_reason, 
+            stop_signal=msg.stop_sequence 
+        )
+
+
+    @cache_response
+    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
+        """Returns a message from the API. Overriden by subclass 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            str: the messsage sent by the API 
+        """
+        # anthropic caches by prefix so it doesn't need a cache key 
+        kwargs.pop('cache_key', None) 
+        self.add_file_beta(messages, kwargs) 
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics: 
+            msg = self.__client.messages.create(
+                model=model, 
+                messages=self.get_messages(messages, system_message), 
+                max_tokens=max_tokens, 
+                system=self.get_system(system_message),
+                **kwargs
+            ) 
+            self.record_message_usage(msg, metrics) 
         return msg.content[0].text 
 
 
+    @watch_stop_signals
+    @resume_stream
     def stream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Generator[str, None, None]: 
         """Streams a message from the API. Overriden by subclass 
 
@@ -56,19 +250,156 @@ class AnthropicGateway (AICompanyGateway):
         Yields:
             Generator[str, None, None]: yields the messages sent by the AI 
         """
-        system = [
-            {
-                'type': 'text', 
-                'text': system_message, 
-                'cache_control': {'type': 'ephemeral'}
-            }
-        ]
-        with self.__client.messages.stream(
+        kwargs.pop('cache_key', None) 
+        cancel = kwargs.pop('cancel', None) 
+        self.add_file_beta(messages, kwargs) 
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics, self.__client.messages.stream(
             model=model, 
-            messages=messages, 
+            messages=self.get_messages(messages, system_message), 
             max_tokens=max_tokens, 
-            system=system, 
+            system=self.get_system(system_message),
             **kwargs
-        ) as stream: 
+        ) as stream, self.close_on_cancel(cancel, stream): 
             for text_delta in stream.text_stream: 
-                yield text_delta 
\ No newline at end of file
+                metrics.record_chunk() 
+                yield text_delta 
+            self.record_message_usage(stream.get_final_message(), metrics) 
+
+
+    def build_batch_request(self, custom_id:str, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Dict: 
+        """Builds one request of a Message Batch 
+
+        Args:
+            custom_id (str): the id that the batch results are keyed by 
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            Dict: the batch request 
+        """
+        kwargs.pop('cache_key', None) 
+        params = {
+            'model': model, 
+            'messages': self.get_messages(messages, system_message), 
+            'max_tokens': max_tokens, 
+            **kwargs 
+        }
+        if system_message: 
+            params['system'] = self.get_system(system_message) 
+        return {'custom_id': custom_id, 'params': params} 
+
+
+    def submit_batch(self, batch_requests:List[Dict]) -> str: 
+        """Submits a Message Batch 
+
+        Args:
+            batch_requests (List[Dict]): the batch requests 
+
+        Returns:
+            str: the id of the batch 
+        """
+        with self.track_request(): 
+            batch = self.__client.messages.batches.create(requests=batch_requests) 
+        return batch.id 
+
+
+    def get_batch_status(self, batch_id:str) -> str: 
+        """Gets the status of a Message Batch 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            str: 'in_progress', 'completed' or 'failed' 
+        """
+        with self.track_request(): 
+            batch = self.__client.messages.batches.retrieve(batch_id) 
+        if batch.processing_status == 'ended': 
+            return 'completed' 
+        if batch.processing_status == 'canceling': 
+            return 'failed' 
+        return 'in_progress' 
+
+
+    def get_batch_results(self, batch_id:str) -> Dict[str, Dict]: 
+        """Gets the results of an ended Message Batch 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            Dict[str, Dict]: maps the custom id of each request to {'content': [the message or None], 'error': [the error or None]} 
+        """
+        results = {} 
+        with self.track_request(): 
+            for row in self.__client.messages.batches.results(batch_id): 
+                if row.result.type == 'succeeded': 
+                    results[row.custom_id] = {'content': row.result.message.content[0].text, 'error': None} 
+                elif row.result.type == 'errored': 
+                    results[row.custom_id] = {'content': None, 'error': str(row.result.error)} 
+                else: 
+                    # the request was canceled or expired 
+                    results[row.custom_id] = {'content': None, 'error': row.result.type} 
+        return results 
+
+
+    @acache_response
+    async def acreate_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Returns a message from the API without blocking the event loop
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            str: the messsage sent by the API 
+        """
+        kwargs.pop('cache_key', None) 
+        self.add_file_beta(messages, kwargs) 
+        async with self.alimit_rate(model, messages, max_tokens, system_message): 
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics: 
+                msg = await self.get_async_client().messages.create(
+                    model=model, 
+                    messages=self.get_messages(messages, system_message), 
+                    max_tokens=max_tokens, 
+                    system=self.get_system(system_message),
+                    **kwargs
+                ) 
+                self.record_message_usage(msg, metrics) 
+        return msg.content[0].text 
+
+
+    @awatch_stop_signals
+    @aresume_stream
+    async def astream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]:
+        """Streams a message from the API without blocking the event loop
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Yields:
+            AsyncGenerator[str, None]: yields the messages sent by the AI
+        """
+        kwargs.pop('cache_key', None) 
+        cancel = kwargs.pop('cancel', None) 
+        self.add_file_beta(messages, kwargs) 
+        async with self.alimit_rate(model, messages, max_tokens, system_message): 
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics: 
+                async with self.get_async_client().messages.stream(
+                    model=model, 
+                    messages=self.get_messages(messages, system_message), 
+                    max_tokens=max_tokens, 
+                    system=self.get_system(system_message),
+                    **kwargs
+                ) as stream:
+                    async for text_delta in self.aiter_until_cancelled(stream.text_stream, cancel):
+                        metrics.record_chunk()
+                        yield text_delta
+                    self.record_message_usage(await stream.get_final_message(), metrics)
\ No newline at end of file
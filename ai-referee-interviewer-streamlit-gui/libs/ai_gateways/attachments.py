@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import io
+import threading
+
+class Attachment:
+    """A document attached to a conversation, such as the uploaded PDF
+
+    Gateways upload it once through their AI company's file API and reference the file id in later requests (see
+    AICompanyGateway.get_attachment_blocks), or send its extracted text if the AI company has no file API
+    """
+
+    # text extracted from the attachments seen by this process, by content hash, so that each PDF is only parsed once
+    __texts = {}
+    __texts_lock = threading.Lock()
+
+    def __init__(self, content:str, name:str='document.pdf', media_type:str='application/pdf') -> None:
+        """Sets up the object
+
+        Args:
+            content (str): the base64 content of the document
+            name (str, optional): the file name of the document. Defaults to 'document.pdf'.
+            media_type (str, optional): the media type of the document. Defaults to 'application/pdf'.
+        """
+        self.content = content
+        self.name = name
+        self.media_type = media_type
+        self.content_hash = hashlib.sha256(content.encode()).hexdigest()
+
+
+    def get_bytes(self) -> bytes:
+        """Gets the raw bytes of the document
+
+        Returns:
+            bytes: the decoded content
+        """
+        return base64.b64decode(self.content)
+
+
+    def get_text(self) -> str:
+        """Gets the text of the document, extracting it the first time it is asked for
+
+        Needs pypdf for PDFs. Returns an empty string if the text can't be extracted
+
+        Returns:
+            str: the text of the document
+        """
+        cls = type(self)
+        with cls.__texts_lock:
+            if self.content_hash in cls.__texts:
+                return cls.__texts[self.content_hash]
+        text = self.extract_text()
+        with cls.__texts_lock:
+            cls.__texts[self.content_hash] = text
+        return text
+
+
+    def extract_text(self) -> str:
+        """Extracts the text of the document
+
+        Returns:
+            str: the text of the document, page by page
+        """
+        if self.media_type != 'application/pdf':
+            return self.get_bytes().decode('utf-8', errors='replace')
+        try:
+            import pypdf
+        except ImportError:
+            return ""
+        try:
+            reader = pypdf.PdfReader(io.BytesIO(self.get_bytes()))
+            return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+        except Exception:
+            return ""
@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator
+
+class TokenBucket:
+    """Bucket that refills at a steady rate up to its capacity, for requests per minute or tokens per minute limits"""
+
+    def __init__(self, per_minute:float) -> None:
+        """Sets up the object
+
+        Args:
+            per_minute (float): the capacity of the bucket, refilled over one minute
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+
+    def get_wait(self, amount:float) -> float:
+        """Gets the seconds until the bucket holds an amount. Amounts above the capacity only wait for a full bucket
+
+        Args:
+            amount (float): the amount to take
+
+        Returns:
+            float: the seconds to wait, 0 if the amount can be taken now
+        """
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+
+    def take(self, amount:float) -> None:
+        """Takes an amount from the bucket, which may go negative for amounts above the capacity
+
+        Args:
+            amount (float): the amount to take
+        """
+        self.level -= amount
+
+
+class RateLimiter:
+    """Requests per minute and tokens per minute limits plus a max number of requests in flight, for one API key and model
+
+    Callers wait until the request fits in every limit instead of sending it and getting a 429 back. Waiting works both
+    from threads (acquire) and from coroutines (aacquire), since Streamlit sessions and the async API share the same limiter
+    """
+
+    # seconds between checks while waiting on the in-flight limit
+    poll_interval = 0.05
+
+    def __init__(self, requests_per_minute:float=None, tokens_per_minute:float=None, max_in_flight:int=None, max_wait:float=60.0) -> None:
+        """Sets up the object
+
+        Args:
+            requests_per_minute (float, optional): the max number of requests per minute. Defaults to None (no limit).
+            tokens_per_minute (float, optional): the max number of input plus max output tokens per minute. Defaults to None (no limit).
+            max_in_flight (int, optional): the max number of requests sent at the same time. Defaults to None (no limit).
+            max_wait (float, optional): seconds a request can wait before giving up. Defaults to 60.0.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+
+        self.__lock = threading.Lock()
+        self.__requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.__tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.__stats = {'in_flight': 0, 'queue_depth': 0, 'max_queue_depth': 0, 'requests': 0, 'waited': 0, 'wait_time': 0.0, 'timeouts': 0}
+
+
+    def try_acquire(self, tokens:int) -> float:
+        """Takes a request and its tokens from the limits if it fits in all of them
+
+        Args:
+            tokens (int): the estimated tokens of the request
+
+        Returns:
+            float: 0 if the request was let through, otherwise the seconds to wait before trying again
+        """
+        with self.__lock:
+            waits = [0.0]
+            if self.max_in_flight is not None and self.__stats['in_flight'] >= self.max_in_flight:
+                waits.append(self.poll_interval)
+            if self.__requests is not None:
+                waits.append(self.__requests.get_wait(1))
+            if self.__tokens is not None:
+                waits.append(self.__tokens.get_wait(tokens))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            if self.__requests is not None:
+                self.__requests.take(1)
+            if self.__tokens is not None:
+                self.__tokens.take(tokens)
+            self.__stats['in_flight'] += 1
+            self.__stats['requests'] += 1
+            return 0.0
+
+
+    def acquire(self, tokens:int=0) -> float:
+        """Waits until a request fits in the limits and takes it from them
+
+        Args:
+            tokens (int, optional): the estimated tokens of the request. Defaults to 0.
+
+        Raises:
+            Exception: raises an exception if the request doesn't fit within max_wait
+
+        Returns:
+            float: the seconds waited
+        """
+        start = time.monotonic()
+        waited = False
+        self.enter_queue()
+        try:
+            while True:
+                wait = self.try_acquire(tokens)
+                if wait == 0:
+                    return self.record_wait(time.monotonic() - start) if waited else 0.0
+                self.check_wait(start, wait)
+                waited = True
+                time.sleep(wait)
+        finally:
+            self.leave_queue()
+
+
+    async def aacquire(self, tokens:int=0) -> float:
+        """Waits until a request fits in the limits and takes it from them, without blocking the event loop
+
+        Args:
+            tokens (int, optional): the estimated tokens of the request. Defaults to 0.
+
+        Raises:
+            Exception: raises an exception if the request doesn't fit within max_wait
+
+        Returns:
+            float: the seconds waited
+        """
+        start = time.monotonic()
+        waited = False
+        self.enter_queue()
+        try:
+            while True:
+                wait = self.try_acquire(tokens)
+                if wait == 0:
+                    return self.record_wait(time.monotonic() - start) if waited else 0.0
+                self.check_wait(start, wait)
+                waited = True
+                await asyncio.sleep(wait)
+        finally:
+            self.leave_queue()
+
+
+    def release(self) -> None:
+        """Frees the in-flight slot of a finished request"""
+        with self.__lock:
+            self.__stats['in_flight'] -= 1
+
+
+    @contextlib.contextmanager
+    def limit(self, tokens:int=0) -> Iterator[None]:
+        """Context manager that holds a request within the limits while it runs
+
+        Args:
+            tokens (int, optional): the estimated tokens of the request. Defaults to 0.
+        """
+        self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    @contextlib.asynccontextmanager
+    async def alimit(self, tokens:int=0) -> AsyncIterator[None]:
+        """Async context manager that holds a request within the limits while it runs
+
+        Args:
+            tokens (int, optional): the estimated tokens of the request. Defaults to 0.
+        """
+        await self.aacquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    def enter_queue(self) -> None:
+        """Counts a request waiting for the limits"""
+        with self.__lock:
+            self.__stats['queue_depth'] += 1
+            self.__stats['max_queue_depth'] = max(self.__stats['max_queue_depth'], self.__stats['queue_depth'])
+
+
+    def leave_queue(self) -> None:
+        """Counts a request that stopped waiting for the limits"""
+        with self.__lock:
+            self.__stats['queue_depth'] -= 1
+
+
+    def check_wait(self, start:float, wait:float) -> None:
+        """Gives up on a request that would wait longer than max_wait
+
+        Args:
+            start (float): the time the request started waiting
+            wait (float): the seconds of the next wait
+
+        Raises:
+            Exception: raises an exception if the request would wait longer than max_wait
+        """
+        if self.max_wait is not None and time.monotonic() - start + wait > self.max_wait:
+            with self.__lock:
+                self.__stats['timeouts'] += 1
+            raise Exception(f"Rate limit: request did not fit within {self.max_wait} seconds")
+
+
+    def record_wait(self, waited:float) -> float:
+        """Counts a request that had to wait for the limits
+
+        Args:
+            waited (float): the seconds waited
+
+        Returns:
+            float: the seconds waited
+        """
+        with self.__lock:
+            self.__stats['waited'] += 1
+            self.__stats['wait_time'] += waited
+        return waited
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the limiter
+
+        Returns:
+            Dict: the requests in flight and waiting (queue depth), the number of requests let through, of requests that had to wait, the total seconds waited and the number of requests that gave up
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+        stats['wait_time'] = round(stats['wait_time'], 3)
+        return stats
@@ -0,0 +1,254 @@
+import collections
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+class ResponseCache:
+    """Content-addressed cache of the messages returned by AICompanyGateway.create_message
+
+    Responses are keyed by a hash of the request, kept in an in-memory LRU and, if a path is given, in a SQLite file
+    so that they survive restarts (e.g. re-running the assessment notebooks)
+    """
+
+    def __init__(self, max_entries:int=256, ttl:float=24 * 60 * 60, path:str=None, max_disk_entries:int=10000, cache_default_sampling:bool=False) -> None:
+        """Sets up the object
+
+        Args:
+            max_entries (int, optional): max number of responses kept in memory. Defaults to 256.
+            ttl (float, optional): seconds a response stays valid for. Defaults to one day.
+            path (str, optional): path to the SQLite file for the on-disk tier. Defaults to None (memory only).
+            max_disk_entries (int, optional): max number of responses kept on disk. Defaults to 10000.
+            cache_default_sampling (bool, optional): whether requests that leave the temperature to the provider's default are cached. That default is usually 1.0, i.e. non-deterministic. Defaults to False.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.cache_default_sampling = cache_default_sampling
+
+        self.__lock = threading.Lock()
+        self.__memory = collections.OrderedDict()
+        self.__stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bypasses': 0}
+
+        self.__db = None
+        if self.path:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self.__db = sqlite3.connect(self.path, check_same_thread=False)
+            self.__db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+            self.__db.commit()
+
+
+    def make_key(self, company:str, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Hashes a request into a cache key
+
+        Args:
+            company (str): the name of the AI company
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str, optional): a system message, if any. Defaults to None.
+
+        Returns:
+            str: the sha256 hex digest of the request
+        """
+        # options that don't change the response aren't part of the key
+        kwargs = {k: v for k, v in kwargs.items() if k not in ('metrics', 'cache_key')}
+        request = {
+            'company': company,
+            'model': model,
+            'system_message': system_message,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'kwargs': kwargs
+        }
+        data = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+    def is_cacheable(self, **kwargs) -> bool:
+        """Checks the cache policy for a request's sampling settings
+
+        Requests that ask for non-deterministic sampling (a temperature above 0, top_p below 1, top_k, or several choices)
+        bypass the cache, since the caller expects a different response each time. So do requests without a temperature,
+        since the providers' default is non-deterministic, unless cache_default_sampling is on
+
+        Returns:
+            bool: True if the response can be cached. False otherwise
+        """
+        temperature = kwargs.get('temperature')
+        top_p = kwargs.get('top_p')
+        if kwargs.get('n', 1) != 1 or kwargs.get('top_k') is not None:
+            return False
+        if temperature is not None and temperature > 0:
+            return False
+        if top_p is not None and top_p < 1:
+            return False
+        if temperature is None and not self.cache_default_sampling:
+            return False
+        return True
+
+
+    def get(self, key:str) -> Optional[str]:
+        """Gets a response from the cache
+
+        Args:
+            key (str): the cache key
+
+        Returns:
+            Optional[str]: the cached response, or None if it isn't cached or has expired
+        """
+        now = time.time()
+        with self.__lock:
+            if key in self.__memory:
+                value, created = self.__memory[key]
+                if now - created <= self.ttl:
+                    self.__memory.move_to_end(key)
+                    self.__stats['memory_hits'] += 1
+                    return value
+                del self.__memory[key]
+
+            if self.__db is not None:
+                row = self.__db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self.__db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self.__db.commit()
+                    # promote it to the memory tier
+                    self.__set_memory(key, row[0], row[1])
+                    self.__stats['disk_hits'] += 1
+                    return row[0]
+
+            self.__stats['misses'] += 1
+            return None
+
+
+    def set(self, key:str, value:str) -> None:
+        """Saves a response to the cache
+
+        Args:
+            key (str): the cache key
+            value (str): the response
+        """
+        now = time.time()
+        with self.__lock:
+            self.__set_memory(key, value, now)
+            if self.__db is not None:
+                self.__db.execute("INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, value, now, now))
+                self.__evict_disk(now)
+                self.__db.commit()
+
+
+    def record_bypass(self) -> None:
+        """Counts a request that bypassed the cache because of the cache policy"""
+        with self.__lock:
+            self.__stats['bypasses'] += 1
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the cache
+
+        Returns:
+            Dict: the hit, miss and bypass counters and the number of entries in each tier
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['memory_entries'] = len(self.__memory)
+            if self.__db is not None:
+                stats['disk_entries'] = self.__db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return stats
+
+
+    def clear(self) -> None:
+        """Removes every response from the cache"""
+        with self.__lock:
+            self.__memory.clear()
+            if self.__db is not None:
+                self.__db.execute("DELETE FROM responses")
+                self.__db.commit()
+
+
+    def __set_memory(self, key:str, value:str, created:float) -> None:
+        """Saves a response to the memory tier, evicting the least recently used responses. Must hold the lock
+
+        Args:
+            key (str): the cache key
+            value (str): the response
+            created (float): the time the response was created
+        """
+        self.__memory[key] = (value, created)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_entries:
+            self.__memory.popitem(last=False)
+
+
+    def __evict_disk(self, now:float) -> None:
+        """Removes expired responses from the disk tier, then the least recently used ones above max_disk_entries. Must hold the lock
+
+        Args:
+            now (float): the current time
+        """
+        self.__db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.__db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+
+def cache_response(create_message:Callable) -> Callable:
+    """Decorator that serves AICompanyGateway.create_message from the gateway's response cache, if it has one
+
+    Args:
+        create_message (Callable): the gateway's create_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(create_message)
+    def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        cache = self.response_cache
+        if cache is None:
+            return create_message(self, model, messages, max_tokens, system_message, **kwargs)
+        if not cache.is_cacheable(**kwargs):
+            cache.record_bypass()
+            return create_message(self, model, messages, max_tokens, system_message, **kwargs)
+
+        # the key is made before the call since some gateways add the system message to the messages
+        key = cache.make_key(self.name, model, messages, max_tokens, system_message, **kwargs)
+        msg = cache.get(key)
+        if msg is None:
+            msg = create_message(self, model, messages, max_tokens, system_message, **kwargs)
+            cache.set(key, msg)
+        return msg
+    return wrapper
+
+
+def acache_response(acreate_message:Callable) -> Callable:
+    """Decorator that serves AICompanyGateway.acreate_message from the gateway's response cache, if it has one
+
+    Args:
+        acreate_message (Callable): the gateway's acreate_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(acreate_message)
+    async def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        cache = self.response_cache
+        if cache is None:
+            return await acreate_message(self, model, messages, max_tokens, system_message, **kwargs)
+        if not cache.is_cacheable(**kwargs):
+            cache.record_bypass()
+            return await acreate_message(self, model, messages, max_tokens, system_message, **kwargs)
+
+        key = cache.make_key(self.name, model, messages, max_tokens, system_message, **kwargs)
+        msg = cache.get(key)
+        if msg is None:
+            msg = await acreate_message(self, model, messages, max_tokens, system_message, **kwargs)
+            cache.set(key, msg)
+        return msg
+    return wrapper
\ No newline at end of file
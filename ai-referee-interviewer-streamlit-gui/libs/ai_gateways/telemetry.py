@@ -0,0 +1,204 @@
+import time
+from typing import Callable, Dict, List
+
+from .cancellation import StreamCancelled
+
+class CallMetrics:
+    """Latency and usage of one call through a gateway
+
+    Pass an instance to create_message or stream_message with the `metrics` keyword to read the metrics of that call once it
+    is done, or register a callback on the gateway with add_metrics_callback to get the metrics of every call
+    """
+
+    def __init__(self) -> None:
+        """Sets up the object"""
+        self.company = None
+        self.model = None
+        self.streamed = False
+        self.start_time = None
+        self.first_chunk_time = None
+        self.last_chunk_time = None
+        self.end_time = None
+        self.chunks = 0
+        self.max_inter_chunk_latency = 0.0
+
+        self.input_tokens = None
+        self.output_tokens = None
+        self.cache_read_tokens = None
+        self.cache_write_tokens = None
+        self.stop_reason = None
+        # the reserved stop signal that ended the message, if any (see the stop_signals keyword of stream_message)
+        self.stop_signal = None
+        self.error = None
+        # the route that won, for calls hedged over several gateways
+        self.route = None
+        # the number of times the call was retried after a connection failure
+        self.retries = 0
+        # the main model of a call sent to a fast model by a ModelRouter, the reason, and the seconds it saved
+        self.routed_from = None
+        self.routing = None
+        self.latency_saved = None
+        # who closed the stream before the model was done ('user' or 'stop_signal'), and the output tokens it saved
+        self.cancelled_by = None
+        self.tokens_saved = None
+
+        self.__callbacks = []
+        # set while resume_stream retries the call, so that the callbacks are only called once the last attempt is done
+        self.__in_attempts = False
+        # the output tokens of the attempts that failed before the current one
+        self.__prior_output_tokens = 0
+
+
+    def start(self, company:str, model:str, streamed:bool, callbacks:List[Callable[['CallMetrics'], None]]=None) -> 'CallMetrics':
+        """Starts timing the call
+
+        Args:
+            company (str): the name of the AI company
+            model (str): the name of the model
+            streamed (bool): whether the message is streamed
+            callbacks (List[Callable[[CallMetrics], None]], optional): functions called with the metrics when the call is done. Defaults to None.
+
+        Returns:
+            CallMetrics: the metrics object itself
+        """
+        self.company = company
+        self.model = model
+        self.streamed = streamed
+        # a retried call keeps timing from its first attempt
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        self.__callbacks = list(callbacks or [])
+        return self
+
+
+    def record_chunk(self) -> None:
+        """Records the arrival of a streamed chunk of text"""
+        now = time.perf_counter()
+        if self.first_chunk_time is None:
+            self.first_chunk_time = now
+        else:
+            self.max_inter_chunk_latency = max(self.max_inter_chunk_latency, now - self.last_chunk_time)
+        self.last_chunk_time = now
+        self.chunks += 1
+
+
+    def record_usage(self, input_tokens:int=None, output_tokens:int=None, cache_read_tokens:int=None, cache_write_tokens:int=None, stop_reason:str=None, stop_signal:str=None) -> None:
+        """Records the usage reported by the API
+
+        Args:
+            input_tokens (int, optional): the input tokens that were neither read from nor written to the cache. Defaults to None.
+            output_tokens (int, optional): the output tokens. Defaults to None.
+            cache_read_tokens (int, optional): the input tokens read from the cache. Defaults to None.
+            cache_write_tokens (int, optional): the input tokens written to the cache. Defaults to None.
+            stop_reason (str, optional): why the model stopped generating. Defaults to None.
+            stop_signal (str, optional): the stop signal or stop sequence that ended the message. Defaults to None.
+        """
+        if input_tokens is not None:
+            self.input_tokens = input_tokens
+        if output_tokens is not None:
+            self.output_tokens = self.__prior_output_tokens + output_tokens
+        if cache_read_tokens is not None:
+            self.cache_read_tokens = cache_read_tokens
+        if cache_write_tokens is not None:
+            self.cache_write_tokens = cache_write_tokens
+        if stop_reason is not None:
+            self.stop_reason = stop_reason
+        if stop_signal is not None:
+            self.stop_signal = stop_signal
+
+
+    def __enter__(self) -> 'CallMetrics':
+        return self
+
+
+    def __exit__(self, exc_type:type, exc:BaseException, tb:object) -> None:
+        """Finishes timing the call and hands the metrics to the callbacks
+
+        A stream closed by its consumer before the end (GeneratorExit) or cancelled with a CancelToken (StreamCancelled) is
+        recorded as 'cancelled', any other exception as 'error'
+        """
+        self.end_time = time.perf_counter()
+        if exc_type is GeneratorExit:
+            self.stop_reason = self.stop_reason or 'cancelled'
+        elif exc_type is not None and issubclass(exc_type, StreamCancelled):
+            self.stop_reason = 'cancelled'
+            self.cancelled_by = self.cancelled_by or str(exc)
+        elif exc_type is not None:
+            self.stop_reason = 'error'
+            self.error = repr(exc)
+        if not self.__in_attempts:
+            self.call_callbacks()
+
+
+    def call_callbacks(self) -> None:
+        """Hands the metrics to the callbacks"""
+        for callback in self.__callbacks:
+            try:
+                callback(self)
+            except Exception:
+                # metrics must never break a call
+                pass
+
+
+    def begin_attempts(self) -> None:
+        """Marks the call as retried by attempts (see resume_stream): the output tokens of the attempts add up, and the
+        callbacks are called once, by end_attempts
+        """
+        self.__in_attempts = True
+
+
+    def next_attempt(self, written_tokens:int) -> None:
+        """Closes an attempt that failed, before the call is retried
+
+        Args:
+            written_tokens (int): the output tokens the attempt streamed, used if the API didn't report its usage
+        """
+        self.__prior_output_tokens = self.output_tokens if self.output_tokens is not None else self.__prior_output_tokens + written_tokens
+        self.output_tokens = self.__prior_output_tokens or None
+        # the call goes on, so the failure of the attempt isn't the outcome of the call
+        self.error = None
+        self.stop_reason = None
+
+
+    def end_attempts(self) -> None:
+        """Ends a call retried by attempts, calling the callbacks with the metrics of the whole call"""
+        if self.__in_attempts:
+            self.__in_attempts = False
+            self.call_callbacks()
+
+
+    def to_dict(self) -> Dict:
+        """Gets the metrics as a flat dict, with times in seconds
+
+        Returns:
+            Dict: the metrics
+        """
+        def _round(x:float) -> float:
+            return round(x, 4) if x is not None else None
+
+        ttft = self.first_chunk_time - self.start_time if self.first_chunk_time is not None else None
+        duration = (self.end_time or time.perf_counter()) - self.start_time if self.start_time is not None else None
+        mean_inter_chunk_latency = None
+        if self.chunks > 1:
+            mean_inter_chunk_latency = (self.last_chunk_time - self.first_chunk_time) / (self.chunks - 1)
+        return {
+            'company': self.company,
+            'model': self.model,
+            'time_to_first_token': _round(ttft),
+            'mean_inter_token_latency': _round(mean_inter_chunk_latency),
+            'max_inter_token_latency': _round(self.max_inter_chunk_latency) if self.chunks > 1 else None,
+            'duration': _round(duration),
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_read_tokens': self.cache_read_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
+            'stop_reason': self.stop_reason,
+            'stop_signal': self.stop_signal,
+            'route': self.route,
+            'retries': self.retries,
+            'routed_from': self.routed_from,
+            'routing': self.routing,
+            'latency_saved': self.latency_saved,
+            'cancelled_by': self.cancelled_by,
+            'tokens_saved': self.tokens_saved
+        }
\ No newline at end of file
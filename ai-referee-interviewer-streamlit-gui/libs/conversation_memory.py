@@ -0,0 +1,185 @@
+import concurrent.futures
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Tuple
+
+# prompt that rolls the summary forward, filled in with the previous summary and the transcript of the turns to add
+CONDENSE_PROMPT = """Below are the summary of an earlier part of a conversation between an AI interviewer (ASSISTANT) and a respondent (USER), and the transcript of the turns that came after it.
+
+Write an updated summary that replaces both. Keep every fact, answer, number, decision and commitment the respondent gave, and note which questions or themes are finished. Be concise and factual, use bullet points, and do not add anything that is not in the text.
+
+<summary>
+{summary}
+</summary>
+
+<transcript>
+{transcript}
+</transcript>"""
+
+class ConversationMemory:
+    """Rolling memory of a long conversation: older, completed turns are condensed into a summary that is sent to the AI
+    in place of the raw turns
+
+    The summary is rolled forward in the background (previous summary + the turns since then -> new summary), so the chat
+    turn never waits for it. Until a condensation is done, the raw turns are sent as before. The transcript itself is
+    never changed, so the full transcript is still saved
+    """
+
+    # one pool of workers for every session of the process
+    __executor = None
+    __executor_lock = threading.Lock()
+
+    def __init__(self, keep_turns:int=8, condense_every:int=6, phase_boundary:str=None, max_workers:int=2) -> None:
+        """Sets up the object
+
+        Args:
+            keep_turns (int, optional): the number of most recent transcript rows that are always sent raw. Defaults to 8.
+            condense_every (int, optional): the number of rows beyond keep_turns that triggers a condensation. Defaults to 6.
+            phase_boundary (str, optional): regex of an assistant message that closes a phase (e.g. a finished theme), condensations then only end at such a message. Defaults to None (any assistant message).
+            max_workers (int, optional): the number of condensations run at the same time by the process, set by the first session. Defaults to 2.
+        """
+        self.keep_turns = keep_turns
+        self.condense_every = condense_every
+        self.phase_boundary = re.compile(phase_boundary, re.IGNORECASE) if phase_boundary else None
+        self.max_workers = max_workers
+
+        self.__lock = threading.Lock()
+        # the summary and the rows it covers, identified by the time of its last row
+        self.__summary = None
+        self.__covered = 0
+        self.__covered_time = None
+        self.__future = None
+        self.__stats = {'condensations': 0, 'failed': 0, 'rows_condensed': 0}
+        # the failures of the worker thread, until the session logs them (see pop_errors)
+        self.__errors = []
+
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Gets the pool of workers shared by every session, creating it the first time
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: the pool of workers
+        """
+        with ConversationMemory.__executor_lock:
+            if ConversationMemory.__executor is None:
+                ConversationMemory.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='memory')
+            return ConversationMemory.__executor
+
+
+    def check_transcript(self, transcript_history:List[Dict]) -> None:
+        """Forgets the summary if the transcript is no longer the one it was made from, e.g. after a restart or a loaded session
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+        """
+        with self.__lock:
+            if self.__covered == 0:
+                return
+            if len(transcript_history) < self.__covered or transcript_history[self.__covered - 1].get('time') != self.__covered_time:
+                self.__summary, self.__covered, self.__covered_time = None, 0, None
+
+
+    def get_rows(self, transcript_history:List[Dict]) -> Tuple[str, List[Dict]]:
+        """Gets the summary of the condensed rows and the rows after them
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+
+        Returns:
+            Tuple[str, List[Dict]]: the summary (None if nothing is condensed yet), and the rows to send raw
+        """
+        self.check_transcript(transcript_history)
+        with self.__lock:
+            return self.__summary, transcript_history[self.__covered:]
+
+
+    def get_condense_end(self, transcript_history:List[Dict]) -> int:
+        """Gets the end of the rows to condense next: the last assistant row (closing a phase) before the kept turns
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+
+        Returns:
+            int: the number of rows the next summary covers, or 0 if it isn't time to condense yet
+        """
+        last = len(transcript_history) - self.keep_turns
+        if last - self.__covered < self.condense_every:
+            return 0
+        for end in range(last, self.__covered, -1):
+            row = transcript_history[end - 1]
+            if row['role'] == 'assistant' and (self.phase_boundary is None or self.phase_boundary.search(row['content'])):
+                return end
+        return 0
+
+
+    def update(self, transcript_history:List[Dict], condense:Callable[[str, List[Dict]], str]) -> bool:
+        """Starts condensing the rows that are due in the background, unless a condensation is already running
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+            condense (Callable[[str, List[Dict]], str]): the function that makes the new summary from the previous summary (None at first) and the rows to add. It runs in a worker thread, so it can't use the session state
+
+        Returns:
+            bool: True if a condensation was started. False otherwise
+        """
+        self.check_transcript(transcript_history)
+        with self.__lock:
+            if self.__future is not None and not self.__future.done():
+                return False
+            end = self.get_condense_end(transcript_history)
+            if end == 0:
+                return False
+            start, summary = self.__covered, self.__summary
+            rows = [dict(row) for row in transcript_history[start:end]]
+            end_time = transcript_history[end - 1].get('time')
+            self.__future = self.get_executor().submit(self.condense, condense, summary, rows, start, end, end_time)
+            return True
+
+
+    def condense(self, condense:Callable[[str, List[Dict]], str], summary:str, rows:List[Dict], start:int, end:int, end_time:str) -> None:
+        """Makes the new summary and swaps it in, if the memory hasn't moved on since it was started. Runs in a worker thread
+
+        Args:
+            condense (Callable[[str, List[Dict]], str]): the function that makes the new summary
+            summary (str): the previous summary
+            rows (List[Dict]): the rows to add to it
+            start (int): the number of rows the previous summary covers
+            end (int): the number of rows the new summary covers
+            end_time (str): the time of the last row the new summary covers
+        """
+        try:
+            new_summary = condense(summary, rows)
+        except Exception as e:
+            logging.getLogger(__name__).exception(f"Condensing {len(rows)} rows into the conversation memory failed")
+            with self.__lock:
+                self.__stats['failed'] += 1
+                self.__errors.append(f"condensing rows {start}-{end} failed: {e!r}")
+            return
+        with self.__lock:
+            if self.__covered != start or not new_summary:
+                return
+            self.__summary, self.__covered, self.__covered_time = new_summary, end, end_time
+            self.__stats['condensations'] += 1
+            self.__stats['rows_condensed'] += len(rows)
+
+
+    def pop_errors(self) -> List[str]:
+        """Gets the failures of the condensations since the last call, for the session log
+
+        Returns:
+            List[str]: the failures
+        """
+        with self.__lock:
+            errors, self.__errors = self.__errors, []
+        return errors
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the memory
+
+        Returns:
+            Dict: the number of rows covered by the summary, the number of condensations done and failed, and the number of rows condensed
+        """
+        with self.__lock:
+            return {'covered': self.__covered, **self.__stats}
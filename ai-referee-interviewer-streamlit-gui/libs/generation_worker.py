@@ -0,0 +1,201 @@
+import concurrent.futures
+import threading
+from typing import Iterable, Tuple
+
+from .ai_gateways.telemetry import CallMetrics
+from .ai_gateways.cancellation import CancelToken, StreamCancelled
+
+class Generation:
+    """One AI message being generated in the background: a thread-safe buffer of the streamed text"""
+
+    def __init__(self, metrics:CallMetrics=None, cancel:CancelToken=None) -> None:
+        """Sets up the object
+
+        Args:
+            metrics (CallMetrics, optional): the metrics of the call that streams the message. Defaults to None.
+            cancel (CancelToken, optional): the token passed to stream_message, which closes its HTTP stream on cancel. Defaults to None (a new token, checked between deltas).
+        """
+        self.metrics = metrics
+        self.cancel_token = cancel or CancelToken()
+        self.__lock = threading.Lock()
+        self.__deltas = []
+        self.__done = threading.Event()
+        self.error = None
+
+
+    def append(self, delta:str) -> None:
+        """Adds a delta of the stream. Called by the worker
+
+        Args:
+            delta (str): the delta
+        """
+        with self.__lock:
+            self.__deltas.append(delta)
+
+
+    def finish(self, error:Exception=None) -> None:
+        """Marks the message as done. Called by the worker
+
+        Args:
+            error (Exception, optional): the error that ended the stream. Defaults to None.
+        """
+        self.error = error
+        self.__done.set()
+
+
+    def read(self) -> Tuple[str, bool]:
+        """Gets the text streamed so far
+
+        Returns:
+            Tuple[str, bool]: the text, and whether the message is done
+        """
+        done = self.__done.is_set()
+        with self.__lock:
+            if len(self.__deltas) > 1:
+                # join once, so that the next read starts from one string
+                self.__deltas = ["".join(self.__deltas)]
+            return (self.__deltas[0] if self.__deltas else ""), done
+
+
+    def cancel(self, reason:str='user') -> None:
+        """Stops the stream, closing its HTTP response at once if it was started with the token of this message
+
+        Args:
+            reason (str, optional): who cancelled the message, recorded in the metrics of its call. Defaults to 'user'.
+        """
+        self.cancel_token.cancel(reason)
+
+
+    def is_cancelled(self) -> bool:
+        """Tells whether the message was cancelled
+
+        Returns:
+            bool: True if cancel was called
+        """
+        return self.cancel_token.is_cancelled()
+
+
+    def wait(self, timeout:float=None) -> bool:
+        """Waits for the message to be done
+
+        Args:
+            timeout (float, optional): the max seconds to wait. Defaults to None (wait until it is done).
+
+        Returns:
+            bool: True if the message is done
+        """
+        return self.__done.wait(timeout)
+
+
+class GenerationWorker:
+    """Streams the AI messages of a session in a background thread, decoupled from the Streamlit script run
+
+    The worker owns the gateway stream and writes its deltas into a Generation, which the UI reads from a fragment that
+    reruns on a timer. The stream doesn't depend on the script run, so it goes on through reruns and widget interactions,
+    and the script thread is free while the AI writes
+    """
+
+    # one pool of workers for every session of the process, which bounds the streams running at the same time
+    __executor = None
+    __executor_lock = threading.Lock()
+
+    def __init__(self, max_workers:int=32) -> None:
+        """Sets up the object
+
+        Args:
+            max_workers (int, optional): the number of messages streamed at the same time by the process, set by the first session. Defaults to 32.
+        """
+        self.max_workers = max_workers
+        self.__lock = threading.Lock()
+        self.__generation = None
+
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Gets the pool of workers shared by every session, creating it the first time
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: the pool of workers
+        """
+        with GenerationWorker.__executor_lock:
+            if GenerationWorker.__executor is None:
+                GenerationWorker.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='generation')
+            return GenerationWorker.__executor
+
+
+    def start(self, stream:Iterable[str], metrics:CallMetrics=None, cancel:CancelToken=None) -> Generation:
+        """Starts streaming a message in the background, cancelling the message before it if it is still running
+
+        Args:
+            stream (Iterable[str]): the stream from AICompanyGateway.stream_message. It is consumed in a worker thread, so it must be created (and its request built from the session state) beforehand
+            metrics (CallMetrics, optional): the metrics of the call, filled in by the stream. Defaults to None.
+            cancel (CancelToken, optional): the token the stream was created with (its `cancel` keyword). Defaults to None.
+
+        Returns:
+            Generation: the message being generated
+        """
+        generation = Generation(metrics=metrics, cancel=cancel)
+        with self.__lock:
+            if self.__generation is not None:
+                self.__generation.cancel('replaced')
+            self.__generation = generation
+        self.get_executor().submit(self.run, generation, stream)
+        return generation
+
+
+    @staticmethod
+    def run(generation:Generation, stream:Iterable[str]) -> None:
+        """Streams a message into its Generation until it ends or is cancelled. Runs in a worker thread
+
+        Args:
+            generation (Generation): the message
+            stream (Iterable[str]): the stream of deltas
+        """
+        error = None
+        try:
+            if not generation.is_cancelled():
+                for delta in stream:
+                    if generation.is_cancelled():
+                        if generation.metrics is not None:
+                            generation.metrics.cancelled_by = generation.cancel_token.reason
+                        break
+                    if delta:
+                        generation.append(delta)
+        except StreamCancelled:
+            # the text streamed until the cancel is kept
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            # closing the stream ends the call, so that its metrics are final before the message is done
+            if hasattr(stream, 'close'):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            generation.finish(error)
+
+
+    def get(self) -> Generation:
+        """Gets the message of the session that is being generated or hasn't been collected yet
+
+        Returns:
+            Generation: the message, or None if there is none
+        """
+        with self.__lock:
+            return self.__generation
+
+
+    def clear(self, cancel:bool=False) -> Generation:
+        """Removes the message of the session, once the UI collected it
+
+        Args:
+            cancel (bool, optional): whether to also stop its stream, e.g. on a restart. Defaults to False.
+
+        Returns:
+            Generation: the message removed, or None if there was none
+        """
+        with self.__lock:
+            generation, self.__generation = self.__generation, None
+        if cancel and generation is not None:
+            generation.cancel('reset')
+        return generation
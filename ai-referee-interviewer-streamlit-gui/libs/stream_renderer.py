@@ -0,0 +1,142 @@
+import re
+from typing import Dict
+
+FENCE_PATTERN = re.compile(r"^[ \t]*(```|~~~)", re.MULTILINE)
+
+class StreamRenderer:
+    """Renders a message streamed by the background worker, on every run of the fragment that polls it
+
+    A fragment run redraws all of its elements, so the renderer is kept across the runs (one per message) and is only fed
+    the text that is new since the last run. Every finished block (a paragraph, list or table that is followed by a blank
+    line outside a code fence) is split off once and kept as it is, and only the block being written is cut again, at a
+    safe markdown boundary, so that half a table row, an unclosed emphasis or link, or an unclosed code fence never
+    flickers on the screen. The work of a run then doesn't grow with the length of the message, only the markdown sent
+    to the browser does. The frame rate is the poll interval of the fragment
+    """
+
+    def __init__(self, cursor:str="▌") -> None:
+        """Sets up the object
+
+        Args:
+            cursor (str, optional): the text shown at the end of the message while it streams. Defaults to "▌".
+        """
+        self.cursor = cursor
+
+        self.text = ""
+        # the characters of text split off as finished blocks, and their markdown
+        self.done = 0
+        self.blocks = []
+        self.__stats = {'chunks': 0, 'renders': 0, 'blocks': 0, 'chars_rendered': 0}
+
+
+    def add(self, chunk:str) -> None:
+        """Adds the text streamed since the last call, splitting off the blocks it finishes
+
+        Args:
+            chunk (str): the new text, empty or None chunks are dropped
+        """
+        if not chunk:
+            return
+        self.text += chunk
+        self.__stats['chunks'] += 1
+        end = self.get_block_end(self.text, self.done)
+        if end > self.done:
+            self.blocks.append(self.text[self.done:end].rstrip())
+            self.done = end
+            self.__stats['blocks'] += 1
+
+
+    def render(self, placeholder:object) -> None:
+        """Renders the finished blocks, then the safe part of the block being written
+
+        Args:
+            placeholder (object): the st.empty() placeholder of the message, made by the current run of the fragment
+        """
+        container = placeholder.container()
+        for block in self.blocks:
+            self.write(container, block)
+        # the cursor is shown even before the first safe text, so that the message is seen being written
+        self.write(container, self.get_safe_text(self.text[self.done:]) + self.cursor)
+        self.__stats['renders'] += 1
+
+
+    def write(self, container:object, text:str) -> None:
+        """Renders text as a new element of the container
+
+        Args:
+            container (object): the container of the message
+            text (str): the markdown
+        """
+        container.markdown(text)
+        self.__stats['chars_rendered'] += len(text)
+
+
+    @staticmethod
+    def get_block_end(text:str, start:int) -> int:
+        """Gets the end of the finished blocks of the text after start: its last blank line outside a code fence that is
+        followed by an unindented line (so that the continuation of a list item stays in its block)
+
+        Args:
+            text (str): the text so far
+            start (int): the start of the block being written
+
+        Returns:
+            int: the index after the blank line, or start if no block is finished
+        """
+        end = start
+        in_fence = False
+        pos = start
+        for line in text[start:].splitlines(keepends=True):
+            if FENCE_PATTERN.match(line):
+                in_fence = not in_fence
+            pos += len(line)
+            if not in_fence and not line.strip() and line.endswith("\n") and pos < len(text) and not text[pos].isspace():
+                end = pos
+        return end
+
+
+    @staticmethod
+    def get_safe_text(tail:str) -> str:
+        """Cuts the block being written at a safe markdown boundary
+
+        Args:
+            tail (str): the text of the block being written
+
+        Returns:
+            str: the part of the block that can be rendered
+        """
+        fences = list(FENCE_PATTERN.finditer(tail))
+        if len(fences) % 2 == 1:
+            opening = fences[-1].start()
+            if "\n" not in tail[opening:]:
+                # the opening line of the fence isn't whole yet
+                return tail[:opening]
+            # inside a code fence, show the whole lines with the fence closed (the cursor goes below it)
+            return tail[:tail.rfind("\n") + 1] + fences[-1].group(1) + "\n"
+
+        # a whole word
+        cut = max(tail.rfind(" "), tail.rfind("\n"))
+        if cut < 0:
+            return ""
+        safe = tail[:cut + 1]
+        line_start = safe.rfind("\n") + 1
+        line = safe[line_start:]
+        if line.lstrip().startswith("|"):
+            # a table row is only shown once it is whole
+            return safe[:line_start]
+        for marker in ("**", "__", "`"):
+            if line.count(marker) % 2 == 1:
+                return safe[:line_start + line.rfind(marker)]
+        bracket = line.rfind("[")
+        if bracket >= 0 and ")" not in line[bracket:]:
+            return safe[:line_start + bracket]
+        return safe
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the renderer
+
+        Returns:
+            Dict: the number of chunks received, of renders, of finished blocks and of characters sent to the screen
+        """
+        return dict(self.__stats)
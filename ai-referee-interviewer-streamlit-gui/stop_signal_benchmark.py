@@ -0,0 +1,111 @@
+"""Micro-benchmark of the closing-code detection on a streamed message
+
+Compares the StopSignalMatcher of the gateways, which reads each delta once, with the check the app used to run on every
+chunk: lower-casing the whole message so far and looking for every closing code and closing message in it. The stream is
+made of random words without any closing code, i.e. the worst case, where the whole message has to be read
+
+Run it from this folder:
+
+    python stop_signal_benchmark.py                        # a 10k-character stream in 4-character deltas
+    python stop_signal_benchmark.py --chars 50000 --delta 8
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import config
+from libs.ai_gateways.stop_signals import StopSignalMatcher
+
+WORDS = "the report the paper method results data model evidence we should could identification robustness and of to in".split()
+
+
+def make_deltas(chars:int, delta:int, seed:int=0) -> List[str]:
+    """Makes a stream of random words without any closing code
+
+    Args:
+        chars (int): the length of the message
+        delta (int): the length of each delta
+        seed (int, optional): the seed of the random words. Defaults to 0.
+
+    Returns:
+        List[str]: the deltas
+    """
+    rng = random.Random(seed)
+    text = ""
+    while len(text) < chars:
+        text += rng.choice(WORDS) + " "
+    text = text[:chars]
+    return [text[i:i + delta] for i in range(0, len(text), delta)]
+
+
+def rescan(deltas:List[str], closing_messages:Dict[str, str]) -> None:
+    """Checks the whole message so far on every delta, like the app used to
+
+    Args:
+        deltas (List[str]): the deltas of the stream
+        closing_messages (Dict[str, str]): the closing codes and messages
+    """
+    msg_so_far = ""
+    for delta in deltas:
+        msg_so_far += delta
+        for c, m in closing_messages.items():
+            if c.lower() in msg_so_far.lower() or m.lower() in msg_so_far.lower():
+                return
+
+
+def automaton(deltas:List[str], closing_messages:Dict[str, str]) -> None:
+    """Feeds every delta to a StopSignalMatcher
+
+    Args:
+        deltas (List[str]): the deltas of the stream
+        closing_messages (Dict[str, str]): the closing codes and messages
+    """
+    matcher = StopSignalMatcher(list(closing_messages.keys()) + list(closing_messages.values()))
+    msg_so_far = ""
+    for delta in deltas:
+        text, signal = matcher.feed(delta)
+        msg_so_far += text
+        if signal is not None:
+            return
+    msg_so_far += matcher.flush()
+
+
+def measure(scan:Callable[[List[str], Dict[str, str]], None], deltas:List[str], repeats:int) -> Dict:
+    """Measures the seconds a scan of the whole stream takes
+
+    Args:
+        scan (Callable[[List[str], Dict[str, str]], None]): the scan
+        deltas (List[str]): the deltas of the stream
+        repeats (int): the number of runs
+
+    Returns:
+        Dict: the median and min seconds of a run, and the median microseconds per delta
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        scan(deltas, config.CLOSING_MESSAGES)
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {'median': median, 'min': min(timings), 'per_delta_us': median / len(deltas) * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures the closing-code detection on a streamed message")
+    parser.add_argument('--chars', type=int, default=10000, help="length of the streamed message")
+    parser.add_argument('--delta', type=int, default=4, help="length of each delta")
+    parser.add_argument('--repeats', type=int, default=20, help="number of runs per scan")
+    args = parser.parse_args()
+
+    deltas = make_deltas(args.chars, args.delta)
+    print(f"{args.chars} characters in {len(deltas)} deltas, {len(config.CLOSING_MESSAGES)} closing codes and messages")
+    results = {name: measure(scan, deltas, args.repeats) for name, scan in (('rescan', rescan), ('automaton', automaton))}
+    for name, result in results.items():
+        print(f"  {name}: {result['median'] * 1e3:.2f}ms (min {result['min'] * 1e3:.2f}ms), {result['per_delta_us']:.2f}us per delta")
+    print(f"  speedup: {results['rescan']['median'] / results['automaton']['median']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
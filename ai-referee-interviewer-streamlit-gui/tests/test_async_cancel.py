@@ -0,0 +1,132 @@
+"""Tests that a CancelToken passed to astream_message closes the stream at once, for every gateway
+
+The Anthropic and OpenAI SDKs stream from an httpx mock transport that sends a chunk every half second, so no API key
+or network is needed. Run it from the app's folder:
+
+    python -m unittest discover tests
+"""
+import asyncio
+import json
+import threading
+import time
+import unittest
+from typing import List, Tuple
+
+import httpx
+
+from libs.ai_gateways.gateway import AICompanyGateway
+from libs.ai_gateways.cancellation import CancelToken, StreamCancelled
+
+# seconds between two chunks of the mock server, and the number of chunks it would send if it isn't cancelled
+CHUNK_INTERVAL = 0.5
+CHUNKS = 20
+
+
+def get_anthropic_events() -> Tuple[List[str], str]:
+    """Gets the server-sent events of an Anthropic message stream
+
+    Returns:
+        Tuple[List[str], str]: the events of the head of the stream, and the event of each text delta
+    """
+    message = {
+        'id': 'msg_test', 'type': 'message', 'role': 'assistant', 'model': 'test', 'content': [],
+        'stop_reason': None, 'stop_sequence': None, 'usage': {'input_tokens': 1, 'output_tokens': 1}
+    }
+    head = [
+        ('message_start', {'type': 'message_start', 'message': message}),
+        ('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+    ]
+    delta = ('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': 'word '}})
+    return [f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in head], f"event: {delta[0]}\ndata: {json.dumps(delta[1])}\n\n"
+
+
+def get_openai_events() -> Tuple[List[str], str]:
+    """Gets the server-sent events of an OpenAI chat completion stream
+
+    Returns:
+        Tuple[List[str], str]: the events of the head of the stream, and the event of each text delta
+    """
+    chunk = {
+        'id': 'chatcmpl-test', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'test',
+        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': 'word '}, 'finish_reason': None}]
+    }
+    return [], f"data: {json.dumps(chunk)}\n\n"
+
+
+def get_transport(events:Tuple[List[str], str]) -> httpx.MockTransport:
+    """Gets an httpx transport that streams the events slowly
+
+    Args:
+        events (Tuple[List[str], str]): the events of the head of the stream, and the event of each text delta
+
+    Returns:
+        httpx.MockTransport: the transport
+    """
+    head, delta = events
+
+    async def body():
+        for event in head:
+            yield event.encode()
+        for _ in range(CHUNKS):
+            yield delta.encode()
+            await asyncio.sleep(CHUNK_INTERVAL)
+
+    async def handler(request:httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=body())
+
+    return httpx.MockTransport(handler)
+
+
+class AsyncCancelTest(unittest.IsolatedAsyncioTestCase):
+
+    async def stream_until_cancelled(self, gateway:AICompanyGateway, cancel_in_thread:bool) -> None:
+        """Streams a message, cancels it after its first chunk and checks that the stream ended at once
+
+        Args:
+            gateway (AICompanyGateway): the gateway
+            cancel_in_thread (bool): whether the cancel comes from another thread (e.g. the stop button of a session)
+        """
+        cancel = CancelToken()
+        chunks = []
+        start = time.perf_counter()
+        with self.assertRaises(StreamCancelled):
+            async for chunk in gateway.astream_message('test', [{'role': 'user', 'content': 'hi'}], 100, cancel=cancel):
+                chunks.append(chunk)
+                if len(chunks) == 1:
+                    if cancel_in_thread:
+                        # the cancel lands while the stream waits for its next chunk
+                        threading.Timer(CHUNK_INTERVAL / 5, cancel.cancel).start()
+                    else:
+                        cancel.cancel()
+        self.assertLess(time.perf_counter() - start, CHUNK_INTERVAL * 3)
+        self.assertTrue(chunks)
+        self.assertEqual(gateway.get_stats()['cancelled'], 1)
+
+
+    async def test_anthropic(self) -> None:
+        for cancel_in_thread in (True, False):
+            gateway = AICompanyGateway.factory('anthropic', api_key='test', max_retries=0, transport=get_transport(get_anthropic_events()))
+            await self.stream_until_cancelled(gateway, cancel_in_thread)
+
+
+    async def test_openai(self) -> None:
+        for cancel_in_thread in (True, False):
+            gateway = AICompanyGateway.factory('openai', api_key='test', max_retries=0, transport=get_transport(get_openai_events()))
+            await self.stream_until_cancelled(gateway, cancel_in_thread)
+
+
+    async def test_mock(self) -> None:
+        for cancel_in_thread in (True, False):
+            gateway = AICompanyGateway.factory('mock', api_key='', ttft=0.0, tokens_per_second=1 / CHUNK_INTERVAL, seed=0)
+            await self.stream_until_cancelled(gateway, cancel_in_thread)
+
+
+    async def test_not_cancelled(self) -> None:
+        gateway = AICompanyGateway.factory('mock', api_key='', ttft=0.0, tokens_per_second=1000.0, seed=0)
+        chunks = [chunk async for chunk in gateway.astream_message('test', [{'role': 'user', 'content': 'hi'}], 100, cancel=CancelToken())]
+        self.assertTrue("".join(chunks))
+        self.assertEqual(gateway.get_stats()['cancelled'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,53 @@
 from typing import List, Dict 
 import openai 
 import json 
+import sys 
+from pathlib import Path 
+
+# the referee app, whose AI gateways run the batches 
+APP_DIR = Path(__file__).resolve().parent.parent/'ai-referee-interviewer-streamlit-gui' 
 
 
 def turn_level_annotation(client:openai.OpenAI, model:str, past_messages:List[Dict], response:str) -> Dict[str, int]: 
+    completion = client.chat.completions.create(**turn_level_annotation_request(model, past_messages, response))
+    annotation = completion.choices[0].message 
+    return json.loads(annotation.content) 
+
+
+def turn_level_annotation_batch(client:openai.OpenAI, model:str, turns:List[Dict], interval:float=60.0, timeout:float=None) -> Dict[str, Dict[str, int]]: 
+    """Annotates many turns at once through the batch API, which costs half as much as one request per turn 
+
+    Args:
+        client (openai.OpenAI): the OpenAI client, whose api key submits the batch 
+        model (str): the name of the model 
+        turns (List[Dict]): the turns, each with a unique 'content_id' and the 'past_messages' and 'response' of turn_level_annotation 
+        interval (float, optional): seconds between two checks of the batch status. Defaults to 60.0.
+        timeout (float, optional): seconds to wait for the batch before giving up. Defaults to None (wait until it finishes).
+
+    Returns:
+        Dict[str, Dict[str, int]]: maps the content id of each turn to its annotation, or to None if its request failed 
+    """
+    requests = [
+        {'content_id': turn['content_id'], **turn_level_annotation_request(model, turn['past_messages'], turn['response'])} 
+        for turn in turns 
+    ]
+    return run_annotation_batch(client, requests, interval=interval, timeout=timeout) 
+
+
+def turn_level_annotation_request(model:str, past_messages:List[Dict], response:str) -> Dict: 
+    """Builds the chat completion request for a turn level annotation 
+
+    The request can be sent right away by turn_level_annotation, or through the batch API with many others by 
+    turn_level_annotation_batch 
+
+    Args:
+        model (str): the name of the model 
+        past_messages (List[Dict]): the messages before the response 
+        response (str): the response to annotate 
+
+    Returns:
+        Dict: the keyword arguments for the chat completion 
+    """
     context = "" 
     for row in past_messages: 
         context += f"*{row['role']}*: {row['content']}\n"
@@ -57,7 +101,7 @@ def turn_level_annotation(client:openai.OpenAI, model:str, past_messages:List[Di
         politeness - x 
         overall - x 
     """
-    completion = client.chat.completions.create(
+    return dict(
         model=model, 
         messages=[{'role': 'user', 'content': prompt}], 
         temperature=0.7, 
@@ -101,12 +145,48 @@ def turn_level_annotation(client:openai.OpenAI, model:str, past_messages:List[Di
             }
         }
     )
+
+
+
+def referee_report_annotation(client:openai.OpenAI, model:str, report:str) -> Dict[str, int]: 
+    completion = client.chat.completions.create(**referee_report_annotation_request(model, report))
     annotation = completion.choices[0].message 
     return json.loads(annotation.content) 
 
 
+def referee_report_annotation_batch(client:openai.OpenAI, model:str, reports:Dict[str, str], interval:float=60.0, timeout:float=None) -> Dict[str, Dict[str, int]]: 
+    """Annotates many referee reports at once through the batch API, which costs half as much as one request per report 
 
-def referee_report_annotation(client:openai.OpenAI, model:str, report:str) -> Dict[str, int]: 
+    Args:
+        client (openai.OpenAI): the OpenAI client, whose api key submits the batch 
+        model (str): the name of the model 
+        reports (Dict[str, str]): maps a unique content id (e.g. the username) to each final referee report 
+        interval (float, optional): seconds between two checks of the batch status. Defaults to 60.0.
+        timeout (float, optional): seconds to wait for the batch before giving up. Defaults to None (wait until it finishes).
+
+    Returns:
+        Dict[str, Dict[str, int]]: maps the content id of each report to its annotation, or to None if its request failed 
+    """
+    requests = [
+        {'content_id': content_id, **referee_report_annotation_request(model, report)} 
+        for content_id, report in reports.items() 
+    ]
+    return run_annotation_batch(client, requests, interval=interval, timeout=timeout) 
+
+
+def referee_report_annotation_request(model:str, report:str) -> Dict: 
+    """Builds the chat completion request for a referee report annotation 
+
+    The request can be sent right away by referee_report_annotation, or through the batch API with many others by 
+    referee_report_annotation_batch 
+
+    Args:
+        model (str): the name of the model 
+        report (str): the final referee report 
+
+    Returns:
+        Dict: the keyword arguments for the chat completion 
+    """
     prompt = f"""
         ### Instruction: 
         You are the managing editor of a top academic journal in finance. Your job is to ensure that referee reports are thorough, useful, and professionally presented. 
@@ -156,7 +236,7 @@ def referee_report_annotation(client:openai.OpenAI, model:str, report:str) -> Di
         politeness - x 
         overall - x 
     """
-    completion = client.chat.completions.create(
+    return dict(
         model=model, 
         messages=[{'role': 'user', 'content': prompt}], 
         temperature=0.7, 
@@ -200,5 +280,28 @@ def referee_report_annotation(client:openai.OpenAI, model:str, report:str) -> Di
             }
         }
     )
-    annotation = completion.choices[0].message 
-    return json.loads(annotation.content) 
\ No newline at end of file
+
+
+def run_annotation_batch(client:openai.OpenAI, requests:List[Dict], interval:float=60.0, timeout:float=None) -> Dict[str, Dict[str, int]]: 
+    """Runs annotation requests through the OpenAI batch API with the BatchJob of the referee app's AI gateways 
+
+    Args:
+        client (openai.OpenAI): the OpenAI client, whose api key submits the batch 
+        requests (List[Dict]): the keyword arguments of the chat completions (see turn_level_annotation_request), each with a unique 'content_id' 
+        interval (float, optional): seconds between two checks of the batch status. Defaults to 60.0.
+        timeout (float, optional): seconds to wait for the batch before giving up. Defaults to None (wait until it finishes).
+
+    Returns:
+        Dict[str, Dict[str, int]]: maps each content id to its annotation, or to None if its request failed 
+    """
+    if str(APP_DIR) not in sys.path: 
+        sys.path.append(str(APP_DIR)) 
+    from libs.ai_gateways.gateway import AICompanyGateway 
+    from libs.ai_gateways.batch import BatchJob 
+
+    gateway = AICompanyGateway.factory('openai', api_key=client.api_key) 
+    results = BatchJob(gateway, requests).run(interval=interval, timeout=timeout) 
+    return {
+        content_id: json.loads(result['content']) if result['error'] is None else None 
+        for content_id, result in results.items() 
+    }
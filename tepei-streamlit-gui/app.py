@@ -16,6 +16,20 @@ if __name__ == "__main__":
         first_interviewer_message=config.FIRST_INTERVIEWER_MESSAGE,
         closing_messages=config.CLOSING_MESSAGES, 
         dropbox_path=config.DROPBOX_PATH, 
-        interview_instructions=config.INTERVIEW_INSTRUCTIONS 
+        interview_instructions=config.INTERVIEW_INSTRUCTIONS, 
+        client_pool_opts=config.CLIENT_POOL_OPTS, 
+        response_cache_opts=config.RESPONSE_CACHE_OPTS, 
+        max_input_tokens=config.MAX_INPUT_TOKENS, 
+        pinned_turns=config.PINNED_TURNS, 
+        hedge_opts=config.HEDGE_OPTS, 
+        rate_limits=config.RATE_LIMITS, 
+        stream_coalesce_opts=config.STREAM_COALESCE_OPTS, 
+        summary_pregeneration_opts=config.SUMMARY_PREGENERATION_OPTS, 
+        memory_opts=config.MEMORY_OPTS, 
+        model_routing_opts=config.MODEL_ROUTING_OPTS, 
+        stream_render_opts=config.STREAM_RENDER_OPTS, 
+        history_view_opts=config.HISTORY_VIEW_OPTS, 
+        generation_worker_opts=config.GENERATION_WORKER_OPTS, 
+        profile_reruns=config.PROFILE_RERUNS 
     )
     app.run() 
\ No newline at end of file
@@ -172,8 +172,86 @@ MODEL = "claude-3-7-sonnet-20250219"  # or e.g. "claude-3-5-sonnet-20240620" (Op
 # AI_COMPANY = "openai"
 # MODEL = 'gpt-4o-2024-08-06'
 # MODEL = 'gpt-4.5-preview-2025-02-27'
+# offline stand-in with simulated latency for load tests, configured with MockGateway options in CLIENT_POOL_OPTS 
+# (e.g. 'ttft': 0.5, 'tokens_per_second': 50.0, 'error_rate': 0.0, 'closing_code': 'x7y8', 'closing_after_turns': 10) 
+# AI_COMPANY = "mock"
 TEMPERATURE = None  # (None for default value)
 MAX_OUTPUT_TOKENS = 4096
+# budget of input tokens for each chat turn, the oldest turns are left out beyond it (None for no budget) 
+MAX_INPUT_TOKENS = 150000 
+# number of most recent transcript rows that are always sent 
+PINNED_TURNS = 6 
+# connection pool of the AI client shared by every session (timeouts in seconds), and how many times a stream that 
+# drops mid-message is resumed from its partial text 
+CLIENT_POOL_OPTS = {
+    'max_connections': 100, 
+    'max_keepalive_connections': 20, 
+    'keepalive_expiry': 30.0, 
+    'timeout': 600.0, 
+    'connect_timeout': 10.0, 
+    'stream_retries': 2, 
+    'stream_retry_backoff': 0.5 
+}
+# cache of AI responses so that asking for the same summary twice doesn't call the API again. Only requests with a 
+# temperature of 0 are cached, e.g. {'max_entries': 256, 'ttl': 24 * 60 * 60} (None to turn off) 
+RESPONSE_CACHE_OPTS = None
+# secondary AI company to stream from if the first token is late (None to turn off), e.g. 
+# {'ai_company': 'openai', 'ai_model': 'gpt-4o-2024-08-06', 'first_token_deadline': 8.0} 
+HEDGE_OPTS = None 
+# batching of the streamed text before it is displayed, at most one re-render every min_interval seconds (None to render every delta) 
+STREAM_COALESCE_OPTS = {
+    'min_interval': 0.05, 
+    'word_boundary': True 
+}
+# rendering of the streamed message, cut at a safe markdown boundary and redrawn every poll_interval seconds (see 
+# GENERATION_WORKER_OPTS) with the cursor at its end 
+STREAM_RENDER_OPTS = {
+    'cursor': "▌" 
+}
+# message history: the recent_messages most recent messages are rendered in full, the older ones are collapsed into 
+# pages of page_size messages that are only rendered when opened. Older messages that don't fill a page yet are rendered 
+# with the recent ones (None to render every message) 
+HISTORY_VIEW_OPTS = {
+    'recent_messages': 12, 
+    'page_size': 10 
+}
+# background streaming of the AI messages: at most max_workers messages are streamed at the same time by the process, 
+# and the chat shows the message being written every poll_interval seconds 
+GENERATION_WORKER_OPTS = {
+    'max_workers': 32, 
+    'poll_interval': 0.2 
+}
+# print how long each run of the page, the chat and the sidebar buttons takes to the server's console (not saved to 
+# Dropbox), to profile the reruns 
+PROFILE_RERUNS = False 
+# background generation of the summary document after every turn once the interview has min_user_turns answers, so that 
+# the generate button returns it right away if the transcript hasn't changed since. Every turn then costs one more 
+# full-transcript call to the AI, e.g. {'min_user_turns': 8, 'max_workers': 2} (None to turn off) 
+SUMMARY_PREGENERATION_OPTS = None 
+# rolling memory for long interviews: once condense_every rows beyond the keep_turns most recent ones are completed, 
+# they are condensed in the background by a cheap model into a summary that is sent in place of them (the full 
+# transcript is still saved). phase_boundary is a regex of the assistant message that closes a phase, e.g. 
+# {'ai_model': 'claude-3-5-haiku-20241022', 'max_tokens': 1000, 'keep_turns': 8, 'condense_every': 6, 'phase_boundary': None} 
+# (None to always send every turn) 
+MEMORY_OPTS = None 
+# per-call model routing: the fast model of the AI company serves the fast_tasks ('summary'), the calls with at most 
+# max_output_tokens, and the turns past the first min_user_turns answers whose answer is an acknowledgement or has at 
+# most max_user_words words. The model that served each turn and the latency saved are logged, e.g. 
+# {'fast_models': {'anthropic': 'claude-3-5-haiku-20241022', 'openai': 'gpt-4o-mini'}, 'fast_tasks': ['summary'], 'max_user_words': 3, 'min_user_turns': 2} 
+# (None to send every call to MODEL) 
+MODEL_ROUTING_OPTS = None 
+# limits on the requests sent by every session together, by company then model ('*' for any), so that a whole class 
+# starting at once waits briefly instead of getting rate limit errors. Match them to the account's API tier 
+RATE_LIMITS = {
+    '*': {
+        '*': {
+            'requests_per_minute': 1000, 
+            'tokens_per_minute': 400000, 
+            'max_in_flight': 32, 
+            'max_wait': 60.0 
+        }
+    }
+}
 
 
 # Display login screen with usernames and simple passwords for studies
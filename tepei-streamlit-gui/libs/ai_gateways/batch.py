@@ -0,0 +1,150 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from .gateway import AICompanyGateway
+
+class BatchJob:
+    """Runs many requests through an AI company's batch API and maps the results back to the caller's content ids
+
+    Batch APIs are cheaper and have much higher throughput than one synchronous request per item, so they are the way to run
+    bulk offline work such as annotating every turn of the assessment transcripts. A job goes through build -> submit -> poll -> collect,
+    and can be saved to and loaded from a file in between so that a long-running batch can be collected from a new process
+    """
+
+    def __init__(self, gateway:AICompanyGateway, requests:List[Dict]=None, max_tokens:int=1024) -> None:
+        """Sets up the object
+
+        Args:
+            gateway (AICompanyGateway): the gateway to the AI company
+            requests (List[Dict], optional): the requests, each a dict with a 'content_id' (str or int) and the keyword arguments for create_message. Defaults to None.
+            max_tokens (int, optional): the max tokens for requests that don't set their own. Defaults to 1024.
+        """
+        self.gateway = gateway
+        self.requests = requests or []
+        self.max_tokens = max_tokens
+        self.batch_id = None
+        # maps the custom id sent to the API to the content id of the request
+        self.custom_ids = {}
+
+
+    def build(self) -> List[Dict]:
+        """Builds the batch requests in the format of the AI company's batch API
+
+        Content ids can be any string or int, but the batch APIs only accept short alphanumeric custom ids, so each request is
+        sent with a custom id made from its position and the mapping is kept to translate the results back
+
+        Raises:
+            Exception: raises an exception if two requests have the same content id
+
+        Returns:
+            List[Dict]: the batch requests
+        """
+        batch_requests = []
+        self.custom_ids = {}
+        content_ids = set()
+        for i, request in enumerate(self.requests):
+            request = dict(request)
+            content_id = request.pop('content_id')
+            if content_id in content_ids:
+                raise Exception(f"Duplicate content id in batch: {content_id}")
+            content_ids.add(content_id)
+            request.setdefault('max_tokens', self.max_tokens)
+            custom_id = f"request-{i}"
+            self.custom_ids[custom_id] = content_id
+            batch_requests.append(self.gateway.build_batch_request(custom_id=custom_id, **request))
+        return batch_requests
+
+
+    def submit(self) -> str:
+        """Builds and submits the batch
+
+        Returns:
+            str: the id of the batch
+        """
+        self.batch_id = self.gateway.submit_batch(self.build())
+        return self.batch_id
+
+
+    def poll(self, interval:float=60.0, timeout:float=None) -> str:
+        """Waits for the batch to finish
+
+        Args:
+            interval (float, optional): seconds between status checks. Defaults to 60.0.
+            timeout (float, optional): seconds to wait before giving up. Defaults to None (wait until the batch finishes).
+
+        Raises:
+            Exception: raises an exception if the batch hasn't been submitted, or if it doesn't finish before the timeout
+
+        Returns:
+            str: the final status of the batch, 'completed' or 'failed'
+        """
+        if self.batch_id is None:
+            raise Exception("Batch has not been submitted yet")
+        start = time.time()
+        while True:
+            status = self.gateway.get_batch_status(self.batch_id)
+            if status != 'in_progress':
+                return status
+            if timeout is not None and time.time() - start + interval > timeout:
+                raise Exception(f"Batch {self.batch_id} did not finish within {timeout} seconds")
+            time.sleep(interval)
+
+
+    def collect(self) -> Dict[str, Dict]:
+        """Gets the results of the finished batch, keyed by content id
+
+        Requests that are missing from the results (e.g. because the batch failed) are returned with an error
+
+        Returns:
+            Dict[str, Dict]: maps each content id to {'content': [the message or None], 'error': [the error or None]}
+        """
+        results = self.gateway.get_batch_results(self.batch_id)
+        collected = {}
+        for custom_id, content_id in self.custom_ids.items():
+            collected[content_id] = results.get(custom_id, {'content': None, 'error': 'missing from batch results'})
+        return collected
+
+
+    def run(self, interval:float=60.0, timeout:float=None) -> Dict[str, Dict]:
+        """Submits the batch, waits for it to finish and collects the results
+
+        Args:
+            interval (float, optional): seconds between status checks. Defaults to 60.0.
+            timeout (float, optional): seconds to wait before giving up. Defaults to None (wait until the batch finishes).
+
+        Returns:
+            Dict[str, Dict]: maps each content id to {'content': [the message or None], 'error': [the error or None]}
+        """
+        self.submit()
+        self.poll(interval=interval, timeout=timeout)
+        return self.collect()
+
+
+    def save(self, fpath:str) -> None:
+        """Saves the batch id and the custom id mapping so that the results can be collected from another process
+
+        Args:
+            fpath (str): the path of the json file to save to
+        """
+        with open(fpath, 'w') as f:
+            json.dump({'batch_id': self.batch_id, 'custom_ids': self.custom_ids}, f)
+
+
+    @classmethod
+    def load(cls, gateway:AICompanyGateway, fpath:str) -> 'BatchJob':
+        """Loads a submitted batch saved by save
+
+        Args:
+            gateway (AICompanyGateway): the gateway to the AI company the batch was submitted to
+            fpath (str): the path of the json file to load
+
+        Returns:
+            BatchJob: the batch job, ready to be polled and collected
+        """
+        state = json.loads(Path(fpath).read_text())
+        job = cls(gateway)
+        job.batch_id = state['batch_id']
+        job.custom_ids = state['custom_ids']
+        return job
\ No newline at end of file
@@ -0,0 +1,199 @@
+import threading
+from typing import Callable, Dict
+
+class StreamCancelled(Exception):
+    """Raised by stream_message when its call was cancelled with a CancelToken"""
+    pass
+
+
+class CancelToken:
+    """Cancels a streamed call from any thread
+
+    Pass an instance to stream_message with the `cancel` keyword. The gateway registers the close of its SDK stream on the
+    token, so cancel aborts the HTTP response at once, even while the stream is waiting for its next chunk, which frees the
+    connection and stops the output tokens. The stream then raises StreamCancelled
+    """
+
+    def __init__(self) -> None:
+        """Sets up the object"""
+        self.__lock = threading.Lock()
+        self.__cancelled = threading.Event()
+        self.__callbacks = {}
+        self.__next_handle = 0
+        # who cancelled the call, e.g. 'user'
+        self.reason = None
+
+
+    def cancel(self, reason:str='user') -> None:
+        """Cancels the call, closing its stream
+
+        Args:
+            reason (str, optional): who cancelled the call, recorded in its metrics. Defaults to 'user'.
+        """
+        with self.__lock:
+            if self.__cancelled.is_set():
+                return
+            self.reason = reason
+            self.__cancelled.set()
+            callbacks, self.__callbacks = list(self.__callbacks.values()), {}
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # the stream may already be closed
+                pass
+
+
+    def is_cancelled(self) -> bool:
+        """Tells whether the call was cancelled
+
+        Returns:
+            bool: True if cancel was called
+        """
+        return self.__cancelled.is_set()
+
+
+    def on_cancel(self, callback:Callable[[], None]) -> int:
+        """Registers a function called by cancel, e.g. the close of an SDK stream. It is called at once if the call is already cancelled
+
+        Args:
+            callback (Callable[[], None]): the function
+
+        Returns:
+            int: the handle to pass to remove, or None if the function was already called
+        """
+        with self.__lock:
+            if not self.__cancelled.is_set():
+                handle = self.__next_handle
+                self.__next_handle += 1
+                self.__callbacks[handle] = callback
+                return handle
+        try:
+            callback()
+        except Exception:
+            pass
+        return None
+
+
+    def remove(self, handle:int) -> None:
+        """Unregisters a function, once its stream is done
+
+        Args:
+            handle (int): the handle returned by on_cancel
+        """
+        with self.__lock:
+            self.__callbacks.pop(handle, None)
+
+
+    def check(self) -> None:
+        """Raises StreamCancelled if the call was cancelled
+
+        Raises:
+            StreamCancelled: if the call was cancelled
+        """
+        if self.__cancelled.is_set():
+            raise StreamCancelled(self.reason)
+
+
+    def sleep(self, seconds:float) -> None:
+        """Waits, for streams that wait between chunks without an HTTP response to close (e.g. the mock)
+
+        Args:
+            seconds (float): the seconds to wait
+
+        Raises:
+            StreamCancelled: as soon as the call is cancelled
+        """
+        self.__cancelled.wait(seconds)
+        self.check()
+
+
+class CancellationTracker:
+    """Counts the output tokens saved by the streams that were closed before the model was done, i.e. cancelled by the
+    user or closed at a closing code found in the text
+
+    The tokens saved by a call are the tokens a complete reply of its model usually has (a moving average of the calls
+    that weren't cancelled) minus the tokens it had written. The output budget released, max_tokens minus the tokens
+    written, is counted too, as an upper bound
+    """
+
+    def __init__(self, smoothing:float=0.2, chars_per_token:int=4) -> None:
+        """Sets up the object
+
+        Args:
+            smoothing (float, optional): the weight of the latest complete call in the usual length of a reply. Defaults to 0.2.
+            chars_per_token (int, optional): the characters per token, for calls cancelled before the API reported their usage. Defaults to 4.
+        """
+        self.smoothing = smoothing
+        self.chars_per_token = chars_per_token
+
+        self.__lock = threading.Lock()
+        # the usual output tokens of a complete reply of each (company, model)
+        self.__reply_tokens = {}
+        self.__stats = {'calls': 0, 'cancelled': 0, 'by': {}, 'tokens_saved': 0, 'budget_released': 0}
+
+
+    def record(self, metrics:'CallMetrics', max_tokens:int, text:str) -> int:
+        """Records a finished call: learns the length of a complete reply, or counts the tokens a cancelled call saved and sets them on its metrics
+
+        Args:
+            metrics (CallMetrics): the metrics of the call
+            max_tokens (int): the max output tokens of the call
+            text (str): the text the call streamed
+
+        Returns:
+            int: the tokens saved, or None if the call wasn't cancelled or its model has no complete reply yet
+        """
+        key = (metrics.company, metrics.model)
+        if metrics.cancelled_by is None:
+            if metrics.stop_reason not in ('error', 'cancelled') and metrics.output_tokens:
+                with self.__lock:
+                    self.__stats['calls'] += 1
+                    usual = self.__reply_tokens.get(key)
+                    self.__reply_tokens[key] = metrics.output_tokens if usual is None else usual + self.smoothing * (metrics.output_tokens - usual)
+            return None
+
+        written = metrics.output_tokens if metrics.output_tokens is not None else len(text) // self.chars_per_token
+        with self.__lock:
+            usual = self.__reply_tokens.get(key)
+            self.__stats['calls'] += 1
+            self.__stats['cancelled'] += 1
+            self.__stats['by'][metrics.cancelled_by] = self.__stats['by'].get(metrics.cancelled_by, 0) + 1
+            self.__stats['budget_released'] += max(max_tokens - written, 0)
+            if usual is None:
+                return None
+            metrics.tokens_saved = int(max(min(usual, max_tokens) - written, 0))
+            self.__stats['tokens_saved'] += metrics.tokens_saved
+        return metrics.tokens_saved
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the tracker
+
+        Returns:
+            Dict: the number of calls and of cancelled calls (by who cancelled them), the tokens saved and the output budget released
+        """
+        with self.__lock:
+            return {**self.__stats, 'by': dict(self.__stats['by'])}
+
+
+_shared_tracker = None
+_shared_tracker_lock = threading.Lock()
+
+
+def get_shared_cancellation_tracker(**tracker_opts) -> CancellationTracker:
+    """Gets the cancellation tracker shared by the whole process, so that its statistics cover every session
+
+    The tracker is created on the first call, so the options of later calls are ignored
+
+    Args:
+        tracker_opts: options passed to the CancellationTracker
+
+    Returns:
+        CancellationTracker: the shared tracker
+    """
+    global _shared_tracker
+    with _shared_tracker_lock:
+        if _shared_tracker is None:
+            _shared_tracker = CancellationTracker(**tracker_opts)
+        return _shared_tracker
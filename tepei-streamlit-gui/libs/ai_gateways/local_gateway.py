@@ -0,0 +1,201 @@
+import json
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, List, Dict, Generator, AsyncGenerator
+
+from .gateway import AICompanyGateway
+from .stop_signals import watch_stop_signals, awatch_stop_signals
+
+@AICompanyGateway.register()
+class LocalGateway (AICompanyGateway):
+    """File-based stand-in for an AI company so that batch jobs can be run end to end offline
+
+    Batches are written to a folder as JSONL input files, and processed into JSONL output files by a local responder
+    the first time their status is checked after the processing delay
+    """
+    name = 'local'
+
+    def setup_client(self, api_key:str, batch_dir:str=None, processing_delay:float=0.0, responder:Callable[[Dict], str]=None, **kwargs) -> None:
+        """Sets up the local stand-in
+
+        Args:
+            api_key (str): the api key. Not used
+            batch_dir (str, optional): the folder where the batch files are written. Defaults to None (a temporary folder).
+            processing_delay (float, optional): seconds a batch stays in progress after it is submitted. Defaults to 0.0.
+            responder (Callable[[Dict], str], optional): function that maps the keyword arguments of a request to its response. Defaults to None (echo the last message).
+        """
+        self.batch_dir = Path(batch_dir or tempfile.mkdtemp(prefix='local-batches-'))
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+        self.processing_delay = processing_delay
+        self.responder = responder or self.echo
+
+
+    @staticmethod
+    def echo(request:Dict) -> str:
+        """Default responder that echoes the text of the last message
+
+        Args:
+            request (Dict): the keyword arguments of the request
+
+        Returns:
+            str: the response
+        """
+        content = request['messages'][-1]['content']
+        if isinstance(content, list):
+            content = " ".join(block.get('text', '') for block in content)
+        return f"Echo: {content}"
+
+
+    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Returns the responder's message
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            str: the messsage from the responder
+        """
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics:
+            msg = self.responder({'model': model, 'messages': messages, 'max_tokens': max_tokens, 'system_message': system_message, **kwargs})
+            metrics.record_usage(stop_reason='end_turn')
+        return msg
+
+
+    @watch_stop_signals
+    def stream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Generator[str, None, None]:
+        """Streams the responder's message word by word
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Yields:
+            Generator[str, None, None]: yields the message from the responder
+        """
+        cancel = kwargs.pop('cancel', None)
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics, self.close_on_cancel(cancel):
+            msg = self.responder({'model': model, 'messages': messages, 'max_tokens': max_tokens, 'system_message': system_message, **kwargs})
+            for i, word in enumerate(msg.split(' ')):
+                if cancel is not None:
+                    cancel.check()
+                metrics.record_chunk()
+                yield word if i == 0 else ' ' + word
+            metrics.record_usage(stop_reason='end_turn')
+
+
+    async def acreate_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Returns the responder's message
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            str: the messsage from the responder
+        """
+        return self.create_message(model, messages, max_tokens, system_message, **kwargs)
+
+
+    @awatch_stop_signals
+    async def astream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]:
+        """Streams the responder's message word by word
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Yields:
+            AsyncGenerator[str, None]: yields the message from the responder
+        """
+        for text_delta in self.stream_message(model, messages, max_tokens, system_message, **kwargs):
+            yield text_delta
+
+
+    def build_batch_request(self, custom_id:str, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Dict:
+        """Builds one line of a batch input file
+
+        Args:
+            custom_id (str): the id that the batch results are keyed by
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            Dict: the batch request
+        """
+        return {
+            'custom_id': custom_id,
+            'body': {'model': model, 'messages': messages, 'max_tokens': max_tokens, 'system_message': system_message, **kwargs}
+        }
+
+
+    def submit_batch(self, batch_requests:List[Dict]) -> str:
+        """Writes the batch input file
+
+        Args:
+            batch_requests (List[Dict]): the batch requests
+
+        Returns:
+            str: the id of the batch
+        """
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch_path = self.batch_dir/batch_id
+        batch_path.mkdir()
+        (batch_path/'input.jsonl').write_text("\n".join(json.dumps(request) for request in batch_requests))
+        (batch_path/'submitted_at').write_text(str(time.time()))
+        return batch_id
+
+
+    def get_batch_status(self, batch_id:str) -> str:
+        """Gets the status of a batch, processing it if the processing delay has passed
+
+        Args:
+            batch_id (str): the id of the batch
+
+        Returns:
+            str: 'in_progress' or 'completed'
+        """
+        batch_path = self.batch_dir/batch_id
+        if (batch_path/'output.jsonl').exists():
+            return 'completed'
+        if time.time() - float((batch_path/'submitted_at').read_text()) < self.processing_delay:
+            return 'in_progress'
+
+        # process the batch
+        output = []
+        for line in (batch_path/'input.jsonl').read_text().splitlines():
+            request = json.loads(line)
+            try:
+                output.append({'custom_id': request['custom_id'], 'content': self.responder(request['body']), 'error': None})
+            except Exception as e:
+                output.append({'custom_id': request['custom_id'], 'content': None, 'error': str(e)})
+        (batch_path/'output.jsonl').write_text("\n".join(json.dumps(row) for row in output))
+        return 'completed'
+
+
+    def get_batch_results(self, batch_id:str) -> Dict[str, Dict]:
+        """Reads the batch output file
+
+        Args:
+            batch_id (str): the id of the batch
+
+        Returns:
+            Dict[str, Dict]: maps the custom id of each request to {'content': [the message or None], 'error': [the error or None]}
+        """
+        results = {}
+        for line in (self.batch_dir/batch_id/'output.jsonl').read_text().splitlines():
+            row = json.loads(line)
+            results[row['custom_id']] = {'content': row['content'], 'error': row['error']}
+        return results
\ No newline at end of file
@@ -0,0 +1,259 @@
+import re
+import threading
+from typing import Dict, Generator, List, Tuple
+
+from .gateway import AICompanyGateway
+from .telemetry import CallMetrics
+
+# user replies that don't need the main model to be answered, e.g. acknowledgements
+TRIVIAL_REPLY_PATTERN = r"^\s*(ok(ay)?|k|thanks?|thank you|thx|yes|yep|yeah|no|nope|sure|got it|great|cool|fine|alright|sounds good|perfect|done)[\s.!]*$"
+
+class ModelRouter:
+    """Chooses per call between a fast, cheap model and the main model of the request
+
+    A call goes to the fast model of its AI company if its task is one of fast_tasks (e.g. the summary), if it asks for
+    few output tokens, or if it is an interview turn past the opening whose last user message is trivial (short, or an
+    acknowledgement). Every other call keeps its main model.
+
+    The router keeps the latency of every model it sees, i.e. the time to the first token and the seconds per output
+    token, so that the latency saved by a call served by the fast model can be estimated against the main model
+    """
+
+    def __init__(self, fast_models:Dict[str, str], fast_tasks:List[str]=None, max_output_tokens:int=0, max_user_words:int=0, trivial_pattern:str=TRIVIAL_REPLY_PATTERN, min_user_turns:int=2, smoothing:float=0.2) -> None:
+        """Sets up the object
+
+        Args:
+            fast_models (Dict[str, str]): the fast model of each AI company, e.g. {'anthropic': 'claude-3-5-haiku-20241022'}. Calls to other AI companies keep their model.
+            fast_tasks (List[str], optional): the tasks always sent to the fast model, e.g. ['summary']. Defaults to None (none).
+            max_output_tokens (int, optional): calls that ask for at most this many output tokens go to the fast model. Defaults to 0 (off).
+            max_user_words (int, optional): turns whose last user message has at most this many words go to the fast model. Defaults to 0 (off).
+            trivial_pattern (str, optional): regex of the user messages whose turns go to the fast model. Defaults to TRIVIAL_REPLY_PATTERN (None to turn it off).
+            min_user_turns (int, optional): the number of user messages before turns can go to the fast model, so that the opening of the interview always gets the main model. Defaults to 2.
+            smoothing (float, optional): the weight of the latest call in the latency of a model. Defaults to 0.2.
+        """
+        self.fast_models = fast_models
+        self.fast_tasks = set(fast_tasks or [])
+        self.max_output_tokens = max_output_tokens
+        self.max_user_words = max_user_words
+        self.trivial_pattern = re.compile(trivial_pattern, re.IGNORECASE) if trivial_pattern else None
+        self.min_user_turns = min_user_turns
+        self.smoothing = smoothing
+
+        self.__lock = threading.Lock()
+        # the time to the first token and the seconds per output token of each (company, model)
+        self.__latencies = {}
+        self.__stats = {'calls': 0, 'fast': 0, 'main': 0, 'reasons': {}, 'latency_saved': 0.0}
+
+
+    @staticmethod
+    def get_text(message:Dict) -> str:
+        """Gets the text of a message, whose content is either a string or a list of content blocks
+
+        Args:
+            message (Dict): the message
+
+        Returns:
+            str: the text of the message
+        """
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+        return " ".join(block.get('text', '') for block in content or [] if isinstance(block, dict) and block.get('type') == 'text')
+
+
+    def classify_turn(self, messages:List[Dict]) -> str:
+        """Tells whether the last user message of an interview turn is trivial enough for the fast model
+
+        Args:
+            messages (List[Dict]): the messages of the turn
+
+        Returns:
+            str: the reason the turn is trivial, or None if it isn't
+        """
+        user_messages = [m for m in messages if m.get('role') == 'user']
+        if not user_messages or len(user_messages) < self.min_user_turns:
+            return None
+        text = self.get_text(messages[-1]).strip() if messages[-1].get('role') == 'user' else ""
+        if not text:
+            return None
+        if self.trivial_pattern is not None and self.trivial_pattern.match(text):
+            return 'trivial reply'
+        if self.max_user_words and len(text.split()) <= self.max_user_words:
+            return 'short reply'
+        return None
+
+
+    def choose(self, company:str, model:str, messages:List[Dict], max_tokens:int, task:str='turn') -> Tuple[str, str]:
+        """Chooses the model of a call
+
+        Args:
+            company (str): the name of the AI company
+            model (str): the main model of the call
+            messages (List[Dict]): the messages of the call
+            max_tokens (int): the max output tokens of the call
+            task (str, optional): what the call is for, e.g. 'turn' or 'summary'. Defaults to 'turn'.
+
+        Returns:
+            Tuple[str, str]: the model to use and the reason it was chosen ('main' if the main model is kept)
+        """
+        fast_model = self.fast_models.get(company)
+        reason = None
+        if fast_model and fast_model != model:
+            if task in self.fast_tasks:
+                reason = f"task {task}"
+            elif self.max_output_tokens and max_tokens <= self.max_output_tokens:
+                reason = 'short output'
+            elif task == 'turn':
+                reason = self.classify_turn(messages)
+        return (fast_model, reason) if reason else (model, 'main')
+
+
+    def route(self, company:str, request:Dict, task:str='turn', metrics:CallMetrics=None) -> Dict:
+        """Routes a request, recording the choice in the metrics of the call
+
+        Args:
+            company (str): the name of the AI company the request is sent to
+            request (Dict): the keyword arguments of create_message or stream_message
+            task (str, optional): what the call is for, e.g. 'turn' or 'summary'. Defaults to 'turn'.
+            metrics (CallMetrics, optional): the metrics of the call, pass them to record once the call is done. Defaults to None.
+
+        Returns:
+            Dict: the request with the chosen model
+        """
+        model, reason = self.choose(company, request['model'], request['messages'], request['max_tokens'], task=task)
+        if metrics is not None:
+            metrics.routed_from, metrics.routing = request['model'], reason
+        with self.__lock:
+            self.__stats['calls'] += 1
+            self.__stats['main' if reason == 'main' else 'fast'] += 1
+            self.__stats['reasons'][reason] = self.__stats['reasons'].get(reason, 0) + 1
+        return {**request, 'model': model}
+
+
+    def estimate_duration(self, company:str, model:str, output_tokens:int) -> float:
+        """Estimates how long a model takes to write a message
+
+        Args:
+            company (str): the name of the AI company
+            model (str): the name of the model
+            output_tokens (int): the output tokens of the message
+
+        Returns:
+            float: the estimated seconds, or None if the model hasn't been seen yet
+        """
+        with self.__lock:
+            latency = self.__latencies.get((company, model))
+        if latency is None:
+            return None
+        return latency['time_to_first_token'] + latency['seconds_per_token'] * (output_tokens or 0)
+
+
+    def record(self, metrics:CallMetrics) -> float:
+        """Learns the latency of the model that served a finished call, and sets the latency the routing saved on its metrics
+
+        Args:
+            metrics (CallMetrics): the metrics of the call, passed to route before the call
+
+        Returns:
+            float: the seconds saved against the main model (negative if the call was slower), 0.0 if the main model served it, or None if it can't be estimated yet
+        """
+        call = metrics.to_dict()
+        ttft, duration, output_tokens = call['time_to_first_token'], call['duration'], call['output_tokens']
+        if metrics.streamed and metrics.stop_reason not in ('error', 'cancelled') and ttft is not None and output_tokens:
+            seconds_per_token = max(duration - ttft, 0.0) / output_tokens
+            with self.__lock:
+                latency = self.__latencies.get((metrics.company, metrics.model))
+                if latency is None:
+                    self.__latencies[(metrics.company, metrics.model)] = {'time_to_first_token': ttft, 'seconds_per_token': seconds_per_token}
+                else:
+                    latency['time_to_first_token'] += self.smoothing * (ttft - latency['time_to_first_token'])
+                    latency['seconds_per_token'] += self.smoothing * (seconds_per_token - latency['seconds_per_token'])
+
+        if metrics.routed_from is None or metrics.model == metrics.routed_from:
+            metrics.latency_saved = 0.0 if metrics.routed_from is not None else None
+            return metrics.latency_saved
+        if metrics.model != self.fast_models.get(metrics.company) or duration is None:
+            # e.g. a hedged call won by the secondary AI company
+            return None
+        main_duration = self.estimate_duration(metrics.company, metrics.routed_from, output_tokens)
+        if main_duration is None:
+            return None
+        metrics.latency_saved = round(main_duration - duration, 4)
+        with self.__lock:
+            self.__stats['latency_saved'] += metrics.latency_saved
+        return metrics.latency_saved
+
+
+    def stream_message(self, gateway:AICompanyGateway, request:Dict, task:str='turn', metrics:CallMetrics=None) -> Generator[str, None, None]:
+        """Streams a message from the routed model
+
+        Args:
+            gateway (AICompanyGateway): the gateway to the AI company
+            request (Dict): the keyword arguments of stream_message
+            task (str, optional): what the call is for. Defaults to 'turn'.
+            metrics (CallMetrics, optional): the metrics of the call. Defaults to None.
+
+        Yields:
+            Generator[str, None, None]: yields the messages sent by the AI
+        """
+        metrics = metrics or CallMetrics()
+        request = self.route(gateway.name, request, task=task, metrics=metrics)
+        try:
+            yield from gateway.stream_message(**request, metrics=metrics)
+        finally:
+            self.record(metrics)
+
+
+    def create_message(self, gateway:AICompanyGateway, request:Dict, task:str='turn', metrics:CallMetrics=None) -> str:
+        """Creates a message with the routed model
+
+        Args:
+            gateway (AICompanyGateway): the gateway to the AI company
+            request (Dict): the keyword arguments of create_message
+            task (str, optional): what the call is for. Defaults to 'turn'.
+            metrics (CallMetrics, optional): the metrics of the call. Defaults to None.
+
+        Returns:
+            str: the message sent by the AI
+        """
+        metrics = metrics or CallMetrics()
+        request = self.route(gateway.name, request, task=task, metrics=metrics)
+        try:
+            return gateway.create_message(**request, metrics=metrics)
+        finally:
+            self.record(metrics)
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the router
+
+        Returns:
+            Dict: the number of calls routed and served by the fast and main models, the calls per reason, the total seconds saved, and the latency of each model
+        """
+        with self.__lock:
+            stats = {**self.__stats, 'reasons': dict(self.__stats['reasons'])}
+            stats['latency_saved'] = round(stats['latency_saved'], 3)
+            stats['latencies'] = {f"{company}/{model}": {k: round(v, 4) for k, v in latency.items()} for (company, model), latency in self.__latencies.items()}
+        return stats
+
+
+_shared_router = None
+_shared_router_lock = threading.Lock()
+
+
+def get_shared_model_router(**router_opts) -> ModelRouter:
+    """Gets the model router shared by the whole process, so that the latencies it learns and its statistics cover every session
+
+    The router is created on the first call, so the options of later calls are ignored
+
+    Args:
+        router_opts: options passed to the ModelRouter
+
+    Returns:
+        ModelRouter: the shared router
+    """
+    global _shared_router
+    with _shared_router_lock:
+        if _shared_router is None:
+            _shared_router = ModelRouter(**router_opts)
+        return _shared_router
@@ -0,0 +1,255 @@
+import collections
+import functools
+from typing import AsyncGenerator, Callable, Dict, Generator, List, Tuple
+
+from .telemetry import CallMetrics
+
+class StopSignalMatcher:
+    """Finds reserved stop signals, such as the closing codes of an interview, in a stream of text
+
+    Used for every AI company: alone for those whose API can't tell which stop sequence ended a message, and alongside
+    the native stop sequences for the others, to catch the casings that aren't sent as stop sequences. The signals are compiled into an
+    Aho-Corasick automaton over their lower-cased text, whose state is kept across deltas, so each character of the stream
+    is looked at once, whatever the length of the message and the number of signals. The text that could be the start of
+    a signal (the depth of the automaton's state) is held back until it is known, so that a signal never reaches the consumer
+    """
+
+    def __init__(self, signals:List[str]) -> None:
+        """Sets up the object
+
+        Args:
+            signals (List[str]): the signals to look for, matched case-insensitively
+        """
+        self.signals = {signal.lower(): signal for signal in signals if signal}
+        self.build()
+        self.state = 0
+        # the characters read since the automaton left its root, with the lower-cased length of each
+        self.pending = collections.deque()
+        self.pending_length = 0
+
+
+    def build(self) -> None:
+        """Builds the automaton: the trie of the signals, with the failure link and the longest signal that ends at each state"""
+        self.goto = [{}]
+        self.depth = [0]
+        self.match = [None]
+        for key in self.signals:
+            state = 0
+            for char in key:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.depth.append(self.depth[state] + 1)
+                    self.match.append(None)
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.match[state] = key
+
+        # breadth first, so that the failure link of a state is done before its children
+        self.fail = [0] * len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            if self.match[state] is None:
+                # a signal that ends at the failure state also ends here (the state's own signal is longer)
+                self.match[state] = self.match[self.fail[state]]
+            for char, child in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0) if state else 0
+                queue.append(child)
+
+
+    def step(self, state:int, char:str) -> int:
+        """Moves the automaton by one lower-cased character
+
+        Args:
+            state (int): the current state
+            char (str): the character
+
+        Returns:
+            int: the next state
+        """
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+
+    def feed(self, delta:str) -> Tuple[str, str]:
+        """Adds a delta of the stream
+
+        Args:
+            delta (str): the delta
+
+        Returns:
+            Tuple[str, str]: the text that can be let out, and the signal found (None if there is none yet). The text after a signal is dropped
+        """
+        text = []
+        for char in delta:
+            lowered = char.lower()
+            self.pending.append((char, len(lowered)))
+            self.pending_length += len(lowered)
+            for c in lowered:
+                self.state = self.step(self.state, c)
+                key = self.match[self.state]
+                if key is not None:
+                    # let out the pending text before the signal
+                    length = self.pending_length
+                    while self.pending and length - self.pending[0][1] >= len(key):
+                        length -= self.pending[0][1]
+                        text.append(self.pending.popleft()[0])
+                    self.reset()
+                    return "".join(text), self.signals[key]
+            # only the end of the text that the state stands for can still be part of a signal
+            while self.pending and self.pending_length - self.pending[0][1] >= self.depth[self.state]:
+                self.pending_length -= self.pending[0][1]
+                text.append(self.pending.popleft()[0])
+        return "".join(text), None
+
+
+    def reset(self) -> None:
+        """Drops the text held back and moves the automaton back to its root"""
+        self.state = 0
+        self.pending.clear()
+        self.pending_length = 0
+
+
+    def flush(self) -> str:
+        """Lets out the text held back at the end of the stream
+
+        Returns:
+            str: the text held back
+        """
+        text = "".join(char for char, _ in self.pending)
+        self.reset()
+        return text
+
+
+def find_stop_signal(text:str, signals:List[str]) -> Tuple[str, str]:
+    """Finds the first stop signal in a whole text, in one pass
+
+    Args:
+        text (str): the text
+        signals (List[str]): the signals to look for, matched case-insensitively
+
+    Returns:
+        Tuple[str, str]: the text before the signal (the whole text if there is none), and the signal found (None if there is none)
+    """
+    matcher = StopSignalMatcher(signals)
+    before, signal = matcher.feed(text)
+    return (before, signal) if signal is not None else (before + matcher.flush(), None)
+
+
+def get_stop_sequences(signals:List[str]) -> Dict[str, str]:
+    """Gets the stop sequences that stand for the signals in an API with case-sensitive stop sequences
+
+    Only the casings most likely to be written are sent, the other casings are caught by the StopSignalMatcher that
+    watch_stop_signals runs over the stream
+
+    Args:
+        signals (List[str]): the signals
+
+    Returns:
+        Dict[str, str]: maps each stop sequence to its signal
+    """
+    sequences = {}
+    for signal in signals:
+        for sequence in (signal, signal.lower(), signal.upper()):
+            sequences.setdefault(sequence, signal)
+    return sequences
+
+
+def watch_stop_signals(stream_message:Callable) -> Callable:
+    """Decorator that adds the `stop_signals` keyword to AICompanyGateway.stream_message
+
+    The stream ends at the first signal, which is left out of the text and reported out of band in the call's metrics
+    (CallMetrics.stop_signal), so the caller doesn't need to scan the text. The signals are found case-insensitively by a
+    StopSignalMatcher, which closes the stream once one is found. Gateways with native_stop_signals also send the signals
+    as stop sequences, so that the API itself stops at their usual casings (as written, lower and upper case), and the
+    matcher catches any other casing
+
+    Args:
+        stream_message (Callable): the gateway's stream_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(stream_message)
+    def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, stop_signals:List[str]=None, **kwargs) -> Generator[str, None, None]:
+        if not stop_signals:
+            yield from stream_message(self, model, messages, max_tokens, system_message, **kwargs)
+            return
+        metrics = kwargs['metrics'] = kwargs.get('metrics') or CallMetrics()
+
+        sequences = None
+        if self.native_stop_signals:
+            sequences = get_stop_sequences(stop_signals)
+            kwargs['stop_sequences'] = list(sequences)
+
+        matcher = StopSignalMatcher(stop_signals)
+        stream = stream_message(self, model, messages, max_tokens, system_message, **kwargs)
+        try:
+            for delta in stream:
+                text, signal = matcher.feed(delta or "")
+                if text:
+                    yield text
+                if signal is not None:
+                    # recorded before the stream is closed, so that the call isn't counted as cancelled
+                    metrics.record_usage(stop_reason='stop_sequence', stop_signal=signal)
+                    # closing the stream aborts its HTTP response, so the model stops writing past the signal
+                    metrics.cancelled_by = 'stop_signal'
+                    return
+            text = matcher.flush()
+            if text:
+                yield text
+            if sequences is not None:
+                # the API reports the stop sequence it stopped at
+                metrics.stop_signal = sequences.get(metrics.stop_signal)
+        finally:
+            stream.close()
+    return wrapper
+
+
+def awatch_stop_signals(astream_message:Callable) -> Callable:
+    """Decorator that adds the `stop_signals` keyword to AICompanyGateway.astream_message
+
+    Works like watch_stop_signals
+
+    Args:
+        astream_message (Callable): the gateway's astream_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(astream_message)
+    async def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, stop_signals:List[str]=None, **kwargs) -> AsyncGenerator[str, None]:
+        if not stop_signals:
+            async for delta in astream_message(self, model, messages, max_tokens, system_message, **kwargs):
+                yield delta
+            return
+        metrics = kwargs['metrics'] = kwargs.get('metrics') or CallMetrics()
+
+        sequences = None
+        if self.native_stop_signals:
+            sequences = get_stop_sequences(stop_signals)
+            kwargs['stop_sequences'] = list(sequences)
+
+        matcher = StopSignalMatcher(stop_signals)
+        stream = astream_message(self, model, messages, max_tokens, system_message, **kwargs)
+        try:
+            async for delta in stream:
+                text, signal = matcher.feed(delta or "")
+                if text:
+                    yield text
+                if signal is not None:
+                    metrics.record_usage(stop_reason='stop_sequence', stop_signal=signal)
+                    metrics.cancelled_by = 'stop_signal'
+                    return
+            text = matcher.flush()
+            if text:
+                yield text
+            if sequences is not None:
+                metrics.stop_signal = sequences.get(metrics.stop_signal)
+        finally:
+            await stream.aclose()
+    return wrapper
@@ -0,0 +1,102 @@
+import base64
+import re
+from typing import Dict, List, Tuple
+
+class ContextBuilder:
+    """Keeps the messages sent to the AI within an input token budget
+
+    The system prompt, the attached document and the most recent turns are always sent. If the whole transcript doesn't fit
+    in the budget, the oldest turns are left out. Token counts are estimates (about 4 characters per token) made once per
+    transcript row, so checking the budget doesn't get slower as the conversation grows
+    """
+
+    def __init__(self, max_input_tokens:int, pinned_turns:int=6, chars_per_token:float=4.0, tokens_per_pdf_page:int=1500) -> None:
+        """Sets up the object
+
+        Args:
+            max_input_tokens (int): the max number of input tokens to send to the AI
+            pinned_turns (int, optional): the number of most recent transcript rows that are always sent. Defaults to 6.
+            chars_per_token (float, optional): the number of characters per token used for the estimates. Defaults to 4.0.
+            tokens_per_pdf_page (int, optional): the number of tokens per page of an attached PDF used for the estimates. Defaults to 1500.
+        """
+        self.max_input_tokens = max_input_tokens
+        self.pinned_turns = pinned_turns
+        self.chars_per_token = chars_per_token
+        self.tokens_per_pdf_page = tokens_per_pdf_page
+
+        # token estimates of the transcript rows and of the attachment, so that each is only estimated once
+        self.__row_tokens = {}
+        self.__attachment_tokens = {}
+
+
+    def estimate_tokens(self, text:str) -> int:
+        """Estimates the number of tokens in some text
+
+        Args:
+            text (str): the text
+
+        Returns:
+            int: the estimated number of tokens
+        """
+        return int(len(text) / self.chars_per_token) + 1
+
+
+    def estimate_row_tokens(self, row:Dict) -> int:
+        """Estimates the number of tokens in a transcript row, reusing the estimate if the row has been seen before
+
+        Args:
+            row (Dict): the transcript row
+
+        Returns:
+            int: the estimated number of tokens
+        """
+        key = (row.get('time'), row['role'], len(row['content']))
+        if key not in self.__row_tokens:
+            self.__row_tokens[key] = self.estimate_tokens(row['content'])
+        return self.__row_tokens[key]
+
+
+    def estimate_attachment_tokens(self, content:str) -> int:
+        """Estimates the number of tokens in an attached base64 PDF from its number of pages
+
+        Args:
+            content (str): the base64 content of the PDF
+
+        Returns:
+            int: the estimated number of tokens
+        """
+        if not content:
+            return 0
+        key = (len(content), content[-64:])
+        if key not in self.__attachment_tokens:
+            pdf = base64.b64decode(content)
+            pages = len(re.findall(rb"/Type\s*/Page(?!s)", pdf))
+            self.__attachment_tokens[key] = max(pages, 1) * self.tokens_per_pdf_page
+        return self.__attachment_tokens[key]
+
+
+    def select_rows(self, transcript_history:List[Dict], system_message:str=None, attachment:str=None) -> Tuple[List[Dict], int, int]:
+        """Selects the transcript rows to send to the AI within the budget
+
+        The oldest rows are left out in pairs so that the remaining rows still alternate between the user and the assistant
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+            system_message (str, optional): the system message. Defaults to None.
+            attachment (str, optional): the base64 content of the attached PDF, if any. Defaults to None.
+
+        Returns:
+            Tuple[List[Dict], int, int]: the rows to send, the estimated number of input tokens sent, and the estimated number of tokens saved
+        """
+        row_tokens = [self.estimate_row_tokens(row) for row in transcript_history]
+        pinned_tokens = self.estimate_tokens(system_message or "") + self.estimate_attachment_tokens(attachment)
+        total_tokens = pinned_tokens + sum(row_tokens)
+
+        # leave out the oldest pairs of rows until the rest fits, never touching the pinned turns
+        start = 0
+        last_droppable = len(transcript_history) - self.pinned_turns
+        saved_tokens = 0
+        while total_tokens - saved_tokens > self.max_input_tokens and start + 2 <= last_droppable:
+            saved_tokens += row_tokens[start] + row_tokens[start + 1]
+            start += 2
+        return transcript_history[start:], total_tokens - saved_tokens, saved_tokens
\ No newline at end of file
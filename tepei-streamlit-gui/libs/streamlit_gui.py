@@ -1,14 +1,7 @@
 import streamlit as st 
-import streamlit_authenticator as stauth 
-from datetime import datetime
-import pytz 
+from datetime import datetime, timezone
 import hashlib 
-import yaml 
 from typing import Dict, Generator, Tuple, List 
-import dropbox 
-import dropbox.files 
-import pandas as pd 
-import pypandoc 
 import io 
 import csv 
 from pathlib import Path 
@@ -17,13 +10,29 @@ import logging
 import time 
 import tempfile 
 import base64 
+# pandas, pypandoc, dropbox, pytz, yaml and the authenticator are imported where they are used, 
+# since most of them are only needed on rare paths and they slow down cold starts 
 
 from .ai_gateways.gateway import AICompanyGateway 
+from .ai_gateways.gateway_pool import get_shared_pool 
+from .ai_gateways.telemetry import CallMetrics 
+from .ai_gateways.hedging import get_shared_hedge_policy 
+from .ai_gateways.routing import ModelRouter, get_shared_model_router 
+from .ai_gateways.stop_signals import find_stop_signal 
+from .ai_gateways.coalesce import coalesce_stream 
+from .ai_gateways.cancellation import CancelToken, get_shared_cancellation_tracker 
+from .ai_gateways.attachments import Attachment 
 from .logger import setup_logger 
+from .context_builder import ContextBuilder 
+from .summary_pregenerator import SummaryPregenerator 
+from .conversation_memory import ConversationMemory, CONDENSE_PROMPT 
+from .stream_renderer import StreamRenderer 
+from .history_view import HistoryView 
+from .generation_worker import Generation, GenerationWorker 
 
 
 class StreamlitGUI: 
-    def __init__(self, page_title:str, page_icon:str, ai_company:str, ai_model:str, max_tokens:int, system_message:str, generate_summary_prompt:str, auth_required:bool, interviewer_avatar:str, user_avatar:str, first_interviewer_message:str, closing_messages:Dict[str, str], dropbox_path:str, interview_instructions:str) -> None: 
+    def __init__(self, page_title:str, page_icon:str, ai_company:str, ai_model:str, max_tokens:int, system_message:str, generate_summary_prompt:str, auth_required:bool, interviewer_avatar:str, user_avatar:str, first_interviewer_message:str, closing_messages:Dict[str, str], dropbox_path:str, interview_instructions:str, client_pool_opts:Dict=None, response_cache_opts:Dict=None, max_input_tokens:int=None, pinned_turns:int=6, hedge_opts:Dict=None, rate_limits:Dict=None, stream_coalesce_opts:Dict=None, summary_pregeneration_opts:Dict=None, memory_opts:Dict=None, model_routing_opts:Dict=None, stream_render_opts:Dict=None, history_view_opts:Dict=None, generation_worker_opts:Dict=None, profile_reruns:bool=False) -> None: 
         """Set up the object
 
         Args:
@@ -40,6 +49,20 @@ class StreamlitGUI:
             closing_messages (Dict[str, str]): a dict that maps closing code to closing message 
             dropbox_path (str): the path to the dropbox data folder to store the transcripts 
             interview_instructions (str): the instructions to display for the bot 
+            client_pool_opts (Dict, optional): the connection pool limits, keep-alive and timeouts of the shared AI client. Defaults to None.
+            response_cache_opts (Dict, optional): options for the cache of AI responses, e.g. for repeated summary requests. Defaults to None (no caching).
+            max_input_tokens (int, optional): the budget of input tokens for each chat turn, older turns are left out beyond it. Defaults to None (no budget).
+            pinned_turns (int, optional): the number of most recent transcript rows that are always sent to the AI. Defaults to 6.
+            hedge_opts (Dict, optional): the secondary 'ai_company' and 'ai_model' to hedge to if the first token is late, and the options of the HedgePolicy. Defaults to None (no hedging).
+            rate_limits (Dict, optional): the rate limits shared by every session, by company then model ('*' for any). Defaults to None (no limits).
+            stream_coalesce_opts (Dict, optional): options of the ChunkCoalescer that batches the streamed deltas before they are rendered. Defaults to None (render every delta).
+            summary_pregeneration_opts (Dict, optional): the 'min_user_turns' after which the summary document is generated in the background after every turn, and the 'max_workers' of the SummaryPregenerator. Defaults to None (no pre-generation).
+            memory_opts (Dict, optional): the cheap 'ai_model' (and its 'max_tokens') that condenses older turns into a rolling summary, an optional condensing 'prompt', and the options of the ConversationMemory. Defaults to None (no rolling memory).
+            model_routing_opts (Dict, optional): the options of the ModelRouter that sends trivial turns and cheap tasks (e.g. the summary) to a fast model. Defaults to None (every call uses ai_model).
+            stream_render_opts (Dict, optional): options of the StreamRenderer that displays the streamed message, e.g. its 'cursor'. Defaults to None (the defaults of the StreamRenderer).
+            history_view_opts (Dict, optional): options of the HistoryView that renders only the recent messages in full and collapses the older ones into pages. Defaults to None (render every message).
+            generation_worker_opts (Dict, optional): the 'max_workers' of the GenerationWorker that streams the AI messages in the background, and the 'poll_interval' in seconds at which the chat shows the message being written. Defaults to None (the defaults of the GenerationWorker, polled every 0.2s).
+            profile_reruns (bool, optional): whether to print how long each run of the page, the chat and the sidebar buttons takes to the server's console. Defaults to False.
         """
         # set the global vars
         self.page_title = page_title 
@@ -56,6 +79,20 @@ class StreamlitGUI:
         self.closing_messages = closing_messages 
         self.dropbox_path = dropbox_path 
         self.interview_instructions = interview_instructions
+        self.client_pool_opts = client_pool_opts or {} 
+        self.response_cache_opts = response_cache_opts 
+        self.max_input_tokens = max_input_tokens 
+        self.pinned_turns = pinned_turns 
+        self.hedge_opts = hedge_opts 
+        self.rate_limits = rate_limits 
+        self.stream_coalesce_opts = stream_coalesce_opts 
+        self.summary_pregeneration_opts = summary_pregeneration_opts 
+        self.memory_opts = memory_opts 
+        self.model_routing_opts = model_routing_opts 
+        self.stream_render_opts = stream_render_opts or {} 
+        self.history_view = HistoryView(**history_view_opts) if history_view_opts else None 
+        self.generation_worker_opts = generation_worker_opts or {} 
+        self.profile_reruns = profile_reruns 
 
         # set up the page 
         st.set_page_config(
@@ -65,14 +102,15 @@ class StreamlitGUI:
 
         if self.auth_required: 
             # set up the authentication 
+            import yaml 
             stauth_config = yaml.safe_load(st.secrets['STREAMLIT_AUTHENTICATOR_CONFIG'])
+            import streamlit_authenticator as stauth 
             self.authenticator = stauth.Authenticate(credentials=stauth_config['credentials'], auto_hash=False)
 
-        # create some containers for the header (where the title will live) and for the chat (where chat history will live) 
+        # create some containers for the header (where the title will live) and for the other sections, the chat creates its own (see display_chat) 
         self.header_container = st.container() 
         self.error_container = st.container() 
         self.instructions_container = st.container() 
-        self.chat_container = st.container() 
 
 
     def setup(self) -> None: 
@@ -83,27 +121,27 @@ class StreamlitGUI:
         self.setup_session_vars() 
         self.display_login_page() 
         self.display_instructions_expander() 
-        self.display_load_past_session() 
-        self.display_restart_interview_button()
-        self.display_generate_summary_button() 
-        self.display_user_input() 
+        with st.sidebar: 
+            # the sidebar buttons rerun on their own 
+            self.display_sidebar_actions() 
 
 
     def run(self) -> None: 
-        """Main function that runs the whole page"""
+        """Main function that runs the whole page
+
+        The chat and the sidebar buttons are fragments (see display_chat and display_sidebar_actions), so a chat turn or a 
+        button press only reruns its own region. The whole page only reruns for changes that affect all of it 
+        """
+        start_time = time.perf_counter() 
         self.setup() 
-        self.display_message_history() 
         if st.session_state.reached_error: 
             self.display_error_message() 
-        else: 
-            if st.session_state.interview_status and not st.session_state.first_instructions_shown: 
-                self.display_instructions()
-            if st.session_state.interview_status: 
-                self.stream_initial_message() 
-            if st.session_state.interview_status and not st.session_state.first_instructions_shown: 
-                time.sleep(1) 
-                # change flag so that the dialog doesn't show up anymore 
-                st.session_state.first_instructions_shown = True 
+        elif st.session_state.interview_status and not st.session_state.first_instructions_shown: 
+            self.display_instructions()
+            # change flag so that the dialog doesn't show up anymore 
+            st.session_state.first_instructions_shown = True 
+        self.display_chat() 
+        self.log_run_time('Page', start_time) 
 
 
     # --------------------------------------------------------------------------
@@ -136,7 +174,7 @@ class StreamlitGUI:
 
         if 'session_id' not in st.session_state and 'username' in st.session_state: 
             # store the start time of the interview 
-            st.session_state.start_time = datetime.now(pytz.timezone('UTC')).timestamp() 
+            st.session_state.start_time = datetime.now(timezone.utc).timestamp() 
 
             # create and store the session ID of the interview 
             data = f"{st.session_state.username}+{st.session_state.start_time}"
@@ -164,6 +202,23 @@ class StreamlitGUI:
             # object to store the uploaded paper 
             st.session_state.paper_content = self.get_paper_content() 
 
+        if 'context_builder' not in st.session_state and self.max_input_tokens: 
+            # object that keeps the messages sent to the AI within the input token budget 
+            st.session_state.context_builder = ContextBuilder(max_input_tokens=self.max_input_tokens, pinned_turns=self.pinned_turns) 
+
+        if 'summary_pregenerator' not in st.session_state and self.summary_pregeneration_opts: 
+            # object that generates the summary document in the background 
+            st.session_state.summary_pregenerator = SummaryPregenerator(max_workers=self.summary_pregeneration_opts.get('max_workers', 2)) 
+
+        if 'conversation_memory' not in st.session_state and self.memory_opts: 
+            # object that condenses the older turns into a summary sent in place of them 
+            memory_opts = {k: v for k, v in self.memory_opts.items() if k in ('keep_turns', 'condense_every', 'phase_boundary', 'max_workers')} 
+            st.session_state.conversation_memory = ConversationMemory(**memory_opts) 
+
+        if 'generation_worker' not in st.session_state: 
+            # object that streams the AI messages in the background, decoupled from the script run 
+            st.session_state.generation_worker = GenerationWorker(max_workers=self.generation_worker_opts.get('max_workers', 32)) 
+
         if 'reached_error' not in st.session_state: 
             # flag for whether we reached an error or not 
             st.session_state.reached_error = False 
@@ -225,80 +280,149 @@ class StreamlitGUI:
         """Displays the restart interview"""
         if not st.session_state.show_login_form: 
             # add 'Restart' button to the side bar
-            with st.sidebar: 
-                if st.session_state.show_confirm_restart: 
-                    # show confirmation message 
-                    st.markdown("**Are you sure you want to restart?**\nYou will be starting the conversation from scratch")
-                    # add the button and runs self.on_restart_button when hit 
-                    st.button(
-                        label="**Confirm**", 
-                        help='Confirm restarting the interview', 
-                        on_click=self.on_restart_button, 
-                        type='primary'
-                    )
-                else: 
-                    st.markdown("To restart the interview from scratch, click restart below")
-                    # add the button and runs self.on_restart_button when hit 
-                    st.button(
-                        label="Restart", 
-                        help='Restart the interview', 
-                        on_click=self.on_restart_button
-                    )
+            if st.session_state.show_confirm_restart: 
+                # show confirmation message 
+                st.markdown("**Are you sure you want to restart?**\nYou will be starting the conversation from scratch")
+                # add the button and runs self.on_restart_button when hit 
+                st.button(
+                    label="**Confirm**", 
+                    help='Confirm restarting the interview', 
+                    on_click=self.on_restart_button, 
+                    type='primary'
+                )
+            else: 
+                st.markdown("To restart the interview from scratch, click restart below")
+                # add the button and runs self.on_restart_button when hit 
+                st.button(
+                    label="Restart", 
+                    help='Restart the interview', 
+                    on_click=self.on_restart_button
+                )
 
 
     def display_generate_summary_button(self) -> None: 
         """Displays the generate summary button"""
         if not st.session_state.show_login_form and st.session_state.interview_status and not st.session_state.reached_error: 
             # button is always displayed unless we are in the login page to allow people to generate the document at any time 
-            with st.sidebar: 
-                st.markdown("To generate a summary document of the interview, click generate below") 
-                # add the button and runs self.on_generate_summary_button when hit 
-                st.button(
-                    label="Generate", 
-                    help='Generate summary of the interview', 
-                    on_click=self.on_generate_summary_button
-                )
+            st.markdown("To generate a summary document of the interview, click generate below") 
+            # add the button and runs self.on_generate_summary_button when hit 
+            st.button(
+                label="Generate", 
+                help='Generate summary of the interview', 
+                on_click=self.on_generate_summary_button
+            )
 
 
     def display_load_past_session(self) -> None: 
         """Displays a button that can load a past session"""
         if not st.session_state.show_login_form: 
-            with st.sidebar: 
-                st.markdown("To load a past session, click below")
-                st.button(
-                    label="Load a Past Session", 
-                    help="Check for past sessions and load them", 
-                    on_click=self.on_load_past_session_button
-                )
+            st.markdown("To load a past session, click below")
+            st.button(
+                label="Load a Past Session", 
+                help="Check for past sessions and load them", 
+                on_click=self.on_load_past_session_button
+            )
 
 
     def display_message_history(self) -> None: 
-        """Displays the full message history so far"""
+        """Displays the message history so far 
+
+        With history_view_opts, only the recent messages are rendered in full, and the older ones are collapsed into 
+        pages behind a toggle, which are only rendered (and sent to the browser) while they are open 
+        """
         if not st.session_state.show_login_form: 
             # always show the message history unless we are showing the login page 
             with self.chat_container: 
-                for message in st.session_state.transcript_history: 
-                    # first set the avatar 
-                    if message['role'] == 'assistant': 
-                        avatar = self.interviewer_avatar 
-                    elif message['role'] == 'user': 
-                        avatar = self.user_avatar 
+                if self.history_view is None: 
+                    pages, recent = [], st.session_state.transcript_history 
+                else: 
+                    pages, recent = self.history_view.get_pages(st.session_state.transcript_history) 
+                for page in pages: 
+                    # the toggle is in the chat fragment, so opening a page only reruns the chat 
+                    if st.toggle(page['label'], key=page['key']): 
+                        for message in page['rows']: 
+                            self.display_message(message) 
+                for message in recent: 
+                    self.display_message(message) 
+
+
+    def display_message(self, message:Dict) -> None: 
+        """Displays a message of the history 
+
+        Args:
+            message (Dict): the transcript row of the message 
+        """
+        # first set the avatar 
+        if message['role'] == 'assistant': 
+            avatar = self.interviewer_avatar 
+        elif message['role'] == 'user': 
+            avatar = self.user_avatar 
+
+        # now display the message 
+        with st.chat_message(message['role'], avatar=avatar): 
+            st.markdown(message['content']) 
 
-                    # now display the message 
-                    with st.chat_message(message['role'], avatar=avatar): 
-                        st.markdown(message['content']) 
 
+    def display_user_input(self) -> str: 
+        """Display the user input 
 
-    def display_user_input(self) -> None: 
-        """Display the user input """
+        Returns:
+            str: the message the user submitted in this run, None if there is none 
+        """
         if st.session_state.interview_status and not st.session_state.reached_error and not st.session_state.found_closing_msg: 
             # only display the user input section if the interview is active 
-            # display the input section and runs self.on_user_input_submit when text submitted 
-            st.chat_input(
+            # the submitted text is answered by display_chat, in the same rerun of the chat fragment 
+            return st.chat_input(
                 placeholder="Your message here", 
                 key="user_input", 
-                on_submit=self.on_user_input_submit
+                # one message at a time: the input is back once the AI's message is saved 
+                disabled=st.session_state.generation_worker.get() is not None 
             )
+        return None 
+
+
+    @st.fragment 
+    def display_chat(self) -> None: 
+        """Displays the chat: the message history, the initial message, the user input and the message being written 
+
+        The chat is a fragment, so submitting a message only reruns the chat instead of the whole page. The answer is 
+        streamed by the background worker of the session, and shown by display_generation, a fragment of its own that 
+        polls the worker on a timer. An error or the end of the interview, which change the rest of the page, rerun the 
+        whole page 
+        """
+        start_time = time.perf_counter() 
+        # created in the fragment, so that each of its reruns draws the chat from scratch 
+        self.chat_container = st.container() 
+        self.display_message_history() 
+        if st.session_state.interview_status and not st.session_state.reached_error: 
+            self.stream_initial_message() 
+        if self.display_user_input(): 
+            self.on_user_input_submit() 
+            self.log_run_time('Chat', start_time) 
+            if st.session_state.reached_error: 
+                st.rerun() 
+            # draw the chat again, with the user message in the history and the message being written below it 
+            st.rerun(scope='fragment') 
+        if st.session_state.generation_worker.get() is not None: 
+            with self.chat_container: 
+                # only this fragment reruns while the AI writes, every poll_interval seconds 
+                st.fragment(self.display_generation, run_every=self.generation_worker_opts.get('poll_interval', 0.2))() 
+
+
+    @st.fragment 
+    def display_sidebar_actions(self) -> None: 
+        """Displays the buttons of the sidebar. Call it within st.sidebar 
+
+        The buttons are a fragment, so pressing one only reruns the buttons (and opens its dialog) instead of the whole page. 
+        A button whose callback changes the rest of the page sets the 'rerun_page' flag 
+        """
+        start_time = time.perf_counter() 
+        self.display_load_past_session() 
+        self.display_restart_interview_button()
+        self.display_generate_summary_button() 
+        self.log_run_time('Sidebar', start_time) 
+        if st.session_state.pop('rerun_page', False): 
+            st.rerun() 
 
 
     def display_error_message(self) -> None: 
@@ -337,6 +461,9 @@ class StreamlitGUI:
         # reset reached error 
         st.session_state.reached_error = False 
 
+        # stop the message being written, if any 
+        if 'generation_worker' in st.session_state: 
+            st.session_state.generation_worker.clear(cancel=True) 
         # remove any other session variable to start over 
         for key in ['transcript_history', 'start_time', 'session_id', 'log', 'log_stream', 'show_confirm_restart', 'found_closing_msg', 'paper_content']: 
             if key in st.session_state:
@@ -344,29 +471,34 @@ class StreamlitGUI:
 
 
     def on_user_input_submit(self) -> None: 
-        """Function that runs when user input is submitted"""
+        """Function that runs when user input is submitted: saves it and starts streaming the answer in the background"""
         try: 
             # get the user inputs 
             text = st.session_state.user_input 
 
             self.log("warning", f"User input: {text}", st.session_state.to_dict())
 
-            # display the user input 
-            with self.chat_container: 
-                message = st.chat_message('user', avatar=self.user_avatar) 
-                message.markdown(text)
-
-            # save the user input  
+            # save the user input, display_chat then shows it in the history 
             self.save_msg_to_session('user', text)
 
             # save to the transcript so far to dropbox 
             thread = threading.Thread(target=self.save_transcript_to_dropbox, args=(st.session_state.to_dict(),)) 
             thread.start() 
 
-            # get the response from the AI bot and stream the message 
-            client = AICompanyGateway.factory(company=self.ai_company, api_key=st.secrets[f"API_KEY_{self.ai_company.upper()}"]) 
-            stream = client.stream_message(model=self.ai_model, messages=self.get_messages_for_ai(), max_tokens=self.max_tokens, system_message=self.system_message)
-            self.stream_message(stream) 
+            # get the response from the AI bot and stream the message in the background 
+            metrics = CallMetrics() 
+            # lets the stop button close the HTTP stream of the call 
+            cancel = CancelToken() 
+            request = {'model': self.ai_model, 'messages': self.get_messages_for_ai(), 'max_tokens': self.max_tokens, 'system_message': self.system_message, 'cache_key': st.session_state.session_id, 'stop_signals': self.get_stop_signals()} 
+            router = self.get_model_router() 
+            if router is not None: 
+                # trivial turns are served by the fast model 
+                request = router.route(self.ai_company, request, metrics=metrics) 
+            if self.hedge_opts: 
+                stream = self.hedge_stream_message(request, metrics, cancel=cancel) 
+            else: 
+                stream = self.get_ai_client().stream_message(**request, metrics=metrics, cancel=cancel)
+            self.start_generation(stream, metrics=metrics, cancel=cancel) 
         except Exception as e: 
             st.session_state.transcript_history = st.session_state.transcript_history[:-1] 
             st.session_state.reached_error = True 
@@ -411,7 +543,8 @@ class StreamlitGUI:
                     use_container_width=False
                 )
                 if confirm_button: 
-                    # when confirmed, load the session 
+                    # when confirmed, load the session, dropping the message being written, if any 
+                    st.session_state.generation_worker.clear(cancel=True) 
                     st.session_state.transcript_history = past_transcripts_map[session_chosen]['transcript'] 
                     st.session_state.session_id = past_transcripts_map[session_chosen]['transcript'][0]['session_id'] 
                     st.rerun() 
@@ -428,51 +561,41 @@ class StreamlitGUI:
         self.log("warning", "Generating summary document", st.session_state.to_dict())
         # start the loading spinner and show the time elapsed so far 
         with st.spinner("Generating document", show_time=True):
+            message = st.empty() 
+            message.markdown("This process may take a few minutes. Please be patient and **do not press \"x\" or close this window**.")
             try: 
-                message = st.empty() 
-                message.markdown("This process may take a few minutes. Please be patient and **do not press \"x\" or close this window**.")
-                # ask the AI to generate a summary 
-                client = AICompanyGateway.factory(company=self.ai_company, api_key=st.secrets[f"API_KEY_{self.ai_company.upper()}"]) 
-                generate_message = [{'role': 'user', 'content': self.generate_summary_prompt}]
-                summary = client.create_message(
-                    model=self.ai_model, 
-                    messages=self.get_messages_for_ai() + generate_message, 
-                    max_tokens=self.max_tokens, 
-                    system_message=self.system_message 
-                )
-
-                # check if there are any closing messages in there 
-                _, summary = self.check_closing_messages(summary) 
+                request = self.get_summary_request() 
             except Exception as e: 
                 st.session_state.reached_error = True 
                 self.log("error", f"Error asking AI to generate summary: {e}", st.session_state.to_dict())
                 return 
 
-            try: 
-                # add the title to the top 
-                summary = f"# Interview Summary\n\nGenerated on {datetime.now(pytz.timezone('UTC')).strftime('%Y-%m-%d %H:%M:%S UTC')} by {st.session_state.name}\n\n" + summary 
-
-                # convert the markdown into word doc 
-                with tempfile.NamedTemporaryFile(suffix=".docx", delete=True) as tmp_file: 
-                    temp_path = tmp_file.name 
-
-                    pypandoc.convert_text(
-                        source=summary,
-                        to="docx",
-                        format="md",
-                        outputfile=temp_path 
-                    )
-
-                    # read in the bytes 
-                    with open(temp_path, "rb") as f: 
-                        doc_content = f.read() 
-
-                    doc_bytes = io.BytesIO(doc_content) 
-
-            except Exception as e: 
-                st.session_state.reached_error = True 
-                self.log("error", f"Error creating docx document: {e}", st.session_state.to_dict())
-                return 
+            doc_content = None 
+            if 'summary_pregenerator' in st.session_state: 
+                # serve the document generated in the background if the transcript hasn't changed since 
+                doc_content = st.session_state.summary_pregenerator.get(SummaryPregenerator.get_transcript_hash(request)) 
+                self.log("warning", f"Summary pre-generation stats: {st.session_state.summary_pregenerator.stats()}", st.session_state.to_dict())
+
+            if doc_content is None: 
+                try: 
+                    # ask the AI to generate a summary 
+                    summary = self.generate_summary(self.get_ai_client(), request) 
+                except Exception as e: 
+                    st.session_state.reached_error = True 
+                    self.log("error", f"Error asking AI to generate summary: {e}", st.session_state.to_dict())
+                    return 
+
+                try: 
+                    doc_content = self.convert_summary_to_docx(summary, st.session_state.name) 
+                except Exception as e: 
+                    st.session_state.reached_error = True 
+                    self.log("error", f"Error creating docx document: {e}", st.session_state.to_dict())
+                    return 
+
+            doc_bytes = io.BytesIO(doc_content) 
+
+        if self.get_model_router() is not None: 
+            self.log("warning", f"Model routing stats: {self.get_model_router().stats()}", st.session_state.to_dict())
 
         # save the document to dropbox 
         thread = threading.Thread(target=self.save_summary_to_dropbox, args=(st.session_state.to_dict(), doc_bytes)) 
@@ -491,11 +614,132 @@ class StreamlitGUI:
         )
 
 
+    def get_summary_request(self) -> Dict: 
+        """Gets the keyword arguments of the create_message call that generates the summary from the whole transcript 
+
+        Returns:
+            Dict: the keyword arguments 
+        """
+        generate_message = [{'role': 'user', 'content': self.generate_summary_prompt}]
+        return {
+            'model': self.ai_model, 
+            'messages': self.get_messages_for_ai(apply_budget=False) + generate_message, 
+            'max_tokens': self.max_tokens, 
+            'system_message': self.system_message, 
+            # deterministic, so that the response cache can serve the summary again 
+            'temperature': 0, 
+            'cache_key': st.session_state.session_id 
+        }
+
+
+    def generate_summary(self, client:AICompanyGateway, request:Dict) -> str: 
+        """Asks the AI to generate the summary. Doesn't use the session state, so that it can run in a background thread 
+
+        Args:
+            client (AICompanyGateway): the AI client 
+            request (Dict): the keyword arguments of create_message (see get_summary_request) 
+
+        Returns:
+            str: the summary in markdown 
+        """
+        router = self.get_model_router() 
+        if router is not None: 
+            summary = router.create_message(client, request, task='summary') 
+        else: 
+            summary = client.create_message(**request) 
+        # check if there are any closing messages in there 
+        _, summary = self.check_closing_messages(summary) 
+        return summary 
+
+
+    def convert_summary_to_docx(self, summary:str, name:str) -> bytes: 
+        """Converts the summary into a word document with a title. Doesn't use the session state, so that it can run in a background thread 
+
+        Args:
+            summary (str): the summary in markdown 
+            name (str): the name of the user the summary is generated for 
+
+        Returns:
+            bytes: the docx data 
+        """
+        # add the title to the top 
+        summary = f"# Interview Summary\n\nGenerated on {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')} by {name}\n\n" + summary 
+
+        # convert the markdown into word doc 
+        with tempfile.NamedTemporaryFile(suffix=".docx", delete=True) as tmp_file: 
+            temp_path = tmp_file.name 
+
+            import pypandoc 
+            pypandoc.convert_text(
+                source=summary,
+                to="docx",
+                format="md",
+                outputfile=temp_path 
+            )
+
+            # read in the bytes 
+            with open(temp_path, "rb") as f: 
+                return f.read() 
+
+
+    def pregenerate_summary(self) -> None: 
+        """Starts generating the summary document in the background, once the interview has the number of answers 
+        set in summary_pregeneration_opts, so that the generate button can serve it right away 
+        """
+        if 'summary_pregenerator' not in st.session_state or not st.session_state.interview_status: 
+            return 
+        user_turns = sum(1 for row in st.session_state.transcript_history if row['role'] == 'user') 
+        if user_turns < self.summary_pregeneration_opts.get('min_user_turns', 0): 
+            return 
+        request = self.get_summary_request() 
+        client, name = self.get_ai_client(), st.session_state.name 
+        st.session_state.summary_pregenerator.submit(
+            SummaryPregenerator.get_transcript_hash(request), 
+            lambda: self.convert_summary_to_docx(self.generate_summary(client, request), name) 
+        )
+
+
+    def update_memory(self) -> None: 
+        """Starts condensing the completed older turns into the rolling memory in the background, once enough of them are due"""
+        if 'conversation_memory' not in st.session_state: 
+            return 
+        client = self.get_ai_client() 
+        memory = st.session_state.conversation_memory 
+        for error in memory.pop_errors(): 
+            # the raw turns are sent until a condensation succeeds 
+            self.log("error", f"Error updating the conversation memory: {error}", st.session_state.to_dict())
+        if memory.update(st.session_state.transcript_history, lambda summary, rows: self.condense_turns(client, summary, rows)): 
+            self.log("warning", f"Condensing older turns into the conversation memory (stats: {memory.stats()})", st.session_state.to_dict())
+
+
+    def condense_turns(self, client:AICompanyGateway, summary:str, rows:List[Dict]) -> str: 
+        """Asks the cheap model of memory_opts to roll the summary of the conversation forward. Doesn't use the session state, so that it can run in a background thread 
+
+        Args:
+            client (AICompanyGateway): the AI client 
+            summary (str): the previous summary, None if there is none yet 
+            rows (List[Dict]): the transcript rows to add to the summary 
+
+        Returns:
+            str: the new summary 
+        """
+        transcript = "\n\n".join(f"{row['role'].upper()}: {row['content']}" for row in rows) 
+        prompt = self.memory_opts.get('prompt', CONDENSE_PROMPT).format(summary=summary or "(none yet)", transcript=transcript) 
+        return client.create_message(
+            model=self.memory_opts['ai_model'], 
+            messages=[{'role': 'user', 'content': prompt}], 
+            max_tokens=self.memory_opts.get('max_tokens', 1000) 
+        )
+
+
     def on_restart_button(self) -> None: 
         """Function that runs when the restart button is hit"""
         if st.session_state.show_confirm_restart: 
             # if the user clicked confirm then restart
             self.log("warning", "Restarting interview", st.session_state.to_dict())
+            # stop the message being written, if any 
+            if 'generation_worker' in st.session_state: 
+                st.session_state.generation_worker.clear(cancel=True) 
             # reset some session state variables 
             for key in ['transcript_history', 'start_time', 'session_id', 'log', 'log_stream', 'show_confirm_restart', 'found_closing_msg', 'paper_content']: 
                 if key in st.session_state:
@@ -506,6 +750,8 @@ class StreamlitGUI:
             st.session_state.reached_error = False 
             # reset to original restart button
             st.session_state.show_confirm_restart = False 
+            # the button is in a fragment, so ask for the whole page to be redrawn 
+            st.session_state.rerun_page = True 
         else: 
             # ask for confirmation 
             st.session_state.show_confirm_restart = True 
@@ -513,69 +759,150 @@ class StreamlitGUI:
 
 
     def stream_initial_message(self) -> None: 
-        """Streams the initial message from the AI"""
+        """Shows the initial message of the interviewer, which is fixed, so it is rendered at once"""
         if not st.session_state.transcript_history: 
             # no messages so far, stream initial message 
             self.log("warning", "Streaming initial message", st.session_state.to_dict())
             with self.chat_container: 
                 with st.chat_message('assistant', avatar=self.interviewer_avatar): 
-                    # stream the message 
-                    streamlit_msg = st.empty() 
-                    for i in range(0, len(self.first_interviewer_message), len(self.first_interviewer_message) // 10): 
-                        streamlit_msg.markdown(self.first_interviewer_message[:i] + "▌")
-                        time.sleep(0.03)
-                    streamlit_msg.markdown(self.first_interviewer_message)
+                    st.markdown(self.first_interviewer_message)
             self.save_msg_to_session('assistant', self.first_interviewer_message)
 
 
-    def stream_message(self, stream:Generator) -> None: 
-        """Helper function to stream AI messages 
+    def start_generation(self, stream:Generator, metrics:CallMetrics=None, cancel:CancelToken=None) -> Generation: 
+        """Starts streaming an AI message in the background worker of the session, display_generation then shows it 
 
         Args:
-            stream (Generator): the generator that contains the messages being streamed 
+            stream (Generator): the generator that contains the messages being streamed. It is created in the script run (so that its request can use the session state) and consumed by the worker 
+            metrics (CallMetrics, optional): the metrics of the call that produced the stream, saved with the message. Defaults to None.
+            cancel (CancelToken, optional): the token the stream was created with, cancelled by the stop button. Defaults to None.
+
+        Returns:
+            Generation: the message being generated 
         """ 
-        self.log("warning", "Streaming message", st.session_state.to_dict())
+        self.log("warning", f"Streaming message (gateway pool stats: {get_shared_pool().stats()})", st.session_state.to_dict())
+        if self.stream_coalesce_opts is not None: 
+            # fewer, bigger chunks so that the buffer of the message grows a bounded number of times 
+            stream = coalesce_stream(stream, **self.stream_coalesce_opts) 
+        return st.session_state.generation_worker.start(stream, metrics=metrics, cancel=cancel) 
+
+
+    def display_generation(self) -> None: 
+        """Displays the AI message being written by the background worker. Runs as a fragment every poll_interval seconds 
+
+        Each run renders the text the worker streamed so far, with a stop button. The message keeps one StreamRenderer 
+        across the runs, which is only fed the text streamed since the last run. Once the message is done, it is saved 
+        and the whole page is rerun, which stops the polling 
+        """
+        generation = st.session_state.generation_worker.get() 
+        if generation is None: 
+            # e.g. the interview was restarted 
+            return 
+        text, done = generation.read() 
+        stream_renderer = st.session_state.get('stream_renderer') 
+        if stream_renderer is None or stream_renderer[0] is not generation: 
+            stream_renderer = st.session_state.stream_renderer = (generation, StreamRenderer(**self.stream_render_opts)) 
+        renderer = stream_renderer[1] 
+        if done: 
+            del st.session_state.stream_renderer 
+            if self.profile_reruns: 
+                logging.getLogger(__name__).warning(f"Stream renderer stats: {renderer.stats()}") 
+            st.session_state.generation_worker.clear() 
+            self.finish_generation(generation) 
+            st.rerun() 
+        renderer.add(text[len(renderer.text):]) 
+        with st.chat_message("assistant", avatar=self.interviewer_avatar): 
+            renderer.render(st.empty()) 
+        st.button(
+            label="Stop", 
+            help="Stop the message being written", 
+            key="stop_generation", 
+            on_click=self.on_stop_button 
+        )
+
+
+    def on_stop_button(self) -> None: 
+        """Function that runs when the stop button is hit: closes the HTTP stream of the message being written, which is then saved as it is"""
+        generation = st.session_state.generation_worker.get() 
+        if generation is not None: 
+            self.log("warning", "Stopping the message being written", st.session_state.to_dict())
+            generation.cancel('user') 
+            # the worker is done as soon as the stream is closed, so the rerun of the fragment can save the message 
+            generation.wait(timeout=2) 
+
+
+    def finish_generation(self, generation:Generation) -> None: 
+        """Saves an AI message once the background worker is done with it 
+
+        Args:
+            generation (Generation): the message generated by the worker 
+        """ 
+        msg_so_far, _ = generation.read() 
+        metrics = generation.metrics 
         streaming_first_msg = not st.session_state.transcript_history 
         try: 
-            with self.chat_container: 
-                # stream messages within the chat container
-                with st.chat_message("assistant", avatar=self.interviewer_avatar): 
-                    # stream messages as the assistant 
-                    streamlit_msg = st.empty() # streamlit object for where the message will go 
-                    msg_so_far = "" # record the message received so far
-                    for chunk in stream: 
-                        # iterate through the stream and add the results 
-                        if chunk: 
-                            msg_so_far += chunk 
-                        found_closing_msg, closing_msg = self.check_closing_messages(msg_so_far) 
-                        if found_closing_msg: 
-                            streamlit_msg.empty() 
-                            break 
-                        if len(msg_so_far) > 10: 
-                            streamlit_msg.markdown(msg_so_far + "▌")
-
-                    # after all the text has streamed
-                    if found_closing_msg: 
-                        # we found a closing message, so display closing message and shut down the conversation 
-                        final_msg = closing_msg
-                        st.session_state.interview_status = False 
-                        st.session_state.found_closing_msg = True 
-                    else: 
-                        # did not find closing message, display the message sent 
-                        final_msg = msg_so_far 
-
-                    # display the message received 
-                    streamlit_msg.markdown(final_msg)
-
-                    self.log("warning", f"Got final message {final_msg}", st.session_state.to_dict())
-
-                    # save the message to the session 
-                    self.save_msg_to_session('assistant', final_msg)
-
-                    # save the transcript to dropbox 
-                    if not streaming_first_msg: 
-                        thread = threading.Thread(target=self.save_transcript_to_dropbox, args=(st.session_state.to_dict(),)) 
-                        thread.start() 
+            if generation.error is not None: 
+                raise generation.error 
+
+            router = self.get_model_router() 
+            if router is not None and metrics is not None and metrics.routing is not None: 
+                router.record(metrics) 
+                self.log("warning", f"Turn served by {metrics.model} (routing: {metrics.routing}, latency saved: {metrics.latency_saved}s, model routing stats: {router.stats()})", st.session_state.to_dict())
+
+            if metrics is not None: 
+                # count the output tokens saved by closing the stream early, at a closing code or with the stop button 
+                tracker = get_shared_cancellation_tracker() 
+                tokens_saved = tracker.record(metrics, self.max_tokens, msg_so_far) 
+                if metrics.cancelled_by is not None: 
+                    self.log("warning", f"Stream closed early by {metrics.cancelled_by} (tokens saved: {tokens_saved}, cancellation stats: {tracker.stats()})", st.session_state.to_dict())
+
+            if metrics is not None and metrics.cancelled_by == 'user' and not msg_so_far.strip(): 
+                # stopped before the first word, so the user message is taken back and can be sent again 
+                st.session_state.transcript_history = st.session_state.transcript_history[:-1] 
+                # the transcript saved to dropbox when the message was sent still has it 
+                thread = threading.Thread(target=self.save_transcript_to_dropbox, args=(st.session_state.to_dict(),)) 
+                thread.start() 
+                return 
+
+            # after all the text has streamed, the gateway reports the closing code (stop signal) that ended the message, if any 
+            stop_signal = metrics.stop_signal if metrics is not None else None 
+            found_closing_msg = stop_signal is not None 
+            if found_closing_msg: 
+                closing_msg = self.closing_messages.get(stop_signal, stop_signal) 
+                # we found a closing message, so display closing message and shut down the conversation 
+                final_msg = closing_msg
+                st.session_state.interview_status = False 
+                st.session_state.found_closing_msg = True 
+            else: 
+                # did not find closing message, display the message sent 
+                final_msg = msg_so_far 
+
+            self.log("warning", f"Got final message {final_msg}", st.session_state.to_dict())
+
+            # save the message to the session, with the latency and usage of the call 
+            call_metrics = metrics.to_dict() if metrics is not None else None 
+            if call_metrics is not None: 
+                # the tokens sent and saved by the input token budget, see get_messages_for_ai 
+                call_metrics.update(st.session_state.pop('input_budget', {})) 
+                self.log("warning", f"Call metrics: {call_metrics}", st.session_state.to_dict())
+            self.save_msg_to_session('assistant', final_msg, metrics=call_metrics)
+
+            # save the transcript to dropbox 
+            if not streaming_first_msg: 
+                thread = threading.Thread(target=self.save_transcript_to_dropbox, args=(st.session_state.to_dict(),)) 
+                thread.start() 
+
+            try: 
+                self.pregenerate_summary() 
+            except Exception as e: 
+                # the summary is then generated when the button is hit 
+                self.log("error", f"Error starting the summary pre-generation: {e}", st.session_state.to_dict())
+
+            try: 
+                self.update_memory() 
+            except Exception as e: 
+                # the raw turns are then sent until the next condensation 
+                self.log("error", f"Error starting the conversation memory update: {e}", st.session_state.to_dict())
         except Exception as e: 
             st.session_state.reached_error = True 
             self.log("error", f"Error streaming message from AI: {e}", st.session_state.to_dict())
@@ -586,6 +913,20 @@ class StreamlitGUI:
     # --------------------------------------------------------------------------
 
 
+    def log_run_time(self, region:str, start_time:float) -> None: 
+        """Prints how long a run of a region of the page took, if profile_reruns is on 
+
+        The time goes to the server's console through the module logger, not to the session log, since every session log 
+        entry uploads the whole log to Dropbox 
+
+        Args:
+            region (str): the region, e.g. 'Page' or 'Chat' 
+            start_time (float): the time.perf_counter() at the start of the run 
+        """
+        if self.profile_reruns: 
+            logging.getLogger(__name__).warning(f"{region} run took {time.perf_counter() - start_time:.4f}s") 
+
+
     def log(self, level:str, message:str, session_state:Dict) -> None: 
         """Logs messages to dropbox 
 
@@ -634,6 +975,7 @@ class StreamlitGUI:
         self.log("warning", f"Saving transcript to dropbox to {save_fpath}", session_state)
 
         # save the transcript history 
+        import pandas as pd 
         df = pd.DataFrame(session_state['transcript_history'])
         csv_content = io.BytesIO() 
         df.to_csv(csv_content, index=False, encoding='utf-8')
@@ -651,7 +993,7 @@ class StreamlitGUI:
             doc_content (io.BytesIO): the docx data to save 
         """
         # create the path to save to 
-        save_fpath = Path(self.dropbox_path)/session_state['username']/f"summary_document+{session_state['username']}+{session_state['session_id']}+{int(datetime.now(pytz.timezone('UTC')).timestamp())}.docx"
+        save_fpath = Path(self.dropbox_path)/session_state['username']/f"summary_document+{session_state['username']}+{session_state['session_id']}+{int(datetime.now(timezone.utc).timestamp())}.docx"
 
         self.log("warning", f"Saving summary to dropbox to {save_fpath}", session_state)
 
@@ -672,6 +1014,7 @@ class StreamlitGUI:
         for x in range(1, tries+1): 
             try: 
                 # create the dropbox client 
+                import dropbox.files 
                 dbx = dropbox.Dropbox(oauth2_refresh_token=st.secrets['REFRESH_TOKEN_DROPBOX'], app_key=st.secrets['APP_KEY_DROPBOX'], app_secret=st.secrets['APP_SECRET_DROPBOX']) 
 
                 # upload the file to dropbox and overwrite the existing file 
@@ -685,71 +1028,150 @@ class StreamlitGUI:
                 time.sleep(2 ** x)
 
 
-    def save_msg_to_session(self, role:str, content:str) -> None: 
+    def save_msg_to_session(self, role:str, content:str, metrics:Dict=None) -> None: 
         """Saves messages in the conversation to our session state variables 
 
         Args:
             role (str): the role of the message sender
             content (str): the message sent 
+            metrics (Dict, optional): the latency and usage metrics of the AI call that produced the message, saved as extra columns of the transcript. Defaults to None.
         """
-        st.session_state.transcript_history.append({
-            'time': datetime.now(pytz.timezone('UTC')).isoformat(timespec='milliseconds'), 
+        row = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), 
             'session_id': st.session_state.session_id, 
             'user': st.session_state.username, 
             'role': role, 
             'content': content 
-        })
+        }
+        if metrics: 
+            row.update({k: v for k, v in metrics.items() if k not in row}) 
+        st.session_state.transcript_history.append(row)
 
 
-    def get_messages_for_ai(self) -> List[Dict[str, str]]: 
+    def get_ai_client(self, ai_company:str=None) -> AICompanyGateway: 
+        """Gets the AI client shared by every session in this process 
+
+        Args:
+            ai_company (str, optional): the name of the AI company. Defaults to None (the configured AI company).
+
+        Returns:
+            AICompanyGateway: the gateway to the AI company 
+        """
+        ai_company = ai_company or self.ai_company 
+        pool = get_shared_pool(response_cache_opts=self.response_cache_opts, rate_limits=self.rate_limits, **self.client_pool_opts) 
+        # the mock and local gateways run offline, without an api key 
+        api_key = st.secrets[f"API_KEY_{ai_company.upper()}"] if ai_company not in ('mock', 'local') else "" 
+        return pool.get(company=ai_company, api_key=api_key) 
+
+
+    def hedge_stream_message(self, request:Dict, metrics:CallMetrics, cancel:CancelToken=None) -> Generator: 
+        """Streams a message from the configured AI company, hedged to the secondary AI company of hedge_opts if the first token is late 
+
+        Args:
+            request (Dict): the keyword arguments of stream_message for the configured AI company 
+            metrics (CallMetrics): the metrics of the call, which record the route that won 
+            cancel (CancelToken, optional): closes the streams of every route. Defaults to None.
+
+        Returns:
+            Generator: the generator that contains the messages being streamed 
+        """
+        policy_opts = dict(self.hedge_opts) 
+        ai_company = policy_opts.pop('ai_company') 
+        ai_model = policy_opts.pop('ai_model') 
+        secondary_request = {**request, 'model': ai_model, 'messages': self.get_messages_for_ai(ai_company=ai_company)} 
+        policy = get_shared_hedge_policy(**policy_opts) 
+        return policy.stream_message(self.get_ai_client(), request, self.get_ai_client(ai_company), secondary_request, metrics=metrics, cancel=cancel) 
+
+
+    def get_model_router(self) -> ModelRouter: 
+        """Gets the model router shared by every session in this process 
+
+        Returns:
+            ModelRouter: the router, or None if model_routing_opts isn't set 
+        """
+        if not self.model_routing_opts: 
+            return None 
+        return get_shared_model_router(**self.model_routing_opts) 
+
+
+    def get_attachment(self) -> Attachment: 
+        """Gets the attachment of the uploaded document, created once per document and kept in the session 
+
+        Returns:
+            Attachment: the attachment, or None if no document was uploaded 
+        """
+        content = st.session_state.paper_content 
+        if not content: 
+            return None 
+        attachment = st.session_state.get('attachment') 
+        if attachment is None or attachment.content != content: 
+            attachment = Attachment(content, name='paper.pdf') 
+            st.session_state.attachment = attachment 
+        return attachment 
+
+
+    def get_messages_for_ai(self, apply_budget:bool=True, ai_company:str=None) -> List[Dict[str, str]]: 
         """Gets the messages for the AI from the transcript history 
 
+        Args:
+            apply_budget (bool, optional): whether to leave out the oldest turns beyond the input token budget. Defaults to True.
+            ai_company (str, optional): the name of the AI company the messages are formatted for. Defaults to None (the configured AI company).
+
         Returns:
             List[Dict[str, str]]: a list of dicts with the messages for the AI
         """
+        ai_company = ai_company or self.ai_company 
+        transcript_history = st.session_state.transcript_history 
+        memory_summary = None 
+        if apply_budget and 'conversation_memory' in st.session_state: 
+            # the older turns that are condensed into the rolling memory are sent as its summary 
+            memory_summary, transcript_history = st.session_state.conversation_memory.get_rows(transcript_history) 
+        if apply_budget and self.max_input_tokens: 
+            transcript_history, sent_tokens, saved_tokens = st.session_state.context_builder.select_rows(transcript_history, system_message=self.system_message, attachment=st.session_state.paper_content) 
+            # saved with the metrics of the turn by finish_generation, since the secondary of a hedged call gets its messages again 
+            st.session_state.input_budget = {'budget_sent_tokens': sent_tokens, 'budget_saved_tokens': saved_tokens} 
+
         messages = [] 
-        if st.session_state.paper_content: 
-            if self.ai_company == 'anthropic': 
-                messages.append({
-                    'role': 'user', 
-                    'content': [
-                        {
-                            'type': 'document', 
-                            'source': {
-                                'type': 'base64', 
-                                'media_type': 'application/pdf', 
-                                'data': st.session_state.paper_content
-                            }, 
-                            'cache_control': {'type': 'ephemeral'}
-                        }, 
-                        {
-                            'type': 'text', 
-                            'text': 'The paper that I am reviewing is attached to give you additional context as you help me with my referee report. You do not need to acknowledge receipt of this document.'
-                        }
-                    ]
-                })
-        for row in st.session_state.transcript_history: 
+        attachment = self.get_attachment() 
+        if attachment is not None: 
+            # the document is uploaded once per AI company and then referenced by its file id 
             messages.append({
-                'role': row['role'], 
-                'content': row['content']
-            })
-        if self.ai_company == 'anthropic' and messages[-1]['role'] == 'user': 
-            content = messages[-1]['content'] 
-            messages[-1] = {
                 'role': 'user', 
-                'content': [
+                'content': self.get_ai_client(ai_company).get_attachment_blocks(attachment) + [
                     {
                         'type': 'text', 
-                        'text': content, 
-                        'cache_control': {'type': 'ephemeral'}
+                        'text': 'The paper that I am reviewing is attached to give you additional context as you help me with my referee report. You do not need to acknowledge receipt of this document.'
                     }
                 ]
-            }
+            })
+        if memory_summary: 
+            messages.append({
+                'role': 'user', 
+                'content': f"Summary of the earlier part of our conversation, whose turns are left out:\n\n{memory_summary}" 
+            })
+        for row in transcript_history: 
+            messages.append({
+                'role': row['role'], 
+                'content': row['content']
+            })
+        # the prompt cache breakpoints are placed by the gateway 
         return messages 
 
 
+    def get_stop_signals(self) -> List[str]: 
+        """Gets the stop signals that end the interview, which are the closing codes and the closing messages themselves 
+
+        The gateway ends the stream at the first one it finds and reports it in the call's metrics, so the streamed 
+        text doesn't need to be scanned for closing codes 
+
+        Returns:
+            List[str]: the stop signals 
+        """
+        return list(self.closing_messages.keys()) + list(self.closing_messages.values()) 
+
+
     def check_closing_messages(self, msg:str) -> Tuple[bool, str]: 
-        """Check if a message contains any of the closing messages 
+        """Check if a message contains any of the closing codes or closing messages, in one pass over the message 
 
         Args:
             msg (str): the message to check 
@@ -757,10 +1179,10 @@ class StreamlitGUI:
         Returns:
             Tuple[bool, str]: a tuple that returns a bool of whether a closing message was found and a string of the final message 
         """
-        for c, m in self.closing_messages.items(): 
-            if c.lower() in msg.lower() or m.lower() in msg.lower(): 
-                return True, m 
-        return False, msg 
+        _, stop_signal = find_stop_signal(msg, self.get_stop_signals()) 
+        if stop_signal is None: 
+            return False, msg 
+        return True, self.closing_messages.get(stop_signal, stop_signal) 
     
 
     @st.cache_resource(show_spinner=False)
@@ -774,6 +1196,8 @@ class StreamlitGUI:
             Dict: a dictionary that maps session name to a dictionary {'transcript': [contains transcript]}
         """
         # connect to dropbox 
+        import dropbox.files 
+        import pytz 
         dbx = dropbox.Dropbox(oauth2_refresh_token=st.secrets['REFRESH_TOKEN_DROPBOX'], app_key=st.secrets['APP_KEY_DROPBOX'], app_secret=st.secrets['APP_SECRET_DROPBOX']) 
 
         # search for transcript files 
@@ -808,6 +1232,7 @@ class StreamlitGUI:
 
 
     def get_paper_content(self) -> str: 
+        import dropbox.files 
         dbx = dropbox.Dropbox(oauth2_refresh_token=st.secrets['REFRESH_TOKEN_DROPBOX'], app_key=st.secrets['APP_KEY_DROPBOX'], app_secret=st.secrets['APP_SECRET_DROPBOX']) 
         # download the paper 
         _, response = dbx.files_download(f"{self.dropbox_path}/jmp_fpaine_firrma.pdf")
@@ -0,0 +1,179 @@
+"""Startup benchmark of the app: the import time of libs.streamlit_gui and the time to the first rendered frame of app.py
+
+Every run happens in a fresh interpreter, like the first session after the host recycled an idle container. The first
+frame is rendered with Streamlit's AppTest, so no server or browser is needed
+
+Run it from this folder:
+
+    python startup_benchmark.py             # prints the timings and compares them with the saved baseline
+    python startup_benchmark.py --save      # also saves the timings as the new baseline
+    python startup_benchmark.py --top 15    # also lists the 15 slowest imports
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+APP_DIR = Path(__file__).resolve().parent
+BASELINE_FPATH = APP_DIR/'startup_baseline.json'
+SECRETS_FPATH = APP_DIR/'.streamlit'/'secrets.toml'
+
+# placeholder secrets, used if the app has no secrets file. The AI company isn't called before the first message, but
+# an app that downloads from Dropbox on its first frame (e.g. the paper of the TEPEI app) needs the real secrets
+SECRETS = {
+    'STREAMLIT_AUTHENTICATOR_CONFIG': "credentials:\n  usernames: {}\n",
+    'REFRESH_TOKEN_DROPBOX': "benchmark",
+    'APP_KEY_DROPBOX': "benchmark",
+    'APP_SECRET_DROPBOX': "benchmark",
+    'API_KEY_ANTHROPIC': "benchmark",
+    'API_KEY_OPENAI': "benchmark"
+}
+
+# streamlit is loaded by the server before the app's script runs, so it isn't counted
+IMPORT_CODE = """
+import time
+import streamlit
+start = time.perf_counter()
+import libs.streamlit_gui
+print(time.perf_counter() - start)
+"""
+
+FIRST_FRAME_CODE = """
+import json, logging, sys, time
+from streamlit.testing.v1 import AppTest
+# the threads the app starts (e.g. the log upload) have no script context outside a server, which is expected here
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+app_test = AppTest.from_file('app.py', default_timeout=120)
+for key, value in json.loads(sys.argv[1]).items():
+    app_test.secrets[key] = value
+start = time.perf_counter()
+app_test.run()
+print(time.perf_counter() - start)
+if app_test.exception:
+    print(app_test.exception[0].message, file=sys.stderr)
+"""
+
+
+def run_python(code:str, *args:str, flags:List[str]=None) -> subprocess.CompletedProcess:
+    """Runs code in a fresh interpreter from the app's folder
+
+    Args:
+        code (str): the code to run
+        args (str): the arguments of the code
+        flags (List[str], optional): flags of the interpreter, e.g. ['-X', 'importtime']. Defaults to None.
+
+    Raises:
+        Exception: raises an exception if the code fails
+
+    Returns:
+        subprocess.CompletedProcess: the finished process
+    """
+    process = subprocess.run([sys.executable, *(flags or []), '-c', code, *args], cwd=APP_DIR, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise Exception(f"Benchmark run failed:\n{process.stderr}")
+    return process
+
+
+def measure(code:str, repeats:int, *args:str) -> Dict:
+    """Measures the seconds a piece of code prints, over several fresh interpreters
+
+    Args:
+        code (str): the code to run, which prints the seconds it measured
+        repeats (int): the number of runs
+        args (str): the arguments of the code
+
+    Returns:
+        Dict: the median, min and max seconds, and the warnings of the runs if any (e.g. a first frame that failed)
+    """
+    timings = []
+    warnings = []
+    for _ in range(repeats):
+        process = run_python(code, *args)
+        timings.append(float(process.stdout.strip().splitlines()[-1]))
+        if process.stderr.strip():
+            warning = process.stderr.strip().splitlines()[-1]
+            print(f"warning: {warning}")
+            if warning not in warnings:
+                warnings.append(warning)
+    results = {'median': round(statistics.median(timings), 4), 'min': round(min(timings), 4), 'max': round(max(timings), 4)}
+    if warnings:
+        results['warnings'] = warnings
+    return results
+
+
+def get_slowest_imports(top:int) -> List[Dict]:
+    """Gets the slowest imports of libs.streamlit_gui with python -X importtime
+
+    Args:
+        top (int): the number of imports to list
+
+    Returns:
+        List[Dict]: the modules and their cumulative import time in seconds, slowest first
+    """
+    process = run_python("import streamlit, time\nimport libs.streamlit_gui", flags=['-X', 'importtime'])
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if module.rstrip() == ' streamlit':
+            # streamlit is loaded by the server before the app, only the imports after it are the app's
+            imports = []
+            continue
+        imports.append({'module': module.rstrip(), 'seconds': int(cumulative) / 1e6})
+    return sorted(imports, key=lambda i: i['seconds'], reverse=True)[:top]
+
+
+def compare(results:Dict, baseline:Dict) -> None:
+    """Prints the change of every median against the baseline
+
+    Args:
+        results (Dict): the timings of this run
+        baseline (Dict): the saved timings
+    """
+    print(f"\nBaseline from {baseline['date']} (Python {baseline['python']} on {baseline.get('platform', 'an unknown platform')}):")
+    for key in ('import', 'first_frame'):
+        old, new = baseline[key]['median'], results[key]['median']
+        print(f"  {key}: {old:.3f}s -> {new:.3f}s ({(new - old) / old:+.1%})")
+        for warning in baseline[key].get('warnings', []):
+            print(f"    baseline warning: {warning}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures the cold start of the app")
+    parser.add_argument('--repeats', type=int, default=5, help="number of fresh interpreters per measurement")
+    parser.add_argument('--save', action='store_true', help=f"save the timings as the new baseline in {BASELINE_FPATH.name}")
+    parser.add_argument('--top', type=int, default=0, help="list the slowest imports")
+    args = parser.parse_args()
+
+    results = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'import': measure(IMPORT_CODE, args.repeats),
+        'first_frame': measure(FIRST_FRAME_CODE, args.repeats, json.dumps({} if SECRETS_FPATH.exists() else SECRETS))
+    }
+    print(f"Import of libs.streamlit_gui: {results['import']['median']:.3f}s (min {results['import']['min']:.3f}s, max {results['import']['max']:.3f}s)")
+    print(f"First frame of app.py: {results['first_frame']['median']:.3f}s (min {results['first_frame']['min']:.3f}s, max {results['first_frame']['max']:.3f}s)")
+
+    if args.top:
+        print("\nSlowest imports:")
+        for i in get_slowest_imports(args.top):
+            print(f"  {i['seconds']:.3f}s {i['module']}")
+
+    if BASELINE_FPATH.exists():
+        compare(results, json.loads(BASELINE_FPATH.read_text()))
+    else:
+        print(f"\nNo baseline to compare with: {BASELINE_FPATH.name} is missing (run with --save to record one)")
+    if args.save:
+        BASELINE_FPATH.write_text(json.dumps(results, indent=4) + "\n")
+        print(f"\nSaved the baseline to {BASELINE_FPATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from typing import Dict, List
+
+class CacheBreakpointPlanner:
+    """Places Anthropic prompt cache breakpoints (cache_control) on a conversation
+
+    A request can only carry a few breakpoints, so they are spent on the blocks that make the longest stable prefix:
+    the attached document, the end of the conversation (written to the cache for the next turn), and rolling checkpoints
+    every `stride` messages. The checkpoints stay in the same place for `stride` messages, so the next turns keep
+    reading the cached history from them even when the conversation grows past the provider's cache lookback window
+    """
+
+    def __init__(self, max_breakpoints:int=4, stride:int=8) -> None:
+        """Sets up the object
+
+        Args:
+            max_breakpoints (int, optional): the max number of breakpoints allowed in a request by the provider. Defaults to 4.
+            stride (int, optional): the number of messages between rolling checkpoints. Defaults to 8.
+        """
+        self.max_breakpoints = max_breakpoints
+        self.stride = stride
+
+
+    def get_breakpoints(self, messages:List[Dict], reserved:int=0) -> List[int]:
+        """Chooses the indices of the messages that get a breakpoint
+
+        Args:
+            messages (List[Dict]): the messages of the conversation
+            reserved (int, optional): the number of breakpoints already used outside of the messages, e.g. on the system prompt. Defaults to 0.
+
+        Returns:
+            List[int]: the indices of the messages, in order of priority
+        """
+        if not messages:
+            return []
+        last = len(messages) - 1
+        candidates = [last]
+
+        # the attached document, which is the biggest stable block
+        for i, msg in enumerate(messages):
+            if isinstance(msg['content'], list) and any(block.get('type') == 'document' for block in msg['content']):
+                candidates.append(i)
+                break
+
+        # rolling checkpoints, most recent first
+        checkpoint = (last // self.stride) * self.stride - 1
+        while checkpoint >= 0:
+            candidates.append(checkpoint)
+            checkpoint -= self.stride
+
+        breakpoints = []
+        for i in candidates:
+            if i not in breakpoints:
+                breakpoints.append(i)
+        return breakpoints[:max(self.max_breakpoints - reserved, 0)]
+
+
+    def plan(self, messages:List[Dict], reserved:int=0) -> List[Dict]:
+        """Places the breakpoints on a copy of the messages, replacing any breakpoints set by the caller
+
+        Args:
+            messages (List[Dict]): the messages of the conversation
+            reserved (int, optional): the number of breakpoints already used outside of the messages, e.g. on the system prompt. Defaults to 0.
+
+        Returns:
+            List[Dict]: the messages with the breakpoints
+        """
+        breakpoints = set(self.get_breakpoints(messages, reserved=reserved))
+        planned = []
+        for i, msg in enumerate(messages):
+            content = msg['content']
+            if isinstance(content, list):
+                content = [{k: v for k, v in block.items() if k != 'cache_control'} for block in content]
+            if i in breakpoints:
+                if isinstance(content, str):
+                    content = [{'type': 'text', 'text': content}]
+                content[-1]['cache_control'] = {'type': 'ephemeral'}
+            planned.append({**msg, 'content': content})
+        return planned
\ No newline at end of file
@@ -0,0 +1,117 @@
+import time
+from typing import AsyncGenerator, AsyncIterable, Generator, Iterable
+
+class ChunkCoalescer:
+    """Batches the small deltas of a stream into bigger chunks
+
+    Providers send a delta every few characters, and every delta costs the app a re-render. The coalescer holds the deltas
+    back until at least `min_interval` seconds passed since the last chunk it let out, and then until the text reaches a
+    word boundary (or `max_delay` passed), so the consumer gets a bounded number of chunks per second that end on whole words
+    """
+
+    def __init__(self, min_interval:float=0.05, word_boundary:bool=True, max_delay:float=0.25, max_chars:int=None) -> None:
+        """Sets up the object
+
+        Args:
+            min_interval (float, optional): the min seconds between two chunks. Defaults to 0.05.
+            word_boundary (bool, optional): whether to only let chunks out at the end of a word. Defaults to True.
+            max_delay (float, optional): seconds after which a chunk is let out even in the middle of a word. Defaults to 0.25.
+            max_chars (int, optional): the number of buffered characters that lets a chunk out straight away. Defaults to None (no limit).
+        """
+        self.min_interval = min_interval
+        self.word_boundary = word_boundary
+        self.max_delay = max_delay
+        self.max_chars = max_chars
+
+        self.buffer = ""
+        self.last_flush = time.perf_counter()
+
+
+    def add(self, delta:str) -> str:
+        """Adds a delta to the buffer and lets a chunk out if it is due
+
+        Args:
+            delta (str): the delta from the stream, None deltas (e.g. OpenAI's last chunk) are dropped
+
+        Returns:
+            str: the chunk to let out, or None if the buffer is held back
+        """
+        if delta:
+            self.buffer += delta
+        if not self.buffer:
+            return None
+
+        waited = time.perf_counter() - self.last_flush
+        if self.max_chars is not None and len(self.buffer) >= self.max_chars:
+            return self.flush()
+        if waited < self.min_interval:
+            return None
+        if self.word_boundary and not self.buffer[-1].isspace() and waited < self.max_delay:
+            # hold the end of the word back until the next delta
+            cut = max(self.buffer.rfind(' '), self.buffer.rfind('\n'))
+            if cut < 0:
+                return None
+            chunk, self.buffer = self.buffer[:cut + 1], self.buffer[cut + 1:]
+            self.last_flush = time.perf_counter()
+            return chunk
+        return self.flush()
+
+
+    def flush(self) -> str:
+        """Lets out everything in the buffer
+
+        Returns:
+            str: the buffered text, or None if the buffer is empty
+        """
+        chunk, self.buffer = self.buffer, ""
+        self.last_flush = time.perf_counter()
+        return chunk or None
+
+
+def coalesce_stream(stream:Iterable[str], **coalescer_opts) -> Generator[str, None, None]:
+    """Wraps a stream from AICompanyGateway.stream_message so that it yields coalesced chunks and no None deltas
+
+    Args:
+        stream (Iterable[str]): the stream of deltas
+        coalescer_opts: options of the ChunkCoalescer
+
+    Yields:
+        Generator[str, None, None]: yields the coalesced chunks
+    """
+    coalescer = ChunkCoalescer(**coalescer_opts)
+    try:
+        for delta in stream:
+            chunk = coalescer.add(delta)
+            if chunk:
+                yield chunk
+        chunk = coalescer.flush()
+        if chunk:
+            yield chunk
+    finally:
+        # closing the wrapper closes the underlying stream, e.g. when the consumer stops early
+        if hasattr(stream, 'close'):
+            stream.close()
+
+
+async def acoalesce_stream(stream:AsyncIterable[str], **coalescer_opts) -> AsyncGenerator[str, None]:
+    """Wraps a stream from AICompanyGateway.astream_message so that it yields coalesced chunks and no None deltas
+
+    Args:
+        stream (AsyncIterable[str]): the stream of deltas
+        coalescer_opts: options of the ChunkCoalescer
+
+    Yields:
+        AsyncGenerator[str, None]: yields the coalesced chunks
+    """
+    coalescer = ChunkCoalescer(**coalescer_opts)
+    try:
+        async for delta in stream:
+            chunk = coalescer.add(delta)
+            if chunk:
+                yield chunk
+        chunk = coalescer.flush()
+        if chunk:
+            yield chunk
+    finally:
+        if hasattr(stream, 'aclose'):
+            await stream.aclose()
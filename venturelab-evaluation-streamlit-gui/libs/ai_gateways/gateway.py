@@ -1,21 +1,54 @@
-import inspect 
 import importlib 
-import types 
-from typing import Generator, List, Dict 
+import importlib.metadata 
+import threading 
+import contextlib 
+import asyncio 
+from typing import Generator, AsyncGenerator, Awaitable, Callable, List, Dict, Iterator, AsyncIterator, Any 
+
+from .telemetry import CallMetrics 
+from .rate_limiter import RateLimiter 
+from .attachments import Attachment 
+from .cancellation import CancelToken, StreamCancelled 
 
 class AICompanyGateway: 
     """Class for standardized gateways to AI company APIs"""
 
     # the name of the AI company
     name = None 
+    # whether the API reports which stop sequence ended a message, so that the stop_signals of stream_message can be sent as stop sequences 
+    native_stop_signals = False 
+    # the entry point group that gateways outside this package register in 
+    entry_point_group = 'ai_gateways' 
+    # gateway classes by the name of their AI company, see register 
+    __registry = {} 
+    __registry_lock = threading.Lock() 
 
-    def __init__(self, api_key:str) -> None: 
+    def __init__(self, api_key:str, response_cache:'ResponseCache'=None, rate_limits:Dict[str, Dict]=None, stream_retries:int=2, stream_retry_backoff:float=0.5, **client_opts) -> None: 
         """Sets up the object 
 
         Args:
             api_key (str): api key to the AI company's API 
+            response_cache (ResponseCache, optional): cache that create_message responses are served from. Defaults to None (no caching).
+            rate_limits (Dict[str, Dict], optional): maps a model name, or '*' for any model, to the options of its RateLimiter. Defaults to None (no limits).
+            stream_retries (int, optional): number of times a stream that fails on a connection error is resumed. Defaults to 2.
+            stream_retry_backoff (float, optional): seconds to wait before the first resume, doubled (with jitter) for each one after it. Defaults to 0.5.
+            client_opts: options for the SDK client's connection pool (see build_http_client) 
         """
-        self.setup_client(api_key)
+        self.response_cache = response_cache 
+        self.rate_limits = rate_limits or {} 
+        self.stream_retries = stream_retries 
+        self.stream_retry_backoff = stream_retry_backoff 
+        # one rate limiter per model, created the first time the model is used 
+        self.__rate_limiters = {} 
+        # ids of the uploaded attachments by content hash, shared by every session that uses this gateway 
+        self.__file_ids = {} 
+        self.__file_locks = {} 
+        # functions called with the CallMetrics of every call 
+        self.metrics_callbacks = [] 
+        # counters for the requests sent through this gateway 
+        self.__stats_lock = threading.Lock() 
+        self.__request_stats = {'requests': 0, 'in_flight': 0, 'errors': 0, 'cancelled': 0, 'input_tokens': 0, 'cache_read_tokens': 0, 'cache_write_tokens': 0} 
+        self.setup_client(api_key, **client_opts)
 
 
     @classmethod
@@ -31,41 +64,471 @@ class AICompanyGateway:
         Returns:
             AICompanyGateway: Returns an instance of the <company>_Gateway class 
         """
-        def _find_class(module:types.ModuleType, company:str) -> type: 
-            """Finds a class within a module 
+        AICompanyGatewayClass = cls.get_gateway_class(company) 
+        return AICompanyGatewayClass(**opts) 
 
-            Args:
-                module (types.ModuleType): the module to search in 
-                company (str): the name of the company to look for 
 
-            Raises:
-                Exception: raises an exception if an unknown company is passed
+    @staticmethod
+    def register(name:str=None) -> Callable[[type], type]: 
+        """Decorator that registers a gateway class under the name of its AI company, so that the factory can create it 
 
-            Returns:
-                type: The class object for the company gateway 
-            """
-            class_name = company.lower() + 'gateway' 
-            for m in inspect.getmembers(module, inspect.isclass): 
-                if m[0].lower() == class_name: 
-                    return m[1] 
-            raise Exception(f"Cannot find class for AI company {company} in {module.__name__}")
-
-        # search for the module in this folder with the company name 
-        module = importlib.import_module("libs.ai_gateways." + company + "_gateway") 
-        # find the gateway class for the company 
-        AICompanyGatewayClass = _find_class(module, company) 
-        return AICompanyGatewayClass(**opts) 
+        Gateways outside this package can also register through an entry point in the 'ai_gateways' group, 
+        named after the AI company and pointing to the class 
+
+        Args:
+            name (str, optional): the name of the AI company. Defaults to None (the class's name attribute).
+
+        Returns:
+            Callable[[type], type]: the decorator 
+        """
+        def decorator(gateway_class:type) -> type: 
+            with AICompanyGateway.__registry_lock: 
+                AICompanyGateway.__registry[(name or gateway_class.name).lower()] = gateway_class 
+            return gateway_class 
+        return decorator 
+
+
+    @staticmethod
+    def get_gateway_class(company:str) -> type: 
+        """Gets the registered gateway class of an AI company 
+
+        The built-in gateways register when their module (<company>_gateway in this folder) is first imported, 
+        and other gateways when their entry point is first loaded. The class is then cached in the registry 
+
+        Args:
+            company (str): the name of the company 
+
+        Raises:
+            Exception: raises an exception if an unknown company is passed
+
+        Returns:
+            type: The class object for the company gateway 
+        """
+        company = company.lower() 
+        with AICompanyGateway.__registry_lock: 
+            if company in AICompanyGateway.__registry: 
+                return AICompanyGateway.__registry[company] 
 
+        module_name = f"{__package__}.{company}_gateway" 
+        try: 
+            importlib.import_module(module_name) 
+        except ModuleNotFoundError as e: 
+            if e.name != module_name: 
+                raise 
+            for entry_point in importlib.metadata.entry_points(group=AICompanyGateway.entry_point_group, name=company): 
+                AICompanyGateway.register(company)(entry_point.load()) 
 
-    def setup_client(self, api_key:str) -> None: 
+        with AICompanyGateway.__registry_lock: 
+            if company in AICompanyGateway.__registry: 
+                return AICompanyGateway.__registry[company] 
+        raise Exception(f"Cannot find class for AI company {company}")
+
+
+    def setup_client(self, api_key:str, **client_opts) -> None: 
         """Sets up the client to the AI company SDK 
 
         Args:
             api_key (str): the api key 
+            client_opts: options for the SDK client's connection pool (see build_http_client) 
         """
         self.__client = None 
 
 
+    @staticmethod
+    def build_http_client(http_client_class:type, max_connections:int=100, max_keepalive_connections:int=20, keepalive_expiry:float=30.0, **kwargs) -> object: 
+        """Builds the httpx client that the SDK client sends its requests through 
+
+        Both SDKs are built on httpx, so the connection pool limits and keep-alive are set the same way for every company 
+
+        Args:
+            http_client_class (type): the httpx client class exported by the SDK (e.g. anthropic.DefaultHttpxClient)
+            max_connections (int, optional): max number of open connections in the pool. Defaults to 100.
+            max_keepalive_connections (int, optional): max number of idle connections kept alive. Defaults to 20.
+            keepalive_expiry (float, optional): seconds an idle connection is kept alive for. Defaults to 30.0.
+
+        Returns:
+            object: the httpx client 
+        """
+        import httpx 
+        limits = httpx.Limits(
+            max_connections=max_connections, 
+            max_keepalive_connections=max_keepalive_connections, 
+            keepalive_expiry=keepalive_expiry
+        )
+        return http_client_class(limits=limits, **kwargs) 
+
+
+    @staticmethod
+    def build_timeout(timeout:float=600.0, connect_timeout:float=10.0) -> object: 
+        """Builds the httpx timeout for the SDK client 
+
+        Args:
+            timeout (float, optional): seconds to wait on a read, write or pool checkout. Defaults to 600.0.
+            connect_timeout (float, optional): seconds to wait while opening a new connection. Defaults to 10.0.
+
+        Returns:
+            object: the httpx timeout 
+        """
+        import httpx 
+        return httpx.Timeout(timeout, connect=connect_timeout) 
+
+
+    @contextlib.contextmanager
+    def track_request(self) -> Iterator[None]: 
+        """Context manager that counts a request sent through the gateway for the pool statistics"""
+        with self.__stats_lock: 
+            self.__request_stats['requests'] += 1 
+            self.__request_stats['in_flight'] += 1 
+        try: 
+            yield 
+        except StreamCancelled: 
+            with self.__stats_lock: 
+                self.__request_stats['cancelled'] += 1 
+            raise 
+        except Exception: 
+            with self.__stats_lock: 
+                self.__request_stats['errors'] += 1 
+            raise 
+        finally: 
+            with self.__stats_lock: 
+                self.__request_stats['in_flight'] -= 1 
+
+
+    @contextlib.contextmanager
+    def close_on_cancel(self, cancel:CancelToken, stream:object=None) -> Iterator[None]: 
+        """Context manager that closes the SDK stream of a call as soon as its CancelToken is cancelled, from the thread that cancels it 
+
+        Closing the stream aborts its HTTP response, so the connection and the output tokens are freed at once. The read 
+        that was waiting for the next chunk then fails, and the failure is raised as StreamCancelled 
+
+        Args:
+            cancel (CancelToken): the token passed to stream_message with the `cancel` keyword, None if the call can't be cancelled 
+            stream (object, optional): the SDK stream, with a close method. Defaults to None (the call checks the token itself).
+        """
+        if cancel is None: 
+            yield 
+            return 
+        handle = cancel.on_cancel(stream.close) if stream is not None else None 
+        try: 
+            yield 
+            # the last chunk may have arrived just before the stream was closed 
+            cancel.check() 
+        except StreamCancelled: 
+            raise 
+        except Exception as e: 
+            if not cancel.is_cancelled(): 
+                raise 
+            raise StreamCancelled(cancel.reason) from e 
+        finally:
+            cancel.remove(handle)
+
+
+    async def aiter_until_cancelled(self, chunks:AsyncIterator, cancel:CancelToken) -> AsyncGenerator[Any, None]:
+        """Iterates an async SDK stream, ending the read that waits for its next chunk as soon as its CancelToken is cancelled
+
+        The close of an async stream is a coroutine of its event loop, so it can't be called from the thread that cancels
+        like close_on_cancel does. The cancel interrupts the task that reads the stream instead, on its event loop and only
+        while it waits for a chunk (not while the caller handles one). Leaving the SDK's `async with` block then closes the
+        HTTP response
+
+        Args:
+            chunks (AsyncIterator): the chunks of the stream
+            cancel (CancelToken): the token passed to astream_message with the `cancel` keyword, None if the call can't be cancelled
+
+        Yields:
+            AsyncGenerator[Any, None]: the chunks
+
+        Raises:
+            StreamCancelled: as soon as the call is cancelled
+        """
+        if cancel is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+        loop = asyncio.get_running_loop()
+        # the task waiting for the next chunk, None while the caller handles a chunk
+        reader = {'task': None}
+
+        def interrupt() -> None:
+            if reader['task'] is not None:
+                reader['task'].cancel()
+
+        handle = cancel.on_cancel(lambda: loop.call_soon_threadsafe(interrupt))
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                cancel.check()
+                reader['task'] = asyncio.current_task()
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    if not cancel.is_cancelled():
+                        raise
+                    # the task itself wasn't cancelled, only its read (uncancel is new in Python 3.11)
+                    if hasattr(reader['task'], 'uncancel'):
+                        reader['task'].uncancel()
+                    raise StreamCancelled(cancel.reason) from None
+                finally:
+                    reader['task'] = None
+                yield chunk
+        finally: 
+            cancel.remove(handle) 
+
+
+    def get_rate_limiter(self, model:str) -> RateLimiter: 
+        """Gets the rate limiter of a model, creating it the first time it is asked for 
+
+        Args:
+            model (str): the name of the model 
+
+        Returns:
+            RateLimiter: the rate limiter, or None if the model has no limits 
+        """
+        opts = self.rate_limits.get(model, self.rate_limits.get('*')) 
+        if not opts: 
+            return None 
+        with self.__stats_lock: 
+            if model not in self.__rate_limiters: 
+                self.__rate_limiters[model] = RateLimiter(**opts) 
+            return self.__rate_limiters[model] 
+
+
+    @staticmethod
+    def estimate_request_tokens(messages:List[Dict], max_tokens:int, system_message:str=None) -> int: 
+        """Estimates the tokens a request counts against the tokens per minute limit: its text input (about 4 characters per token) plus its max output tokens 
+
+        Attached documents aren't counted, since their base64 size says little about their tokens 
+
+        Args:
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str, optional): a system message, if any. Defaults to None.
+
+        Returns:
+            int: the estimated number of tokens 
+        """
+        chars = len(system_message or "") 
+        for msg in messages: 
+            content = msg['content'] 
+            if isinstance(content, str): 
+                chars += len(content) 
+            else: 
+                chars += sum(len(block.get('text', '')) for block in content) 
+        return chars // 4 + max_tokens 
+
+
+    @contextlib.contextmanager
+    def limit_rate(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None) -> Iterator[None]: 
+        """Context manager that waits until a request fits in the rate limits of its model and holds it within them while it runs 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str, optional): a system message, if any. Defaults to None.
+        """
+        limiter = self.get_rate_limiter(model) 
+        if limiter is None: 
+            yield 
+            return 
+        with limiter.limit(self.estimate_request_tokens(messages, max_tokens, system_message)): 
+            yield 
+
+
+    @contextlib.asynccontextmanager
+    async def alimit_rate(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None) -> AsyncIterator[None]: 
+        """Async context manager that waits until a request fits in the rate limits of its model, without blocking the event loop 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str, optional): a system message, if any. Defaults to None.
+        """
+        limiter = self.get_rate_limiter(model) 
+        if limiter is None: 
+            yield 
+            return 
+        async with limiter.alimit(self.estimate_request_tokens(messages, max_tokens, system_message)): 
+            yield 
+
+
+    def upload_file(self, attachment:Attachment) -> str: 
+        """Uploads a document through the AI company's file API. Overriden by subclass 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            str: the id of the uploaded file, or None if the AI company has no file API 
+        """
+        return None 
+
+
+    def get_file_id(self, attachment:Attachment) -> str: 
+        """Gets the file id of a document, uploading it the first time it is seen by this gateway 
+
+        Uploads that fail aren't tried again, so that every later request falls back straight away 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            str: the id of the uploaded file, or None if it couldn't be uploaded 
+        """
+        with self.__stats_lock: 
+            if attachment.content_hash in self.__file_ids: 
+                return self.__file_ids[attachment.content_hash] 
+            lock = self.__file_locks.setdefault(attachment.content_hash, threading.Lock()) 
+        # one upload per document, even if several sessions ask for it at the same time 
+        with lock: 
+            if attachment.content_hash not in self.__file_ids: 
+                try: 
+                    file_id = self.upload_file(attachment) 
+                except Exception: 
+                    file_id = None 
+                with self.__stats_lock: 
+                    self.__file_ids[attachment.content_hash] = file_id 
+            return self.__file_ids[attachment.content_hash] 
+
+
+    def get_attachment_blocks(self, attachment:Attachment) -> List[Dict]: 
+        """Gets the content blocks that attach a document to a message. Overriden by subclass 
+
+        By default the extracted text of the document is sent, for AI companies without a file API 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            List[Dict]: the content blocks 
+        """
+        return [{'type': 'text', 'text': f"<document name=\"{attachment.name}\">\n{attachment.get_text()}\n</document>"}] 
+
+
+    def is_retryable(self, error:Exception) -> bool: 
+        """Checks if an error is a connection-level failure that is worth retrying. Overriden by subclass 
+
+        Args:
+            error (Exception): the error 
+
+        Returns:
+            bool: True if the request can be retried. False otherwise 
+        """
+        import httpx 
+        return isinstance(error, httpx.TransportError) 
+
+
+    def get_resume_messages(self, messages:List[Dict], partial:str) -> List[Dict]: 
+        """Gets the messages that make the AI continue a message from the partial text it streamed before failing. Overriden by subclass 
+
+        By default the partial text is prefilled as the start of the assistant's turn, so the AI carries on from its last word 
+
+        Args:
+            messages (List[Dict]): a list of messages of the conversation so far 
+            partial (str): the text streamed so far 
+
+        Returns:
+            List[Dict]: the messages to send 
+        """
+        # the prefill can't end with whitespace 
+        return list(messages) + [{'role': 'assistant', 'content': partial.rstrip()}] 
+
+
+    def add_metrics_callback(self, callback:Callable[[CallMetrics], None]) -> None: 
+        """Registers a function that is called with the CallMetrics of every call made through the gateway 
+
+        Args:
+            callback (Callable[[CallMetrics], None]): the function 
+        """
+        self.metrics_callbacks.append(callback) 
+
+
+    def start_metrics(self, model:str, kwargs:Dict, streamed:bool) -> CallMetrics: 
+        """Starts the metrics of a call, using the CallMetrics passed by the caller with the `metrics` keyword if there is one 
+
+        Args:
+            model (str): the name of the model 
+            kwargs (Dict): the keyword arguments of the call, the `metrics` keyword is removed from them 
+            streamed (bool): whether the message is streamed 
+
+        Returns:
+            CallMetrics: the metrics of the call, to be used as a context manager around the call 
+        """
+        metrics = kwargs.pop('metrics', None) or CallMetrics() 
+        return metrics.start(self.name, model, streamed, callbacks=self.metrics_callbacks) 
+
+
+    def record_usage(self, input_tokens:int, cache_read_tokens:int=0, cache_write_tokens:int=0) -> None: 
+        """Counts the input tokens of a request for the prompt caching statistics 
+
+        Args:
+            input_tokens (int): the input tokens that were neither read from nor written to the cache 
+            cache_read_tokens (int, optional): the input tokens read from the cache. Defaults to 0.
+            cache_write_tokens (int, optional): the input tokens written to the cache. Defaults to 0.
+        """
+        with self.__stats_lock: 
+            self.__request_stats['input_tokens'] += input_tokens or 0 
+            self.__request_stats['cache_read_tokens'] += cache_read_tokens or 0 
+            self.__request_stats['cache_write_tokens'] += cache_write_tokens or 0 
+
+
+    def get_stats(self) -> Dict: 
+        """Gets the statistics of the requests sent through this gateway and of its connection pool 
+
+        Returns:
+            Dict: the request and token counters, the share of input tokens read from the prompt cache, the rate limiter statistics (incl. queue depth) of each model, plus the number of open and idle connections when the SDK exposes them 
+        """
+        with self.__stats_lock: 
+            stats = dict(self.__request_stats) 
+            rate_limiters = dict(self.__rate_limiters) 
+        if rate_limiters: 
+            stats['rate_limits'] = {model: limiter.stats() for model, limiter in rate_limiters.items()} 
+        total_input_tokens = stats['input_tokens'] + stats['cache_read_tokens'] + stats['cache_write_tokens'] 
+        stats['cached_token_ratio'] = round(stats['cache_read_tokens'] / total_input_tokens, 3) if total_input_tokens else 0.0 
+        stats.update(self.get_connection_stats()) 
+        return stats 
+
+
+    def get_connection_stats(self) -> Dict: 
+        """Gets the statistics of the connection pool. Overriden by subclass 
+
+        Returns:
+            Dict: the number of open and idle connections 
+        """
+        return {} 
+
+
+    @staticmethod
+    def read_connection_stats(http_client:object) -> Dict: 
+        """Reads the open and idle connections from an httpx client's connection pool 
+
+        httpx doesn't expose its pool publicly, so this is best effort and returns an empty dict if the internals change 
+
+        Args:
+            http_client (object): the httpx client 
+
+        Returns:
+            Dict: the number of open and idle connections 
+        """
+        pool = getattr(getattr(http_client, '_transport', None), '_pool', None) 
+        connections = getattr(pool, 'connections', None) 
+        if connections is None: 
+            return {} 
+        connections = list(connections) 
+        return {
+            'connections': len(connections), 
+            'idle_connections': sum(1 for c in connections if c.is_idle()) 
+        }
+
+
+    def close(self) -> None: 
+        """Closes the SDK client and its connection pool. Overriden by subclass"""
+        pass 
+
+
     def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
         """Returns a message from the API. Overriden by subclass 
 
@@ -93,4 +556,163 @@ class AICompanyGateway:
         Yields:
             Generator[str, None, None]: yields the messages sent by the AI 
         """
-        pass  
\ No newline at end of file
+        pass
+
+
+    def build_batch_request(self, custom_id:str, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Dict: 
+        """Builds one request of a batch in the format of the AI company's batch API. Overriden by subclass 
+
+        Args:
+            custom_id (str): the id that the batch results are keyed by 
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            Dict: the batch request 
+        """
+        pass 
+
+
+    def submit_batch(self, batch_requests:List[Dict]) -> str: 
+        """Submits a batch of requests built by build_batch_request. Overriden by subclass 
+
+        Args:
+            batch_requests (List[Dict]): the batch requests 
+
+        Returns:
+            str: the id of the batch 
+        """
+        pass 
+
+
+    def get_batch_status(self, batch_id:str) -> str: 
+        """Gets the status of a batch. Overriden by subclass 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            str: 'in_progress', 'completed' or 'failed' 
+        """
+        pass 
+
+
+    def get_batch_results(self, batch_id:str) -> Dict[str, Dict]: 
+        """Gets the results of a completed batch. Overriden by subclass 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            Dict[str, Dict]: maps the custom id of each request to {'content': [the message or None], 'error': [the error or None]} 
+        """
+        pass 
+
+
+    async def acreate_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
+        """Returns a message from the API without blocking the event loop. Overriden by subclass 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            str: the messsage sent by the API 
+        """
+        pass 
+
+
+    async def astream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]: 
+        """Streams a message from the API without blocking the event loop. Overriden by subclass 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Yields:
+            AsyncGenerator[str, None]: yields the messages sent by the AI 
+        """
+        pass 
+
+
+    async def acreate_messages(self, requests:List[Dict], max_concurrency:int=None) -> List[str]: 
+        """Sends many requests concurrently on the same event loop 
+
+        Args:
+            requests (List[Dict]): a list of the keyword arguments for acreate_message, one dict per request 
+            max_concurrency (int, optional): the max number of requests in flight at once. Defaults to None (no limit).
+
+        Returns:
+            List[str]: the messages sent by the API, in the same order as the requests 
+        """
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None 
+
+        async def _create_message(request:Dict) -> str: 
+            """Sends one request, waiting for a free slot if the concurrency is limited 
+
+            Args:
+                request (Dict): the keyword arguments for acreate_message 
+
+            Returns:
+                str: the message sent by the API 
+            """
+            if semaphore is None: 
+                return await self.acreate_message(**request) 
+            async with semaphore: 
+                return await self.acreate_message(**request) 
+
+        return await asyncio.gather(*[_create_message(request) for request in requests]) 
+
+
+    def create_messages(self, requests:List[Dict], max_concurrency:int=None) -> List[str]: 
+        """Sync shim around acreate_messages for code that isn't async, such as the assessment notebooks 
+
+        Args:
+            requests (List[Dict]): a list of the keyword arguments for acreate_message, one dict per request 
+            max_concurrency (int, optional): the max number of requests in flight at once. Defaults to None (no limit).
+
+        Returns:
+            List[str]: the messages sent by the API, in the same order as the requests 
+        """
+        return self.run_sync(self.acreate_messages(requests, max_concurrency=max_concurrency)) 
+
+
+    @staticmethod
+    def run_sync(coro:Awaitable) -> Any: 
+        """Runs a coroutine from sync code and waits for its result 
+
+        Coroutines run on one background event loop shared by the whole process. This works even when the caller already has a 
+        running loop (e.g. Jupyter), and lets the async SDK clients keep their connections alive between calls 
+
+        Args:
+            coro (Awaitable): the coroutine to run 
+
+        Returns:
+            Any: the result of the coroutine 
+        """
+        return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result() 
+
+
+_background_loop = None 
+_background_loop_lock = threading.Lock() 
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop: 
+    """Gets the event loop used by AICompanyGateway.run_sync, starting it in a daemon thread on the first call 
+
+    Returns:
+        asyncio.AbstractEventLoop: the background event loop 
+    """
+    global _background_loop 
+    with _background_loop_lock: 
+        if _background_loop is None: 
+            _background_loop = asyncio.new_event_loop() 
+            thread = threading.Thread(target=_background_loop.run_forever, name='ai-gateway-loop', daemon=True) 
+            thread.start() 
+        return _background_loop 
\ No newline at end of file
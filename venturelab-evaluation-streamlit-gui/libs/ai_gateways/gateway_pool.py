@@ -0,0 +1,114 @@
+import hashlib
+import threading
+from typing import Dict, Tuple
+
+from .gateway import AICompanyGateway
+from .response_cache import ResponseCache
+
+class GatewayPool:
+    """Process-wide cache of gateways
+
+    Streamlit runs every session in the same process, so caching one gateway per (company, api key) lets all the sessions
+    share the same SDK client and reuse its kept-alive connections instead of opening a new connection pool on every message
+    """
+
+    def __init__(self, response_cache_opts:Dict=None, rate_limits:Dict[str, Dict[str, Dict]]=None, **client_opts) -> None:
+        """Sets up the object
+
+        Args:
+            response_cache_opts (Dict, optional): options for a ResponseCache shared by every gateway in the pool. Defaults to None (no caching).
+            rate_limits (Dict[str, Dict[str, Dict]], optional): maps a company name, or '*' for any company, to the rate limits of its gateways by model (see AICompanyGateway). Defaults to None (no limits).
+            client_opts: options passed to every gateway created by the pool, such as the connection pool limits, keep-alive and timeouts
+        """
+        self.client_opts = client_opts
+        self.response_cache = ResponseCache(**response_cache_opts) if response_cache_opts is not None else None
+        self.rate_limits = rate_limits or {}
+        self.__gateways = {}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+
+    def get(self, company:str, api_key:str) -> AICompanyGateway:
+        """Gets the gateway for a company and api key, creating it the first time it is asked for
+
+        Args:
+            company (str): the name of the AI company
+            api_key (str): api key to the AI company's API
+
+        Returns:
+            AICompanyGateway: the shared gateway
+        """
+        key = self.get_key(company, api_key)
+        with self.__lock:
+            gateway = self.__gateways.get(key)
+            if gateway is not None:
+                self.__hits += 1
+                return gateway
+            self.__misses += 1
+            rate_limits = self.rate_limits.get(company, self.rate_limits.get('*'))
+            gateway = AICompanyGateway.factory(company=company, api_key=api_key, response_cache=self.response_cache, rate_limits=rate_limits, **self.client_opts)
+            self.__gateways[key] = gateway
+            return gateway
+
+
+    def get_key(self, company:str, api_key:str) -> Tuple[str, str]:
+        """Gets the cache key for a company and api key
+
+        The api key is hashed so that it doesn't show up in the pool statistics
+
+        Args:
+            company (str): the name of the AI company
+            api_key (str): api key to the AI company's API
+
+        Returns:
+            Tuple[str, str]: the company and a short hash of the api key
+        """
+        return company, hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the pool
+
+        Returns:
+            Dict: the cache hits and misses, the statistics (incl. rate limiter queue depths) of each gateway keyed by "<company>:<api key hash>", and the response cache statistics
+        """
+        with self.__lock:
+            gateways = dict(self.__gateways)
+            stats = {'hits': self.__hits, 'misses': self.__misses, 'gateways': {}}
+        for (company, key_hash), gateway in gateways.items():
+            stats['gateways'][f"{company}:{key_hash}"] = gateway.get_stats()
+        if self.response_cache is not None:
+            stats['response_cache'] = self.response_cache.stats()
+        return stats
+
+
+    def close(self) -> None:
+        """Closes every gateway in the pool and empties it"""
+        with self.__lock:
+            gateways = list(self.__gateways.values())
+            self.__gateways = {}
+        for gateway in gateways:
+            gateway.close()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool(**client_opts) -> GatewayPool:
+    """Gets the gateway pool shared by the whole process
+
+    The pool is created on the first call, so the client options of later calls are ignored
+
+    Args:
+        client_opts: options passed to every gateway created by the pool
+
+    Returns:
+        GatewayPool: the shared pool
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = GatewayPool(**client_opts)
+        return _shared_pool
\ No newline at end of file
@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+from typing import Dict, Generator
+
+from .gateway import AICompanyGateway
+from .cancellation import CancelToken
+from .telemetry import CallMetrics
+
+class HedgePolicy:
+    """Streams a message from a primary gateway, and hedges to a secondary gateway if the first token is late
+
+    If the primary hasn't sent its first token within the deadline (or fails before it), the same conversation is started on
+    the secondary. Whichever sends a token first wins and is streamed to the caller, and the other one is cancelled.
+    Each route is streamed in its own thread with its own CancelToken, so a cancelled route's HTTP stream is closed at once
+    """
+
+    routes = ('primary', 'secondary')
+
+    def __init__(self, first_token_deadline:float=8.0, failover_on_error:bool=True) -> None:
+        """Sets up the object
+
+        Args:
+            first_token_deadline (float, optional): seconds to wait for the primary's first token before starting the secondary. Defaults to 8.0.
+            failover_on_error (bool, optional): whether to start the secondary straight away if the primary fails before its first token. Defaults to True.
+        """
+        self.first_token_deadline = first_token_deadline
+        self.failover_on_error = failover_on_error
+
+        self.__lock = threading.Lock()
+        self.__stats = {'calls': 0, 'hedged': 0, 'failovers': 0, 'failed': 0, 'primary_wins': 0, 'secondary_wins': 0}
+
+
+    def stream_message(self, primary:AICompanyGateway, primary_request:Dict, secondary:AICompanyGateway, secondary_request:Dict, metrics:CallMetrics=None, cancel:CancelToken=None) -> Generator[str, None, None]:
+        """Streams a message from whichever route sends its first token first
+
+        The requests are passed separately since each AI company has its own message format, e.g. for attached documents
+
+        Args:
+            primary (AICompanyGateway): the gateway to the primary AI company
+            primary_request (Dict): the keyword arguments of stream_message for the primary (model, messages, max_tokens, ...)
+            secondary (AICompanyGateway): the gateway to the secondary AI company
+            secondary_request (Dict): the keyword arguments of stream_message for the secondary
+            metrics (CallMetrics, optional): the metrics of the hedged call. Its route is set to the route that won. Defaults to None.
+            cancel (CancelToken, optional): cancels every route of the call. Defaults to None.
+
+        Raises:
+            Exception: raises the error of the last route to fail if no route sends a token
+            StreamCancelled: if the call is cancelled
+
+        Yields:
+            Generator[str, None, None]: yields the messages sent by the winning AI
+        """
+        gateways = {'primary': (primary, primary_request), 'secondary': (secondary, secondary_request)}
+        events = queue.Queue()
+        cancels = {route: CancelToken() for route in self.routes}
+        route_metrics = {route: CallMetrics() for route in self.routes}
+        started = []
+        finished = []
+        winner = None
+        metrics = metrics or CallMetrics()
+        self.record('calls')
+
+        def _start(route:str) -> None:
+            gateway, request = gateways[route]
+            started.append(route)
+            thread = threading.Thread(target=self.pump, args=(route, gateway, request, route_metrics[route], cancels[route], events), daemon=True)
+            thread.start()
+
+        def _cancel_routes() -> None:
+            for route_cancel in cancels.values():
+                route_cancel.cancel(cancel.reason)
+
+        with metrics.start(primary.name, primary_request.get('model'), streamed=True):
+            handle = cancel.on_cancel(_cancel_routes) if cancel is not None else None
+            try:
+                _start('primary')
+                deadline = time.perf_counter() + self.first_token_deadline
+
+                # wait for the first token of either route
+                while winner is None:
+                    timeout = max(deadline - time.perf_counter(), 0) if 'secondary' not in started else None
+                    try:
+                        route, kind, value = events.get(timeout=timeout)
+                        if cancel is not None:
+                            # a route closed by the cancel mustn't fail over
+                            cancel.check()
+                    except queue.Empty:
+                        self.record('hedged')
+                        _start('secondary')
+                        continue
+
+                    if kind == 'chunk':
+                        if value:
+                            winner = route
+                            metrics.record_chunk()
+                            yield value
+                        continue
+
+                    finished.append(route)
+                    if kind == 'end':
+                        # the route finished without a token, i.e. an empty message
+                        winner = route
+                    elif route == 'primary' and 'secondary' not in started and self.failover_on_error:
+                        self.record('failovers')
+                        _start('secondary')
+                    elif len(finished) == len(started) and ('secondary' in started or not self.failover_on_error):
+                        self.record('failed')
+                        raise value
+
+                # cancel the losers, then stream the rest of the winner
+                for route in self.routes:
+                    if route != winner:
+                        cancels[route].cancel('hedge')
+                self.record(f"{winner}_wins")
+                while winner not in finished:
+                    route, kind, value = events.get()
+                    if route != winner:
+                        continue
+                    if kind == 'chunk':
+                        if value:
+                            metrics.record_chunk()
+                            yield value
+                    elif kind == 'end':
+                        finished.append(route)
+                    else:
+                        raise value
+            finally:
+                if cancel is not None:
+                    cancel.remove(handle)
+                for route in self.routes:
+                    cancels[route].cancel('hedge')
+                if winner is not None:
+                    won = route_metrics[winner]
+                    metrics.company, metrics.model = won.company, won.model
+                    metrics.record_usage(
+                        input_tokens=won.input_tokens,
+                        output_tokens=won.output_tokens,
+                        cache_read_tokens=won.cache_read_tokens,
+                        cache_write_tokens=won.cache_write_tokens,
+                        stop_reason=won.stop_reason,
+                        stop_signal=won.stop_signal
+                    )
+                metrics.route = winner
+
+
+    @staticmethod
+    def pump(route:str, gateway:AICompanyGateway, request:Dict, metrics:CallMetrics, cancel:CancelToken, events:queue.Queue) -> None:
+        """Streams a message from one route into the events queue until it ends or is cancelled. Runs in its own thread
+
+        Args:
+            route (str): the name of the route
+            gateway (AICompanyGateway): the gateway of the route
+            request (Dict): the keyword arguments of stream_message
+            metrics (CallMetrics): the metrics of the route's call
+            cancel (CancelToken): cancelled when the route lost the race, or when the hedged call is cancelled
+            events (queue.Queue): the queue of (route, kind, value) events, where kind is 'chunk', 'end' or 'error'
+        """
+        # gateways may add the system message to the messages, so each route gets its own list
+        request = {**request, 'messages': list(request['messages']), 'metrics': metrics, 'cancel': cancel}
+        stream = None
+        try:
+            stream = gateway.stream_message(**request)
+            for chunk in stream:
+                if cancel.is_cancelled():
+                    break
+                events.put((route, 'chunk', chunk))
+            events.put((route, 'end', None))
+        except Exception as e:
+            events.put((route, 'error', e))
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+    def record(self, key:str) -> None:
+        """Counts an event in the statistics
+
+        Args:
+            key (str): the name of the counter
+        """
+        with self.__lock:
+            self.__stats[key] += 1
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the policy
+
+        Returns:
+            Dict: the number of calls, of calls that were hedged or failed over to the secondary, of calls where every route failed, and the wins of each route
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+
+_shared_policy = None
+_shared_policy_lock = threading.Lock()
+
+
+def get_shared_hedge_policy(**policy_opts) -> HedgePolicy:
+    """Gets the hedge policy shared by the whole process, so that its statistics cover every session
+
+    The policy is created on the first call, so the options of later calls are ignored
+
+    Args:
+        policy_opts: options passed to the HedgePolicy
+
+    Returns:
+        HedgePolicy: the shared policy
+    """
+    global _shared_policy
+    with _shared_policy_lock:
+        if _shared_policy is None:
+            _shared_policy = HedgePolicy(**policy_opts)
+        return _shared_policy
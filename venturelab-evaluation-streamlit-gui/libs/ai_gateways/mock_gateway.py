@@ -0,0 +1,296 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import List, Dict, Generator, AsyncGenerator, Tuple
+
+from .gateway import AICompanyGateway
+from .local_gateway import LocalGateway
+from .stream_retry import resume_stream, aresume_stream
+from .stop_signals import watch_stop_signals, awatch_stop_signals
+
+@AICompanyGateway.register()
+class MockGateway (LocalGateway):
+    """Offline stand-in for an AI company with realistic streaming latency, for load and latency tests of the apps
+
+    Responses are canned or echoed, streamed word by word after a time to first token and at a set number of tokens per
+    second, with jitter. Errors can be injected before the first token or in the middle of a stream, and the closing
+    codes of the apps can be sent on demand. Set AI_COMPANY = "mock" in config.py to run an app without an API key
+    """
+    name = 'mock'
+
+    def setup_client(self, api_key:str, ttft:float=0.5, tokens_per_second:float=50.0, jitter:float=0.2, responses:List[str]=None, error_rate:float=0.0, mid_stream_error_rate:float=0.0, closing_code:str=None, closing_after_turns:int=None, seed:int=None, **kwargs) -> None:
+        """Sets up the mock
+
+        Args:
+            api_key (str): the api key. Not used
+            ttft (float, optional): seconds before the first token. Defaults to 0.5.
+            tokens_per_second (float, optional): the number of tokens streamed per second after the first one. Defaults to 50.0.
+            jitter (float, optional): the relative random variation of every delay, e.g. 0.2 for +/- 20%. Defaults to 0.2.
+            responses (List[str], optional): canned responses, picked by the number of user turns so far. Defaults to None (echo the last message).
+            error_rate (float, optional): the share of calls that fail with a connection error before the first token. Defaults to 0.0.
+            mid_stream_error_rate (float, optional): the share of streams that drop with a read error after some tokens. Defaults to 0.0.
+            closing_code (str, optional): the closing code to reply with, e.g. 'x7y8'. Defaults to None.
+            closing_after_turns (int, optional): the number of user turns after which the closing code is sent. Defaults to None (only when a user message contains the code).
+            seed (int, optional): the seed of the random delays and errors. Defaults to None.
+            kwargs: options of the LocalGateway, e.g. for batches. Connection pool options are ignored
+        """
+        super().setup_client(api_key, **{k: v for k, v in kwargs.items() if k in ('batch_dir', 'processing_delay', 'responder')})
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.responses = responses
+        self.error_rate = error_rate
+        self.mid_stream_error_rate = mid_stream_error_rate
+        self.closing_code = closing_code
+        self.closing_after_turns = closing_after_turns
+
+        self.__random = random.Random(seed)
+        self.__random_lock = threading.Lock()
+        if responses is not None:
+            self.responder = self.pick_response
+
+
+    def pick_response(self, request:Dict) -> str:
+        """Responder that picks a canned response by the number of user turns so far
+
+        Args:
+            request (Dict): the keyword arguments of the request
+
+        Returns:
+            str: the response
+        """
+        user_turns = sum(1 for msg in request['messages'] if msg['role'] == 'user')
+        return self.responses[(user_turns - 1) % len(self.responses)]
+
+
+    def get_response(self, request:Dict) -> str:
+        """Gets the response to a request, which is the closing code if it is due
+
+        A request that ends with a prefilled assistant turn (a resumed stream) gets the rest of the response
+
+        Args:
+            request (Dict): the keyword arguments of the request
+
+        Returns:
+            str: the response
+        """
+        messages = request['messages']
+        if messages and messages[-1]['role'] == 'assistant':
+            prefill = self.get_text(messages[-1]['content'])
+            response = self.get_response({**request, 'messages': messages[:-1]})
+            return response[len(prefill):] if response.startswith(prefill) else response
+        if self.closing_code is not None:
+            user_messages = [msg for msg in request['messages'] if msg['role'] == 'user']
+            last_user_message = self.get_text(user_messages[-1]['content']) if user_messages else ""
+            if self.closing_code in last_user_message:
+                return self.closing_code
+            if self.closing_after_turns is not None and len(user_messages) >= self.closing_after_turns:
+                return self.closing_code
+        return self.responder(request)
+
+
+    @staticmethod
+    def get_text(content:object) -> str:
+        """Gets the text of a message's content
+
+        Args:
+            content (object): the content, either a string or a list of blocks
+
+        Returns:
+            str: the text
+        """
+        if isinstance(content, list):
+            return " ".join(block.get('text', '') for block in content)
+        return content
+
+
+    def jittered(self, delay:float) -> float:
+        """Adds the jitter to a delay
+
+        Args:
+            delay (float): the delay in seconds
+
+        Returns:
+            float: the jittered delay
+        """
+        with self.__random_lock:
+            return max(delay * self.__random.uniform(1 - self.jitter, 1 + self.jitter), 0.0)
+
+
+    def should_fail(self, rate:float) -> bool:
+        """Draws whether an error is injected
+
+        Args:
+            rate (float): the probability of an error
+
+        Returns:
+            bool: True if the call should fail. False otherwise
+        """
+        if rate <= 0:
+            return False
+        with self.__random_lock:
+            return self.__random.random() < rate
+
+
+    def plan_stream(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Tuple[List[Tuple[float, str]], int]:
+        """Plans the tokens of a stream and the delay before each of them
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Raises:
+            Exception: raises a connection error if one is injected before the first token
+
+        Returns:
+            Tuple[List[Tuple[float, str]], int]: the (delay, token) pairs, and the index of the token the stream drops at (None if it doesn't)
+        """
+        import httpx
+        if self.should_fail(self.error_rate):
+            raise httpx.ConnectError("mock gateway: injected connection error")
+
+        msg = self.get_response({'model': model, 'messages': messages, 'max_tokens': max_tokens, 'system_message': system_message, **kwargs})
+        tokens = re.findall(r"\s*\S+", msg)[:max_tokens] or [""]
+        plan = [(self.jittered(self.ttft), tokens[0])]
+        plan += [(self.jittered(1 / self.tokens_per_second), token) for token in tokens[1:]]
+
+        drop_at = None
+        if len(tokens) > 1 and self.should_fail(self.mid_stream_error_rate):
+            with self.__random_lock:
+                drop_at = self.__random.randint(1, len(tokens) - 1)
+        return plan, drop_at
+
+
+    def record_mock_usage(self, messages:List[Dict], system_message:str, tokens:int, metrics:'CallMetrics') -> None:
+        """Records estimated usage (about 4 characters per token) as if the API had reported it
+
+        Args:
+            messages (List[Dict]): a list of messages of the conversation so far
+            system_message (str): a system message, if any
+            tokens (int): the number of tokens sent
+            metrics (CallMetrics): the metrics of the call
+        """
+        input_tokens = (len(system_message or "") + sum(len(self.get_text(msg['content'])) for msg in messages)) // 4
+        self.record_usage(input_tokens=input_tokens)
+        metrics.record_usage(input_tokens=input_tokens, output_tokens=tokens, cache_read_tokens=0, cache_write_tokens=0, stop_reason='end_turn')
+
+
+    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Returns the mock's message after the time it would take to generate it
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            str: the messsage from the mock
+        """
+        kwargs.pop('cache_key', None)
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics:
+            plan, _ = self.plan_stream(model, messages, max_tokens, system_message, **kwargs)
+            time.sleep(sum(delay for delay, _ in plan))
+            self.record_mock_usage(messages, system_message, len(plan), metrics)
+        return "".join(token for _, token in plan)
+
+
+    @watch_stop_signals
+    @resume_stream
+    def stream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Generator[str, None, None]:
+        """Streams the mock's message token by token at the configured speed
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Yields:
+            Generator[str, None, None]: yields the message from the mock
+        """
+        import httpx
+        kwargs.pop('cache_key', None)
+        cancel = kwargs.pop('cancel', None)
+        with self.limit_rate(model, messages, max_tokens, system_message), self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics, self.close_on_cancel(cancel):
+            plan, drop_at = self.plan_stream(model, messages, max_tokens, system_message, **kwargs)
+            for i, (delay, token) in enumerate(plan):
+                if i == drop_at:
+                    raise httpx.ReadError("mock gateway: injected dropped stream")
+                if cancel is not None:
+                    # there is no response to close, so the wait ends as soon as the call is cancelled
+                    cancel.sleep(delay)
+                else:
+                    time.sleep(delay)
+                metrics.record_chunk()
+                yield token
+            self.record_mock_usage(messages, system_message, len(plan), metrics)
+
+
+    async def acreate_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str:
+        """Returns the mock's message after the time it would take to generate it, without blocking the event loop
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Returns:
+            str: the messsage from the mock
+        """
+        kwargs.pop('cache_key', None)
+        async with self.alimit_rate(model, messages, max_tokens, system_message):
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics:
+                plan, _ = self.plan_stream(model, messages, max_tokens, system_message, **kwargs)
+                await asyncio.sleep(sum(delay for delay, _ in plan))
+                self.record_mock_usage(messages, system_message, len(plan), metrics)
+        return "".join(token for _, token in plan)
+
+
+    @staticmethod
+    async def aplay_stream(plan:List[Tuple[float, str]], drop_at:int) -> AsyncGenerator[str, None]:
+        """Plays the tokens of a planned stream at their delays, without blocking the event loop
+
+        Args:
+            plan (List[Tuple[float, str]]): the delay before each token and the token (see plan_stream)
+            drop_at (int): the index of the token at which the stream drops, None if it doesn't
+
+        Yields:
+            AsyncGenerator[str, None]: the tokens
+        """
+        import httpx
+        for i, (delay, token) in enumerate(plan):
+            if i == drop_at:
+                raise httpx.ReadError("mock gateway: injected dropped stream")
+            await asyncio.sleep(delay)
+            yield token
+
+
+    @awatch_stop_signals
+    @aresume_stream
+    async def astream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]:
+        """Streams the mock's message token by token at the configured speed, without blocking the event loop
+
+        Args:
+            model (str): the name of the model
+            messages (List[Dict]): a list of messages of the conversation so far
+            max_tokens (int): the max number of tokens that can be generated in the chat completion
+            system_message (str): a system message, if any. Defaults to None.
+
+        Yields:
+            AsyncGenerator[str, None]: yields the message from the mock
+        """
+        kwargs.pop('cache_key', None)
+        cancel = kwargs.pop('cancel', None)
+        async with self.alimit_rate(model, messages, max_tokens, system_message):
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics:
+                plan, drop_at = self.plan_stream(model, messages, max_tokens, system_message, **kwargs)
+                async for token in self.aiter_until_cancelled(self.aplay_stream(plan, drop_at), cancel):
+                    metrics.record_chunk()
+                    yield token
+                self.record_mock_usage(messages, system_message, len(plan), metrics)
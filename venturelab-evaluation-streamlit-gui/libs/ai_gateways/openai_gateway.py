@@ -1,31 +1,86 @@
-import openai 
-from typing import List, Dict, Generator 
+import asyncio 
+import json 
+import threading 
+from typing import List, Dict, Generator, AsyncGenerator 
 
 from .gateway import AICompanyGateway
+from .response_cache import cache_response, acache_response
+from .telemetry import CallMetrics
+from .attachments import Attachment
+from .stream_retry import resume_stream, aresume_stream
+from .stop_signals import watch_stop_signals, awatch_stop_signals
 
+@AICompanyGateway.register()
 class OpenAIGateway (AICompanyGateway): 
     name = 'openai' 
 
-    def setup_client(self, api_key:str) -> None: 
+    def setup_client(self, api_key:str, timeout:float=600.0, connect_timeout:float=10.0, max_retries:int=2, **pool_opts) -> None: 
         """Sets up the client to the AI company SDK 
 
+        The client is thread-safe and keeps its connections alive, so one gateway can be shared by every session 
+
         Args:
             api_key (str): the api key 
+            timeout (float, optional): seconds to wait on a read, write or pool checkout. Defaults to 600.0.
+            connect_timeout (float, optional): seconds to wait while opening a new connection. Defaults to 10.0.
+            max_retries (int, optional): number of retries done by the SDK. Defaults to 2.
+            pool_opts: the connection pool limits (see build_http_client) 
         """
-        self.__client = openai.OpenAI(api_key=api_key) 
+        self.__client_opts = {
+            'api_key': api_key, 
+            'timeout': self.build_timeout(timeout, connect_timeout), 
+            'max_retries': max_retries 
+        }
+        self.__pool_opts = pool_opts 
+        # the SDK is only imported once a gateway to the AI company is created 
+        import openai 
+        self.__http_client = self.build_http_client(openai.DefaultHttpxClient, **pool_opts) 
+        self.__client = openai.OpenAI(http_client=self.__http_client, **self.__client_opts) 
 
+        # the async client is created lazily because its connections belong to the event loop that uses it 
+        self.__async_client = None 
+        self.__async_client_loop = None 
+        self.__async_client_lock = threading.Lock() 
 
-    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
-        """Returns a message from the API. Overriden by subclass 
 
-        Args:
-            model (str): the name of the model 
-            messages (List[Dict]): a list of messages of the conversation so far 
-            max_tokens (int): the max number of tokens that can be generated in the chat completion 
-            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+    def get_async_client(self) -> 'openai.AsyncOpenAI': 
+        """Gets the async client for the running event loop, creating it if the loop changed 
 
         Returns:
-            str: the messsage sent by the API 
+            openai.AsyncOpenAI: the async client 
+        """
+        import openai 
+        loop = asyncio.get_running_loop() 
+        with self.__async_client_lock: 
+            if self.__async_client is None or self.__async_client_loop is not loop: 
+                self.__async_client = openai.AsyncOpenAI(
+                    http_client=self.build_http_client(openai.DefaultAsyncHttpxClient, **self.__pool_opts), 
+                    **self.__client_opts 
+                ) 
+                self.__async_client_loop = loop 
+            return self.__async_client 
+
+
+    def get_connection_stats(self) -> Dict: 
+        """Gets the statistics of the connection pool 
+
+        Returns:
+            Dict: the number of open and idle connections 
+        """
+        return self.read_connection_stats(self.__http_client) 
+
+
+    def close(self) -> None: 
+        """Closes the SDK client and its connection pool"""
+        self.__client.close() 
+
+
+    def add_system_message(self, messages:List[Dict], system_message:str) -> None: 
+        """Adds the system message to the start of the conversation 
+
+        Args:
+            messages (List[Dict]): messages in the conversation so far 
+            system_message (str): a system message, if any 
         """
         def _check_for_system_message(messages:List[Dict]) -> bool: 
             """Checks to see if there is a system message already in the conversation 
@@ -43,15 +98,134 @@ class OpenAIGateway (AICompanyGateway):
         if system_message and not _check_for_system_message(messages): 
             # add system message without overriding existing system message 
             messages.insert(0, {"role": "system", "content": system_message})
-        msg = self.__client.chat.completions.create(
-            model=model, 
-            messages=messages, 
-            max_completion_tokens=max_tokens, 
-            **kwargs 
-        ) 
+
+
+    def upload_file(self, attachment:Attachment) -> str: 
+        """Uploads a document through the Files API 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            str: the id of the uploaded file 
+        """
+        with self.track_request(): 
+            file = self.__client.files.create(file=(attachment.name, attachment.get_bytes(), attachment.media_type), purpose='user_data') 
+        return file.id 
+
+
+    def get_attachment_blocks(self, attachment:Attachment) -> List[Dict]: 
+        """Gets the content parts that attach a document to a message, by file id once it has been uploaded 
+
+        If the upload fails, the extracted text of the document is sent instead 
+
+        Args:
+            attachment (Attachment): the document 
+
+        Returns:
+            List[Dict]: the content parts 
+        """
+        file_id = self.get_file_id(attachment) 
+        if file_id is None: 
+            return super().get_attachment_blocks(attachment) 
+        return [{'type': 'file', 'file': {'file_id': file_id}}] 
+
+
+    def add_cache_key(self, kwargs:Dict) -> None: 
+        """Turns the cache_key option into the prompt_cache_key hint, so that requests sharing a prefix are routed to the same prompt cache 
+
+        Args:
+            kwargs (Dict): the keyword arguments of the request 
+        """
+        cache_key = kwargs.pop('cache_key', None) 
+        if cache_key: 
+            # sent through extra_body since older SDK versions don't have the parameter 
+            kwargs['extra_body'] = {**kwargs.get('extra_body', {}), 'prompt_cache_key': cache_key} 
+
+
+    def is_retryable(self, error:Exception) -> bool: 
+        """Checks if an error is a connection-level failure or a server error, which are worth retrying 
+
+        Args:
+            error (Exception): the error 
+
+        Returns:
+            bool: True if the request can be retried. False otherwise 
+        """
+        import openai 
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)): 
+            return True 
+        return super().is_retryable(error) 
+
+
+    def get_resume_messages(self, messages:List[Dict], partial:str) -> List[Dict]: 
+        """Gets the messages that make the AI continue a message from the partial text it streamed before failing 
+
+        Chat completions don't continue a trailing assistant message, so the partial text is sent as the assistant's turn 
+        followed by an instruction to carry on from where it stopped 
+
+        Args:
+            messages (List[Dict]): a list of messages of the conversation so far 
+            partial (str): the text streamed so far 
+
+        Returns:
+            List[Dict]: the messages to send 
+        """
+        return list(messages) + [
+            {'role': 'assistant', 'content': partial.rstrip()}, 
+            {'role': 'user', 'content': 'Your last message was cut off. Continue it from exactly where it stopped, without repeating any of it or adding anything before it.'} 
+        ]
+
+
+    def record_completion_usage(self, usage:'openai.types.CompletionUsage', metrics:CallMetrics) -> None: 
+        """Records the usage of a chat completion in the gateway's statistics and in the call's metrics 
+
+        Args:
+            usage (openai.types.CompletionUsage): the usage of the chat completion 
+            metrics (CallMetrics): the metrics of the call 
+        """
+        if usage is None: 
+            return 
+        details = usage.prompt_tokens_details 
+        cached_tokens = (details.cached_tokens or 0) if details else 0 
+        self.record_usage(input_tokens=usage.prompt_tokens - cached_tokens, cache_read_tokens=cached_tokens) 
+        metrics.record_usage(
+            input_tokens=usage.prompt_tokens - cached_tokens, 
+            output_tokens=usage.completion_tokens, 
+            cache_read_tokens=cached_tokens, 
+            cache_write_tokens=0 
+        )
+
+
+    @cache_response
+    def create_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
+        """Returns a message from the API. Overriden by subclass 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            str: the messsage sent by the API 
+        """
+        self.add_system_message(messages, system_message) 
+        self.add_cache_key(kwargs) 
+        with self.limit_rate(model, messages, max_tokens), self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics: 
+            msg = self.__client.chat.completions.create(
+                model=model, 
+                messages=messages, 
+                max_completion_tokens=max_tokens, 
+                **kwargs 
+            ) 
+            self.record_completion_usage(msg.usage, metrics) 
+            metrics.record_usage(stop_reason=msg.choices[0].finish_reason) 
         return msg.choices[0].message.content 
 
 
+    @watch_stop_signals
+    @resume_stream
     def stream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Generator[str, None, None]: 
         """Streams a message from the API. Overriden by subclass 
 
@@ -64,28 +238,191 @@ class OpenAIGateway (AICompanyGateway):
         Yields:
             Generator[str, None, None]: yields the messages sent by the AI 
         """
-        def _check_for_system_message(messages:List[Dict]) -> bool: 
-            """Checks to see if there is a system message already in the conversation 
-
-            Args:
-                messages (List[Dict]): messages in the conversation so far 
-
-            Returns:
-                bool: True if a system message exists already. False otherwise 
-            """
-            for msg in messages: 
-                if msg['role'] == 'system': 
-                    return True 
-            return False 
-        if system_message and not _check_for_system_message(messages): 
-            # add system message without overriding existing system message 
-            messages.insert(0, {"role": "system", "content": system_message})
-        with self.__client.chat.completions.create(
+        self.add_system_message(messages, system_message) 
+        cancel = kwargs.pop('cancel', None) 
+        self.add_cache_key(kwargs) 
+        with self.limit_rate(model, messages, max_tokens), self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics, self.__client.chat.completions.create(
             model=model, 
             messages=messages, 
             max_completion_tokens=max_tokens, 
             stream=True, 
+            stream_options={'include_usage': True}, 
             **kwargs 
-        ) as stream: 
+        ) as stream, self.close_on_cancel(cancel, stream): 
             for chunk in stream: 
-                yield chunk.choices[0].delta.content 
\ No newline at end of file
+                if chunk.usage: 
+                    # the last chunk has the usage and no choices 
+                    self.record_completion_usage(chunk.usage, metrics) 
+                if chunk.choices: 
+                    choice = chunk.choices[0] 
+                    if choice.delta.content: 
+                        metrics.record_chunk() 
+                    metrics.record_usage(stop_reason=choice.finish_reason) 
+                    yield choice.delta.content 
+
+
+    def build_batch_request(self, custom_id:str, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Dict: 
+        """Builds one line of a Batch API input file 
+
+        Args:
+            custom_id (str): the id that the batch results are keyed by 
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            Dict: the batch request 
+        """
+        messages = list(messages) 
+        self.add_system_message(messages, system_message) 
+        # the batch file has the raw request body, so the cache key goes in as is 
+        if kwargs.get('cache_key'): 
+            kwargs['prompt_cache_key'] = kwargs['cache_key'] 
+        kwargs.pop('cache_key', None) 
+        return {
+            'custom_id': custom_id, 
+            'method': 'POST', 
+            'url': '/v1/chat/completions', 
+            'body': {
+                'model': model, 
+                'messages': messages, 
+                'max_completion_tokens': max_tokens, 
+                **kwargs 
+            }
+        }
+
+
+    def submit_batch(self, batch_requests:List[Dict]) -> str: 
+        """Uploads the batch requests as a JSONL file and creates a batch from it 
+
+        Args:
+            batch_requests (List[Dict]): the batch requests 
+
+        Returns:
+            str: the id of the batch 
+        """
+        content = "\n".join(json.dumps(request) for request in batch_requests).encode('utf-8') 
+        with self.track_request(): 
+            batch_file = self.__client.files.create(file=('batch.jsonl', content), purpose='batch') 
+        with self.track_request(): 
+            batch = self.__client.batches.create(
+                input_file_id=batch_file.id, 
+                endpoint='/v1/chat/completions', 
+                completion_window='24h' 
+            ) 
+        return batch.id 
+
+
+    def get_batch_status(self, batch_id:str) -> str: 
+        """Gets the status of a batch 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            str: 'in_progress', 'completed' or 'failed' 
+        """
+        with self.track_request(): 
+            batch = self.__client.batches.retrieve(batch_id) 
+        if batch.status == 'completed': 
+            return 'completed' 
+        if batch.status in ('failed', 'expired', 'cancelling', 'cancelled'): 
+            return 'failed' 
+        return 'in_progress' 
+
+
+    def get_batch_results(self, batch_id:str) -> Dict[str, Dict]: 
+        """Downloads the output and error files of a completed batch 
+
+        Args:
+            batch_id (str): the id of the batch 
+
+        Returns:
+            Dict[str, Dict]: maps the custom id of each request to {'content': [the message or None], 'error': [the error or None]} 
+        """
+        with self.track_request(): 
+            batch = self.__client.batches.retrieve(batch_id) 
+        results = {} 
+        for file_id in [batch.output_file_id, batch.error_file_id]: 
+            if not file_id: 
+                continue 
+            with self.track_request(): 
+                content = self.__client.files.content(file_id).text 
+            for line in content.splitlines(): 
+                if not line.strip(): 
+                    continue 
+                row = json.loads(line) 
+                response = row.get('response') or {} 
+                if row.get('error') or response.get('status_code') != 200: 
+                    results[row['custom_id']] = {'content': None, 'error': str(row.get('error') or response.get('body'))} 
+                else: 
+                    results[row['custom_id']] = {'content': response['body']['choices'][0]['message']['content'], 'error': None} 
+        return results 
+
+
+    @acache_response
+    async def acreate_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> str: 
+        """Returns a message from the API without blocking the event loop 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Returns:
+            str: the messsage sent by the API 
+        """
+        self.add_system_message(messages, system_message) 
+        self.add_cache_key(kwargs) 
+        async with self.alimit_rate(model, messages, max_tokens): 
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=False) as metrics: 
+                msg = await self.get_async_client().chat.completions.create(
+                    model=model, 
+                    messages=messages, 
+                    max_completion_tokens=max_tokens, 
+                    **kwargs 
+                ) 
+                self.record_completion_usage(msg.usage, metrics) 
+                metrics.record_usage(stop_reason=msg.choices[0].finish_reason) 
+        return msg.choices[0].message.content 
+
+
+    @awatch_stop_signals
+    @aresume_stream
+    async def astream_message(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]: 
+        """Streams a message from the API without blocking the event loop 
+
+        Args:
+            model (str): the name of the model 
+            messages (List[Dict]): a list of messages of the conversation so far 
+            max_tokens (int): the max number of tokens that can be generated in the chat completion 
+            system_message (str): a system message, if any. The system message can also be included in the messages param. Defaults to None.
+
+        Yields:
+            AsyncGenerator[str, None]: yields the messages sent by the AI 
+        """
+        self.add_system_message(messages, system_message) 
+        self.add_cache_key(kwargs) 
+        cancel = kwargs.pop('cancel', None) 
+        async with self.alimit_rate(model, messages, max_tokens): 
+            with self.track_request(), self.start_metrics(model, kwargs, streamed=True) as metrics: 
+                stream = await self.get_async_client().chat.completions.create(
+                    model=model, 
+                    messages=messages, 
+                    max_completion_tokens=max_tokens, 
+                    stream=True, 
+                    stream_options={'include_usage': True}, 
+                    **kwargs 
+                ) 
+                async with stream: 
+                    async for chunk in self.aiter_until_cancelled(stream, cancel): 
+                        if chunk.usage: 
+                            self.record_completion_usage(chunk.usage, metrics) 
+                        if chunk.choices: 
+                            choice = chunk.choices[0] 
+                            if choice.delta.content: 
+                                metrics.record_chunk() 
+                            metrics.record_usage(stop_reason=choice.finish_reason) 
+                            yield choice.delta.content 
\ No newline at end of file
@@ -0,0 +1,131 @@
+import asyncio
+import functools
+import random
+import time
+from typing import AsyncGenerator, Callable, Dict, Generator, List
+
+from .telemetry import CallMetrics
+
+def get_retry_delay(attempt:int, backoff:float) -> float:
+    """Gets the jittered exponential backoff before a retry
+
+    Args:
+        attempt (int): the number of the retry, starting at 1
+        backoff (float): seconds to wait before the first retry, doubled for each retry after it
+
+    Returns:
+        float: the seconds to wait
+    """
+    return backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+def get_resume_request(gateway:'AICompanyGateway', messages:List[Dict], max_tokens:int, partial:str) -> Dict:
+    """Gets the messages and max tokens of the request that continues a stream that died after some text
+
+    Args:
+        gateway (AICompanyGateway): the gateway that streamed the text
+        messages (List[Dict]): the messages of the original request
+        max_tokens (int): the max tokens of the original request
+        partial (str): the text streamed so far
+
+    Returns:
+        Dict: the 'messages' and 'max_tokens' of the continuation request
+    """
+    if not partial.strip():
+        return {'messages': messages, 'max_tokens': max_tokens}
+    # the streamed text counts against max_tokens (about 4 characters per token)
+    return {
+        'messages': gateway.get_resume_messages(messages, partial),
+        'max_tokens': max(max_tokens - len(partial) // 4, 16)
+    }
+
+
+def resume_stream(stream_message:Callable) -> Callable:
+    """Decorator that retries AICompanyGateway.stream_message on connection-level failures, with jittered backoff
+
+    If the stream dies after some text was streamed, the retry continues from that text (see AICompanyGateway.get_resume_messages)
+    so that only the missing tail is generated again, and the caller gets one uninterrupted stream
+
+    Args:
+        stream_message (Callable): the gateway's stream_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(stream_message)
+    def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> Generator[str, None, None]:
+        # the attempts share the metrics of the call, which call their callbacks once, when the last attempt is done
+        metrics = kwargs['metrics'] = kwargs.get('metrics') or CallMetrics()
+        metrics.begin_attempts()
+        partial = ""
+        attempt = 0
+        try:
+            while True:
+                request = get_resume_request(self, messages, max_tokens, partial)
+                # the whitespace at the end of the partial text isn't sent back, so it mustn't be streamed twice
+                skip_whitespace = partial != partial.rstrip()
+                attempt_start = len(partial)
+                try:
+                    for chunk in stream_message(self, model, list(request['messages']), request['max_tokens'], system_message, **kwargs):
+                        if chunk and skip_whitespace:
+                            chunk = chunk.lstrip()
+                            skip_whitespace = not chunk
+                        if chunk:
+                            partial += chunk
+                        yield chunk
+                    return
+                except Exception as e:
+                    if attempt >= self.stream_retries or not self.is_retryable(e):
+                        raise
+                    attempt += 1
+                    metrics.retries += 1
+                    # the text of the failed attempt is kept, so its tokens count in the output of the call
+                    metrics.next_attempt(written_tokens=len(partial[attempt_start:]) // 4)
+                    time.sleep(get_retry_delay(attempt, self.stream_retry_backoff))
+        finally:
+            metrics.end_attempts()
+    return wrapper
+
+
+def aresume_stream(astream_message:Callable) -> Callable:
+    """Decorator that retries AICompanyGateway.astream_message on connection-level failures, with jittered backoff
+
+    Works like resume_stream, without blocking the event loop while waiting
+
+    Args:
+        astream_message (Callable): the gateway's astream_message method
+
+    Returns:
+        Callable: the wrapped method
+    """
+    @functools.wraps(astream_message)
+    async def wrapper(self, model:str, messages:List[Dict], max_tokens:int, system_message:str=None, **kwargs) -> AsyncGenerator[str, None]:
+        # the attempts share the metrics of the call, which call their callbacks once, when the last attempt is done
+        metrics = kwargs['metrics'] = kwargs.get('metrics') or CallMetrics()
+        metrics.begin_attempts()
+        partial = ""
+        attempt = 0
+        try:
+            while True:
+                request = get_resume_request(self, messages, max_tokens, partial)
+                skip_whitespace = partial != partial.rstrip()
+                attempt_start = len(partial)
+                try:
+                    async for chunk in astream_message(self, model, list(request['messages']), request['max_tokens'], system_message, **kwargs):
+                        if chunk and skip_whitespace:
+                            chunk = chunk.lstrip()
+                            skip_whitespace = not chunk
+                        if chunk:
+                            partial += chunk
+                        yield chunk
+                    return
+                except Exception as e:
+                    if attempt >= self.stream_retries or not self.is_retryable(e):
+                        raise
+                    attempt += 1
+                    metrics.retries += 1
+                    metrics.next_attempt(written_tokens=len(partial[attempt_start:]) // 4)
+                    await asyncio.sleep(get_retry_delay(attempt, self.stream_retry_backoff))
+        finally:
+            metrics.end_attempts()
+    return wrapper
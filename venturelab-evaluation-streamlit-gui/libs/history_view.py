@@ -0,0 +1,84 @@
+import collections
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+class HistoryView:
+    """Splits the message history into the most recent messages, which are rendered in full, and pages of older messages,
+    which are collapsed and only rendered when opened
+
+    Only full pages are made, and the messages left over stay with the recent ones, so a page keeps its messages and its
+    label as the conversation grows. Streamlit tells widgets apart by their label too, even with a key, so a page whose
+    label changed would close. What a page needs to know about a message (its word count and preview) is computed once per
+    message content and cached by its hash, so the cost of a rerun doesn't grow with the length of the transcript
+    """
+
+    # the blocks of the messages seen by this process, by hash of their content, least recently used first
+    __blocks = collections.OrderedDict()
+    __blocks_lock = threading.Lock()
+    max_cached_blocks = 4096
+
+    def __init__(self, recent_messages:int=12, page_size:int=10, preview_chars:int=80) -> None:
+        """Sets up the object
+
+        Args:
+            recent_messages (int, optional): the number of most recent messages rendered in full. Defaults to 12.
+            page_size (int, optional): the number of older messages per collapsed page. Defaults to 10.
+            preview_chars (int, optional): the length of the preview of a page's first message in its label. Defaults to 80.
+        """
+        self.recent_messages = recent_messages
+        self.page_size = page_size
+        self.preview_chars = preview_chars
+
+
+    def get_block(self, content:str) -> Dict:
+        """Gets the cached block of a message, making it the first time its content is seen
+
+        Args:
+            content (str): the content of the message
+
+        Returns:
+            Dict: the hash, word count and one-line preview of the message
+        """
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        cls = type(self)
+        with cls.__blocks_lock:
+            block = cls.__blocks.get(content_hash)
+            if block is not None:
+                cls.__blocks.move_to_end(content_hash)
+                return block
+
+        preview = " ".join(content.split())
+        if len(preview) > self.preview_chars:
+            preview = preview[:self.preview_chars].rsplit(" ", 1)[0] + "…"
+        block = {'hash': content_hash, 'words': len(content.split()), 'preview': preview}
+        with cls.__blocks_lock:
+            cls.__blocks[content_hash] = block
+            while len(cls.__blocks) > cls.max_cached_blocks:
+                cls.__blocks.popitem(last=False)
+        return block
+
+
+    def get_pages(self, transcript_history:List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Splits the history into pages of older messages and the recent messages
+
+        Args:
+            transcript_history (List[Dict]): the transcript history of the conversation so far
+
+        Returns:
+            Tuple[List[Dict], List[Dict]]: the pages, each with its 'key', 'label' and 'rows', and the recent messages (the last
+                recent_messages, plus the older ones that don't fill a page yet)
+        """
+        older = max(len(transcript_history) - self.recent_messages, 0)
+        split = older - older % self.page_size
+        pages = []
+        for start in range(0, split, self.page_size):
+            rows = transcript_history[start:start + self.page_size]
+            blocks = [self.get_block(row['content']) for row in rows]
+            words = sum(block['words'] for block in blocks)
+            pages.append({
+                'key': f"history_page_{start}",
+                'label': f"Messages {start + 1}–{start + len(rows)} ({words:,} words): {blocks[0]['preview']}",
+                'rows': rows
+            })
+        return pages, transcript_history[split:]
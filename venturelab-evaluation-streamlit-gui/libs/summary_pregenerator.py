@@ -0,0 +1,125 @@
+import concurrent.futures
+import hashlib
+import json
+import threading
+from typing import Callable, Dict
+
+class SummaryPregenerator:
+    """Generates the summary document of a session in the background, ahead of the "Generate" button
+
+    Every job is keyed by the hash of the request it generates the summary from, so a document is only served while the
+    transcript it was generated from is still the current one. A newer transcript replaces the older jobs of the session
+    """
+
+    # one pool of workers for every session of the process, so that pre-generation can't flood the API
+    __executor = None
+    __executor_lock = threading.Lock()
+
+    def __init__(self, max_workers:int=2) -> None:
+        """Sets up the object
+
+        Args:
+            max_workers (int, optional): the number of summaries generated at the same time by the process, set by the first session. Defaults to 2.
+        """
+        self.max_workers = max_workers
+        self.__lock = threading.Lock()
+        self.__transcript_hash = None
+        self.__future = None
+        self.__stats = {'submitted': 0, 'superseded': 0, 'hits': 0, 'misses': 0, 'failed': 0}
+
+
+    @staticmethod
+    def get_transcript_hash(request:Dict) -> str:
+        """Gets the hash of the request a summary is generated from
+
+        Args:
+            request (Dict): the keyword arguments of create_message for the summary
+
+        Returns:
+            str: the hash
+        """
+        data = json.dumps({k: v for k, v in request.items() if k not in ('metrics', 'cache_key')}, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Gets the pool of workers shared by every session, creating it the first time
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: the pool of workers
+        """
+        with SummaryPregenerator.__executor_lock:
+            if SummaryPregenerator.__executor is None:
+                SummaryPregenerator.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='summary')
+            return SummaryPregenerator.__executor
+
+
+    def submit(self, transcript_hash:str, generate:Callable[[], bytes]) -> None:
+        """Starts generating the summary of a transcript in the background, unless it is already generated or being generated
+
+        Args:
+            transcript_hash (str): the hash of the summary request (see get_transcript_hash)
+            generate (Callable[[], bytes]): the function that generates the document. It runs in a worker thread, so it can't use the session state
+        """
+        with self.__lock:
+            if transcript_hash == self.__transcript_hash:
+                return
+            if self.__future is not None:
+                # a job that hasn't started yet is dropped, a running one finishes but is never served
+                self.__future.cancel()
+                self.__stats['superseded'] += 1
+            self.__transcript_hash = transcript_hash
+            self.__future = self.get_executor().submit(generate)
+            self.__stats['submitted'] += 1
+
+
+    def get(self, transcript_hash:str, timeout:float=None) -> bytes:
+        """Gets the pre-generated document of a transcript, waiting for it if it is still being generated
+
+        Args:
+            transcript_hash (str): the hash of the summary request (see get_transcript_hash)
+            timeout (float, optional): the max seconds to wait for a running job. Defaults to None (wait until it is done).
+
+        Returns:
+            bytes: the document, or None if there is no job for this transcript, it failed or it didn't finish within the timeout
+        """
+        with self.__lock:
+            future = self.__future if transcript_hash == self.__transcript_hash else None
+        if future is None or future.cancelled():
+            self.record('misses')
+            return None
+        try:
+            document = future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # still running, it can be served later
+            self.record('misses')
+            return None
+        except Exception:
+            self.record('failed')
+            with self.__lock:
+                # the next turn or the button tries again
+                if self.__future is future:
+                    self.__transcript_hash, self.__future = None, None
+            return None
+        self.record('hits')
+        return document
+
+
+    def record(self, stat:str) -> None:
+        """Counts an event in the statistics
+
+        Args:
+            stat (str): the name of the event
+        """
+        with self.__lock:
+            self.__stats[stat] += 1
+
+
+    def stats(self) -> Dict:
+        """Gets the statistics of the pre-generation
+
+        Returns:
+            Dict: the number of jobs submitted and superseded by a newer transcript, of documents served (hits), of requests with no job for their transcript (misses) and of failed jobs
+        """
+        with self.__lock:
+            return dict(self.__stats)